@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 import time
-import smbus
-import subprocess
+import i2c_bus
+from hd44780 import PCF8574Transport, TRANSPORT_BLOCK, initialize
 
 
 class CharLCD2004(object):
-    def __init__(self):
+    def __init__(self, transport=TRANSPORT_BLOCK):
         # Note you need to change the bus number to 0 if running on a revision 1 Raspberry Pi.
-        self.bus = smbus.SMBus(1)
+        self.bus = i2c_bus.get_smbus(1)
+        # Shared with every other device on the bus, held around each transfer
+        self.lock = i2c_bus.smbus_lock(1)
+        self.transport = PCF8574Transport(self.bus, transport)
         self.BLEN = 1  # turn on/off background light
         self.PCF8574_address = 0x27  # I2C address of the PCF8574 chip.
         self.PCF8574A_address = 0x3f  # I2C address of the PCF8574A chip.
@@ -22,72 +25,32 @@ class CharLCD2004(object):
             temp |= 0x08
         else:
             temp &= 0xF7
-        self.bus.write_byte(addr, temp)
+        with self.lock:
+            self.bus.write_byte(addr, temp)
 
     def send_command(self, comm):
-        # Send bit7-4 firstly
-        buf = comm & 0xF0
-        buf |= 0x04  # RS = 0, RW = 0, EN = 1
-        self.write_word(self.LCD_ADDR, buf)
-        time.sleep(0.002)
-        buf &= 0xFB  # Make EN = 0
-        self.write_word(self.LCD_ADDR, buf)
-        # Send bit3-0 secondly
-        buf = (comm & 0x0F) << 4
-        buf |= 0x04  # RS = 0, RW = 0, EN = 1
-        self.write_word(self.LCD_ADDR, buf)
-        time.sleep(0.002)
-        buf &= 0xFB  # Make EN = 0
-        self.write_word(self.LCD_ADDR, buf)
+        with self.lock:
+            self.transport.command(self.LCD_ADDR, comm, self.BLEN == 1)
 
     def send_data(self, data):
-        # Send bit7-4 firstly
-        buf = data & 0xF0
-        buf |= 0x05  # RS = 1, RW = 0, EN = 1
-        self.write_word(self.LCD_ADDR, buf)
-        time.sleep(0.002)
-        buf &= 0xFB  # Make EN = 0
-        self.write_word(self.LCD_ADDR, buf)
-        # Send bit3-0 secondly
-        buf = (data & 0x0F) << 4
-        buf |= 0x05  # RS = 1, RW = 0, EN = 1
-        self.write_word(self.LCD_ADDR, buf)
-        time.sleep(0.002)
-        buf &= 0xFB  # Make EN = 0
-        self.write_word(self.LCD_ADDR, buf)
-
-    def i2c_scan(self):
-        cmd = "i2cdetect -y 1 |awk \'NR>1 {$1=\"\";print}\'"
-        result = subprocess.check_output(cmd, shell=True).decode()
-        result = result.replace("\n", "").replace(" --", "")
-        i2c_list = result.split(' ')
-        return i2c_list
+        with self.lock:
+            self.transport.send(self.LCD_ADDR, [(data, True)], self.BLEN == 1)
 
     def init_lcd(self, addr=None, bl=1):
-        i2c_list = self.i2c_scan()
         if addr is None:
-            if '27' in i2c_list:
-                self.LCD_ADDR = self.PCF8574_address
-            elif '3f' in i2c_list:
-                self.LCD_ADDR = self.PCF8574A_address
-            else:
+            found = i2c_bus.probe_addresses([self.PCF8574_address, self.PCF8574A_address])
+            if not found:
                 raise IOError("I2C address 0x27 or 0x3f not found.")
+            self.LCD_ADDR = found[0]
         else:
             self.LCD_ADDR = addr
-            if str(hex(addr)).strip('0x') not in i2c_list:
+            if not i2c_bus.probe(addr):
                 raise IOError(f"I2C address {str(hex(addr))} not found.")
         self.BLEN = bl
         try:
-            self.send_command(0x33)  # Must initialize to 8-line mode at first
-            time.sleep(0.005)
-            self.send_command(0x32)  # Then initialize to 4-line mode
-            time.sleep(0.005)
-            self.send_command(0x28)  # 2 Lines & 5*7 dots
-            time.sleep(0.005)
-            self.send_command(0x0C)  # Enable display without cursor
-            time.sleep(0.005)
-            self.send_command(0x01)  # Clear Screen
-            self.bus.write_byte(self.LCD_ADDR, 0x08)
+            with self.lock:
+                initialize(self.transport, self.LCD_ADDR, self.BLEN == 1)
+                self.bus.write_byte(self.LCD_ADDR, 0x08)
         except:
             return False
         else:
@@ -97,8 +60,8 @@ class CharLCD2004(object):
         self.send_command(0x01)  # Clear Screen
 
     def openlight(self):  # Enable the backlight
-        self.bus.write_byte(self.LCD_ADDR, 0x08)
-        self.bus.close()
+        with self.lock:
+            self.bus.write_byte(self.LCD_ADDR, 0x08)
 
     def write(self, x, y, str):
         if x < 0:
@@ -111,14 +74,17 @@ class CharLCD2004(object):
             y = self.lcd_rows - 1
         # Move cursor
         addr = 0x80 + 0x40 * y + x
-        self.send_command(addr)
-        for chr in str:
-            self.send_data(ord(chr))
+        # Cursor move and text go out as one transfer
+        with self.lock:
+            self.transport.send(self.LCD_ADDR, [(addr, False)] + [(ord(chr), True) for chr in str],
+                                self.BLEN == 1)
 
     def display_num(self, x, y, num):
         addr = 0x80 + 0x40 * y + x
-        self.send_command(addr)
-        self.send_data(num)
+        # Cursor move and digit are kept together
+        with self.lock:
+            self.send_command(addr)
+            self.send_data(num)
 
     # New Methods
 
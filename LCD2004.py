@@ -1,15 +1,33 @@
 #!/usr/bin/env python3
 import time
-import smbus2 as smbus
+import clock
+import i2c_bus
+from hd44780 import PCF8574Transport, TRANSPORT_BLOCK, initialize
 
 lines = [""] * 4
 
+COLUMNS = 20
+ROWS = 4
+ROW_OFFSETS = [0x00, 0x40, 0x14, 0x54]
+# Unchanged cells between two changed runs that are rewritten rather than paying for a cursor move
+MAX_RUN_GAP = 1
+
 
 class LCD2004Display:
-    def __init__(self, addr=0x27, bl=1):
-        self.BUS = smbus.SMBus(1)
+    def __init__(self, addr=0x27, bl=1, transport=TRANSPORT_BLOCK):
+        self.BUS = i2c_bus.get_smbus(1)
+        self.lock = i2c_bus.smbus_lock(1)
         self.LCD_ADDR = addr
         self.BLEN = bl
+        self.transport = PCF8574Transport(self.BUS, transport)
+
+        # Copy of what DDRAM holds, writes only send the cells that differ from it
+        self.shadow = [[' '] * COLUMNS for _ in range(ROWS)]
+        self.cells_written_last = 0
+        self.cells_written_total = 0
+        self.cells_skipped_total = 0
+        self.cursor_moves_total = 0
+
         self._init_display()
         # Initialize lines
         self.lines = [""] * 4
@@ -32,56 +50,28 @@ class LCD2004Display:
         self.BUS.write_byte(addr, temp)
 
     def _send_command(self, comm):
-        buf = comm & 0xF0
-        buf |= 0x04
-        self._write_word(self.LCD_ADDR, buf)
-        time.sleep(0.002)
-        buf &= 0xFB
-        self._write_word(self.LCD_ADDR, buf)
-
-        buf = (comm & 0x0F) << 4
-        buf |= 0x04
-        self._write_word(self.LCD_ADDR, buf)
-        time.sleep(0.002)
-        buf &= 0xFB
-        self._write_word(self.LCD_ADDR, buf)
+        with self.lock:
+            self.transport.command(self.LCD_ADDR, comm, self.BLEN == 1)
 
     def _send_data(self, data):
-        buf = data & 0xF0
-        buf |= 0x05
-        self._write_word(self.LCD_ADDR, buf)
-        time.sleep(0.002)
-        buf &= 0xFB
-        self._write_word(self.LCD_ADDR, buf)
-
-        buf = (data & 0x0F) << 4
-        buf |= 0x05
-        self._write_word(self.LCD_ADDR, buf)
-        time.sleep(0.002)
-        buf &= 0xFB
-        self._write_word(self.LCD_ADDR, buf)
+        with self.lock:
+            self.transport.send(self.LCD_ADDR, [(data, True)], self.BLEN == 1)
 
     def _init_display(self):
         try:
-            self._send_command(0x33)
-            time.sleep(0.005)
-            self._send_command(0x32)
-            time.sleep(0.005)
-            self._send_command(0x28)
-            time.sleep(0.005)
-            self._send_command(0x0C)
-            time.sleep(0.005)
-            self._send_command(0x01)
-            self.BUS.write_byte(self.LCD_ADDR, 0x08)
+            with self.lock:
+                initialize(self.transport, self.LCD_ADDR, self.BLEN == 1)
         except:
             raise Exception("Failed to initialize display")
 
     def clear(self):
-        self._send_command(0x01)
+        with self.lock:
+            self._send_command(0x01)
+            self.shadow = [[' '] * COLUMNS for _ in range(ROWS)]
 
     def open_light(self):
-        self.BUS.write_byte(0x27, 0x08)
-        self.BUS.close()
+        with self.lock:
+            self.BUS.write_byte(self.LCD_ADDR, 0x08)
 
     def write(self, x, y, text):
         if x < 0:
@@ -93,12 +83,54 @@ class LCD2004Display:
         if y > 3:
             y = 3
         lines[y] = text
-        row_offsets = [0x00, 0x40, 0x14, 0x54]
-        addr = 0x80 + row_offsets[y] + x
-        self._send_command(addr)
-
-        for chr in text:
-            self._send_data(ord(chr))
+        self.cells_written_last = self._write_cells(x, y, text)
+
+    def _write_frame(self, rows):
+        # Writes full rows from the top as a single transfer, cells_written_last covers the whole frame
+        items = []
+        with self.lock:
+            self.cells_written_last = sum(self._diff_cells(0, y, text, items) for y, text in enumerate(rows))
+            self.transport.send(self.LCD_ADDR, items, self.BLEN == 1)
+
+    def _write_cells(self, x, y, text):
+        items = []
+        with self.lock:
+            written = self._diff_cells(x, y, text, items)
+            self.transport.send(self.LCD_ADDR, items, self.BLEN == 1)
+        return written
+
+    def _diff_cells(self, x, y, text, items):
+        # Queues a cursor move and the characters for each changed run and updates the shadow
+        text = text[:COLUMNS - x]
+        row = self.shadow[y]
+        written = 0
+        for start, end in self._changed_runs(row, x, text):
+            items.append((0x80 + ROW_OFFSETS[y] + start, False))
+            self.cursor_moves_total += 1
+            for column in range(start, end):
+                items.append((ord(text[column - x]), True))
+                row[column] = text[column - x]
+            written += end - start
+        self.cells_written_total += written
+        self.cells_skipped_total += len(text) - written
+        return written
+
+    @staticmethod
+    def _changed_runs(row, x, text):
+        # Column ranges [start, end) where text differs from the row, runs separated by short gaps are merged
+        runs = []
+        for column in range(x, x + len(text)):
+            if row[column] == text[column - x]:
+                continue
+            if runs and column - runs[-1][1] <= MAX_RUN_GAP:
+                runs[-1][1] = column + 1
+            else:
+                runs.append([column, column + 1])
+        return runs
+
+    def write_stats(self):
+        return {'cells_written_last': self.cells_written_last, 'cells_written_total': self.cells_written_total,
+                'cells_skipped_total': self.cells_skipped_total, 'cursor_moves_total': self.cursor_moves_total}
 
     def get_max_characters(self):
         # Returns the maximum number of characters per line for the display.
@@ -109,8 +141,7 @@ class LCD2004Display:
             raise ValueError("col must be between 0 and 19")
         if row < 0 or row >= 4:
             raise ValueError("row must be between 0 and 3")
-        row_offsets = [0x00, 0x40, 0x14, 0x54]
-        addr = 0x80 + row_offsets[row] + col
+        addr = 0x80 + ROW_OFFSETS[row] + col
         self._send_command(addr)
 
     def scroll_text(self, line_number, text, direction="left", delay=0.3):
@@ -125,13 +156,13 @@ class LCD2004Display:
                 display_text = text[i:i + 20]
                 self.set_cursor_position(0, line_number)
                 self.write(0, line_number, display_text.ljust(20))
-                time.sleep(delay)
+                clock.sleep(delay)
         elif direction == "right":
             for i in range(len(text) + 20):
                 display_text = text[max(0, len(text) - 20 - i):len(text) - i]
                 self.set_cursor_position(0, line_number)
                 self.write(0, line_number, display_text.rjust(20))
-                time.sleep(delay)
+                clock.sleep(delay)
 
     def clear_line(self, line_number):
         if line_number < 0 or line_number >= 4:
@@ -142,44 +173,43 @@ class LCD2004Display:
     def display_default_four_rows(self):
         self.display_four_rows_center(["Internal:", "reading...", "External:", "reading..."], justification='left')
 
-
     def display_text_with_border(self, text_lines, full_display_border=False):
-        self.clear()
+        # Built as a whole screen and written through the shadow buffer instead of clearing first
         border_line = '*' * 20
+        frame = [" " * 20] * 4
 
         if full_display_border:
-            self.write(0, 0, border_line)
+            frame[0] = border_line
             for i in range(1, 4):
                 line_text = text_lines[i - 1] if i - 1 < len(text_lines) else ""
-                self.write(0, i, "*" + line_text.center(18) + "*")
-            self.write(0, 3, border_line)
+                frame[i] = "*" + line_text.center(18) + "*"
+            frame[3] = border_line
         else:
             for i, text in enumerate(text_lines):
                 if i == 0:
-                    self.write(0, 0, border_line)
-                    self.write(0, 1, "*" + text.center(18) + "*")
-                    self.write(0, 2, border_line)
+                    frame[0:3] = [border_line, "*" + text.center(18) + "*", border_line]
                 elif i == 1:
-                    self.write(0, 1, border_line)
-                    self.write(0, 2, "*" + text.center(18) + "*")
-                    self.write(0, 3, border_line)
+                    frame[1:4] = [border_line, "*" + text.center(18) + "*", border_line]
+
+        self._write_frame(frame)
 
     def display_four_rows_center(self, texts, justification='center'):
-        self.clear()
         num_lines = min(4, len(texts))
         max_chars = 20  # Assuming the display has 20 columns
-        for i in range(num_lines):
-            text = texts[i]
+        frame = []
+        for i in range(4):
+            text = texts[i] if i < num_lines else ""
             lines[i] = text
-            lines[i] = texts[i]
+            self.lines[i] = text
             if justification == 'left':
-                display_text = text.ljust(max_chars)
+                frame.append(text.ljust(max_chars))
             elif justification == 'right':
-                display_text = text.rjust(max_chars)
+                frame.append(text.rjust(max_chars))
             else:  # default to center
-                display_text = text.center(max_chars)
+                frame.append(text.center(max_chars))
 
-            self.write(0, i, display_text)
+        # Only the cells that changed are sent, so there is no need to clear the screen first
+        self._write_frame(frame)
 
     def update_line(self, line_number, text, justification='center'):
         if line_number < 0 or line_number >= 4:
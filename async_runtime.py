@@ -0,0 +1,95 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from scheduler import PeriodicJob, job_report
+
+CONTROL_EXECUTOR = 'control'
+
+
+class AsyncRuntime:
+    # asyncio alternative to Scheduler.run_forever. Blocking driver calls run on single worker
+    # executors, one per bus plus one per job group, so independent devices are serviced concurrently
+    # while calls to the same device stay in order.
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.jobs = {}
+        self._job_executors = {}
+        self._buses = {}
+        self._executors = {}
+        self.on_reading = None
+
+    def _executor(self, name):
+        if name not in self._executors:
+            self._executors[name] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"async-{name}")
+        return self._executors[name]
+
+    def add_job(self, name, period, callback, start_delay=0, executor=CONTROL_EXECUTOR):
+        if period <= 0:
+            raise ValueError(f"Period for job {name} must be greater than 0")
+        if name in self.jobs:
+            raise ValueError(f"Job {name} already scheduled")
+        job = PeriodicJob(name, period, callback)
+        job.deadline = start_delay
+        self.jobs[name] = job
+        self._job_executors[name] = executor
+        return job
+
+    def add_sensors(self, sensors, interval, on_reading=None):
+        # sensors is a dict of name -> Sensor, on_reading runs on the control executor after every reading
+        for name, sensor in sensors.items():
+            if sensor.bus_name not in self._buses:
+                self._buses[sensor.bus_name] = {'sensors': {},
+                                                'job': PeriodicJob(f"sample-{sensor.bus_name}", interval, None)}
+            self._buses[sensor.bus_name]['sensors'][name] = sensor
+        self.on_reading = on_reading
+
+    def set_sensor_interval(self, interval):
+        for bus in self._buses.values():
+            bus['job'].period = interval
+
+    async def _run_job(self, job, executor):
+        loop = asyncio.get_running_loop()
+        job.deadline += loop.time()
+        while True:
+            await asyncio.sleep(max(0.0, job.deadline - loop.time()))
+            started = loop.time()
+            await loop.run_in_executor(executor, job.callback)
+            finished = loop.time()
+            job.record_run(started, finished)
+            job.advance(finished)
+
+    async def _run_bus(self, bus_name, sensors, job):
+        loop = asyncio.get_running_loop()
+        executor = self._executor(f"bus-{bus_name}")
+        control = self._executor(CONTROL_EXECUTOR)
+        job.deadline = loop.time()
+        while True:
+            started = loop.time()
+            for name, sensor in sensors.items():
+                try:
+                    reading = await loop.run_in_executor(executor, sensor.read_sensor)
+                except (OSError, RuntimeError) as e:
+                    print(f"Error reading {name} sensor on {bus_name} bus: {e}")
+                    continue
+                self.snapshot.publish(name, reading)
+                if self.on_reading is not None:
+                    # Act on the reading straight away rather than on the next control tick
+                    await loop.run_in_executor(control, self.on_reading)
+            finished = loop.time()
+            job.record_run(started, finished)
+            job.advance(finished)
+            await asyncio.sleep(max(0.0, job.deadline - loop.time()))
+
+    async def _main(self):
+        tasks = [self._run_bus(bus_name, bus['sensors'], bus['job']) for bus_name, bus in self._buses.items()]
+        tasks += [self._run_job(job, self._executor(self._job_executors[name])) for name, job in self.jobs.items()]
+        await asyncio.gather(*tasks)
+
+    def run(self):
+        try:
+            asyncio.run(self._main())
+        finally:
+            for executor in self._executors.values():
+                executor.shutdown(wait=False)
+
+    def report(self):
+        return job_report([bus['job'] for bus in self._buses.values()] + list(self.jobs.values()))
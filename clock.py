@@ -0,0 +1,117 @@
+import time
+import threading
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+REAL = 'real'
+MONOTONIC = 'monotonic'
+SIMULATED = 'simulated'
+
+
+class RealClock:
+    # The system clocks. time() follows the wall clock, so it can step when NTP syncs after boot.
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait(self, event, timeout=None):
+        # Event.wait on this clock, returns True if the event was set
+        return event.wait(timeout)
+
+
+class MonotonicClock(RealClock):
+    # Wall time taken once at start and then carried forward on the monotonic clock. Timestamps and
+    # run times never jump when the Pi, which has no RTC, gets its time from the network.
+    def __init__(self):
+        self._wall_start = time.time()
+        self._monotonic_start = time.monotonic()
+
+    def time(self):
+        return self._wall_start + time.monotonic() - self._monotonic_start
+
+
+class SimulatedClock:
+    # Time only moves when something sleeps, and then it jumps straight to the end of the sleep. The scheduler
+    # sleeps until its next deadline, so a run goes from one scheduled event to the next without waiting.
+    # Meant for a single thread driving the whole application.
+    def __init__(self, start=None):
+        self._lock = threading.Lock()
+        self._wall_start = time.time() if start is None else start
+        self._now = 0.0
+        self.sleep_count = 0
+
+    def time(self):
+        with self._lock:
+            return self._wall_start + self._now
+
+    def monotonic(self):
+        with self._lock:
+            return self._now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.sleep_count += 1
+            if seconds > 0:
+                self._now += seconds
+
+    def advance(self, seconds):
+        self.sleep(seconds)
+
+    def wait(self, event, timeout=None):
+        if event.is_set() or timeout is None:
+            # Nothing else runs to set it, an unbounded wait would never return
+            return event.is_set()
+        self.sleep(timeout)
+        return event.is_set()
+
+
+CLOCKS = {REAL: RealClock, MONOTONIC: MonotonicClock, SIMULATED: SimulatedClock}
+
+_clock = RealClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    # Installed once at startup, before anything reads the time
+    global _clock
+    _clock = clock
+    return clock
+
+
+def create_clock(name):
+    clock_class = CLOCKS.get(name)
+    if clock_class is None:
+        raise ValueError(f"Invalid clock. Supported clocks: {', '.join(CLOCKS)}")
+    return clock_class()
+
+
+# The application calls these rather than the time module, they always go to the installed clock
+
+def now():
+    return _clock.time()
+
+
+def monotonic():
+    return _clock.monotonic()
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
+
+
+def wait(event, timeout=None):
+    return _clock.wait(event, timeout)
+
+
+def timestamp(seconds=None):
+    # Log timestamp in local time, of now unless seconds is given
+    return time.strftime(TIMESTAMP_FORMAT, time.localtime(_clock.time() if seconds is None else seconds))
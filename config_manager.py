@@ -1,4 +1,103 @@
+import os
+import time
+import threading
 import configparser
+from collections import namedtuple
+
+
+class Setting:
+    def __init__(self, type, default, minimum=None, maximum=None, choices=None):
+        self.type = type
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.choices = choices
+
+    def parse(self, key, text):
+        if self.type is tuple:
+            # Comma separated list
+            value = tuple(item.strip() for item in text.split(',') if item.strip())
+        else:
+            try:
+                value = self.type(text)
+            except ValueError:
+                raise ValueError(f"{key} = {text!r} is not a valid {self.type.__name__}")
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError(f"{key} = {value} is below the minimum of {self.minimum}")
+        if self.maximum is not None and value > self.maximum:
+            raise ValueError(f"{key} = {value} is above the maximum of {self.maximum}")
+        if self.choices is not None and value not in self.choices:
+            raise ValueError(f"{key} = {value!r} must be one of: {', '.join(self.choices)}")
+        return value
+
+
+# Every key config.ini may hold, with its type, default and allowed range
+SCHEMA = {
+    'min_humidity': Setting(float, 50.0, 0, 100),
+    'max_humidity': Setting(float, 60.0, 0, 100),
+    'hysteresis': Setting(float, 5.0, 0, 100),
+    'min_fan_on_time': Setting(int, 60, 0, 3600),
+    'min_fan_off_time': Setting(int, 60, 0, 3600),
+    'sensor_interval': Setting(int, 10, 1, 3600),
+    'logfile': Setting(str, 'log.csv'),
+    'readings_dir': Setting(str, 'readings'),
+    'rollup_dir': Setting(str, 'rollups'),
+    'rollup_minute_days': Setting(float, 2.0, 0.01, 365),
+    'rollup_hour_days': Setting(float, 90.0, 1, 3650),
+    'rollup_day_days': Setting(float, 3650.0, 1, 36500),
+    'max_log_size': Setting(int, 150000, 1024),
+    'max_archive_size': Setting(int, 310001, 1024),
+    'log_compression': Setting(str, 'gzip', choices=('gzip', 'lzma', 'none')),
+    'log_batch_size': Setting(int, 50, 1, 10000),
+    'log_batch_interval': Setting(int, 5, 0, 3600),
+    'log_fsync': Setting(str, 'interval', choices=('batch', 'interval', 'never')),
+    'log_fsync_interval': Setting(int, 60, 0, 86400),
+    'log_queue_size': Setting(int, 1000, 1),
+    'font': Setting(str, 'Quicksand-Regular.ttf'),
+    'fontsize': Setting(int, 12, 6, 64),
+    'border': Setting(int, 5, 0, 32),
+    'text_cache_bytes': Setting(int, 16384, 0),
+    'sensor_heat_startup_time': Setting(int, 10, 0, 3600),
+    'sensor_heat_running_time': Setting(int, 2, 0, 60),
+    'sensor_heat_interval': Setting(int, 90, 1, 86400),
+    'display_interval': Setting(int, 1, 1, 60),
+    'log_flush_interval': Setting(int, 30, 1, 3600),
+    'config_save_interval': Setting(int, 1, 1, 60),
+    'config_reload_interval': Setting(int, 5, 1, 3600),
+    'config_write_debounce': Setting(float, 2.0, 0, 60),
+    'fast_boot': Setting(int, 1, 0, 1),
+    'inventory_file': Setting(str, 'inventory.json'),
+    'installed_devices': Setting(tuple, ('SHT41_Internal', 'SHT30', 'LCD2004', 'EMC2101', 'FAN', 'SSD1306')),
+    'up_button_pin': Setting(int, 12, 0, 27),
+    'dn_button_pin': Setting(int, 16, 0, 27),
+}
+
+# Validated, read-only view of the whole file. Settings are plain attributes, nothing is parsed on access.
+ConfigSnapshot = namedtuple('ConfigSnapshot', list(SCHEMA))
+
+
+def build_snapshot(config):
+    # CUSTOM falls back to DEFAULT through configparser, and missing keys fall back to the schema
+    section = config["CUSTOM"] if config.has_section("CUSTOM") else config[configparser.DEFAULTSECT]
+    errors = []
+    values = {}
+    for key, setting in SCHEMA.items():
+        if key not in section:
+            values[key] = setting.default
+            continue
+        try:
+            values[key] = setting.parse(key, section[key])
+        except ValueError as e:
+            errors.append(str(e))
+    for key in section:
+        if key not in SCHEMA:
+            print(f"Unknown config key ignored: {key}")
+    if not errors and values['min_humidity'] >= values['max_humidity']:
+        errors.append(f"min_humidity ({values['min_humidity']}) must be below "
+                      f"max_humidity ({values['max_humidity']})")
+    if errors:
+        raise ValueError("Invalid configuration: " + "; ".join(errors))
+    return ConfigSnapshot(**values)
 
 
 class ConfigManager:
@@ -6,6 +105,39 @@ class ConfigManager:
         self.config_file = config_file
         self.config = configparser.ConfigParser()
         self.config.read(config_file)
+        # Held while self.config is changed or replaced, updates come from the ConfigWriter thread
+        self.lock = threading.RLock()
+        self.snapshot = build_snapshot(self.config)
+        self.mtime = self._mtime()
+        self.reload_count = 0
+
+    def _mtime(self):
+        try:
+            return os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload_if_changed(self):
+        # Swaps in a new snapshot when the file has changed and is valid, a bad edit keeps the old one.
+        # Readers that took self.snapshot once see either the old or the new settings, never a mix.
+        with self.lock:
+            mtime = self._mtime()
+            if mtime == self.mtime:
+                return False
+            self.mtime = mtime
+            config = configparser.ConfigParser()
+            try:
+                config.read(self.config_file)
+                snapshot = build_snapshot(config)
+            except (configparser.Error, ValueError) as e:
+                print(f"Error reloading {self.config_file}, keeping the current settings: {e}")
+                return False
+            self.config = config
+            changed = snapshot != self.snapshot
+            self.snapshot = snapshot
+            if changed:
+                self.reload_count += 1
+            return changed
 
     def get_config(self, key):
         if "CUSTOM" in self.config and key in self.config["CUSTOM"]:
@@ -16,14 +148,11 @@ class ConfigManager:
             raise KeyError(f"Config for DEFAULT/{key} not found.")
 
     def get_int_config(self, key):
+        # Already parsed into the schema type, so min_humidity comes back as a float
+        if key in SCHEMA:
+            return getattr(self.snapshot, key)
+        return int(self.get_config(key))
 
-        if "CUSTOM" in self.config and key in self.config["CUSTOM"]:
-            return int(self.config["CUSTOM"][key])
-        elif "DEFAULT" in self.config and key in self.config["DEFAULT"]:
-            return int(self.config["DEFAULT"][key])
-        else:
-            raise KeyError(f"Config for DEFAULT/{key} not found.")
-    
     def display_config(self):
         for section in self.config.sections():
             print(f"[{section}]")
@@ -33,13 +162,119 @@ class ConfigManager:
             print("[DEFAULT]")
             for key in self.config['DEFAULT']:
                 print(f"{key} = {self.config['DEFAULT'][key]}")
-    
+
     def update_config(self, key, value):
-        if not self.config.has_section("CUSTOM"):
-            self.config.add_section("CUSTOM")
-        self.config.set("CUSTOM", key, str(value))
-        self.save_config()
+        self.update_configs({key: value})
+
+    def update_configs(self, values):
+        # Validates and saves several keys with one write of the file
+        with self.lock:
+            if not self.config.has_section("CUSTOM"):
+                self.config.add_section("CUSTOM")
+            previous = {key: self.config.get("CUSTOM", key, fallback=None) for key in values}
+            for key, value in values.items():
+                self.config.set("CUSTOM", key, str(value))
+            try:
+                snapshot = build_snapshot(self.config)
+            except ValueError:
+                # Put the old values back so the file is never written with a setting the snapshot rejects
+                for key, value in previous.items():
+                    if value is None:
+                        self.config.remove_option("CUSTOM", key)
+                    else:
+                        self.config.set("CUSTOM", key, value)
+                raise
+            self.snapshot = snapshot
+            self.save_config()
+            self.mtime = self._mtime()
 
     def save_config(self):
-        with open(self.config_file, 'w') as configfile:
-            self.config.write(configfile)
+        # Written to a temporary file and renamed over config.ini, a power cut leaves the old or the new file
+        directory = os.path.dirname(os.path.abspath(self.config_file))
+        temp_file = self.config_file + '.tmp'
+        with self.lock:
+            with open(temp_file, 'w') as configfile:
+                self.config.write(configfile)
+                configfile.flush()
+                os.fsync(configfile.fileno())
+            os.replace(temp_file, self.config_file)
+        # Make the rename itself durable
+        directory_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+
+class ConfigWriter(threading.Thread):
+    # Saves config changes on its own thread. Updates are collected until none has arrived for
+    # debounce seconds and then written together, so a burst of button presses is one write.
+    def __init__(self, config_manager, debounce=2.0):
+        super().__init__(name='config-writer', daemon=True)
+        self.config_manager = config_manager
+        self.debounce = debounce
+        self.pending = {}
+        self.pending_updates = 0
+        self._condition = threading.Condition()
+        self._deadline = None
+        self._stopping = False
+
+        self.update_count = 0
+        self.write_count = 0
+        self.error_count = 0
+        self.failed_update_count = 0
+
+    def update(self, key, value):
+        with self._condition:
+            self.pending[key] = value
+            self.pending_updates += 1
+            self.update_count += 1
+            self._deadline = time.monotonic() + self.debounce
+            self._condition.notify()
+
+    def flush(self):
+        # Writes whatever is pending straight away, on the calling thread
+        with self._condition:
+            values = self.pending
+            updates = self.pending_updates
+            self.pending = {}
+            self.pending_updates = 0
+            self._deadline = None
+        if values:
+            self._write(values, updates)
+
+    def _write(self, values, updates):
+        try:
+            self.config_manager.update_configs(values)
+            self.write_count += 1
+        except (OSError, ValueError) as e:
+            self.error_count += 1
+            self.failed_update_count += updates
+            print(f"Error saving config: {e}")
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._stopping and (self._deadline is None or time.monotonic() < self._deadline):
+                    timeout = None if self._deadline is None else self._deadline - time.monotonic()
+                    self._condition.wait(timeout)
+                if self._stopping:
+                    return
+            self.flush()
+
+    def stop(self, timeout=5):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self.is_alive():
+            self.join(timeout)
+        self.flush()
+
+    def stats(self):
+        # Each update used to be a write of its own. Updates that are still pending or were lost to a failed
+        # write were never saved, so they do not count as avoided writes.
+        with self._condition:
+            saved = self.update_count - self.pending_updates - self.failed_update_count
+        return {'updates': self.update_count, 'writes': self.write_count,
+                'writes_avoided': max(saved - self.write_count, 0), 'errors': self.error_count,
+                'failed_updates': self.failed_update_count}
@@ -0,0 +1,146 @@
+import threading
+from collections import namedtuple
+
+FAN_START = 'start'
+FAN_STOP = 'stop'
+
+# Both buttons have to be left alone this long before an edited setpoint is saved
+SAVE_QUIET_TIME = 3
+
+# fan_on and when it last switched, changed_at is None until the first switch so nothing holds it at boot
+FanState = namedtuple('FanState', ['fan_on', 'changed_at'])
+ControlSettings = namedtuple('ControlSettings', ['min_humidity', 'max_humidity', 'hysteresis',
+                                                 'min_on_time', 'min_off_time'])
+
+
+def off_threshold(settings):
+    # The fan stops below min_humidity, but never less than hysteresis below where it starts
+    return min(settings.min_humidity, settings.max_humidity - settings.hysteresis)
+
+
+def step(state, settings, humidity, now):
+    # Pure fan decision: returns the new state and FAN_START, FAN_STOP or None.
+    # humidity is None when there is no valid reading, which never switches the fan.
+    if humidity is None:
+        return state, None
+    if state.changed_at is not None:
+        hold = settings.min_on_time if state.fan_on else settings.min_off_time
+        if now - state.changed_at < hold:
+            return state, None
+    if not state.fan_on and humidity > settings.max_humidity:
+        return FanState(True, now), FAN_START
+    if state.fan_on and humidity < off_threshold(settings):
+        return FanState(False, now), FAN_STOP
+    return state, None
+
+
+class DehydratorController:
+    # Setpoints, button edit state and fan state behind one lock. The gpiozero callbacks and the control
+    # loop only go through the methods below. fan is a HumidityController, or None to only decide.
+    # The fan is switched outside that lock, under fan_lock, so readers never wait on the I2C bus.
+    def __init__(self, settings, fan=None):
+        self.lock = threading.Lock()
+        self.fan_lock = threading.Lock()
+        self.settings = settings
+        self.fan = fan
+        self.state = FanState(False, None)
+        self.mode = None
+        self.changed = False
+        self.last_press_time = {'up': 0, 'dn': 0}
+        self.start_count = 0
+        self.stop_count = 0
+        self.last_run_time = None
+
+    def step(self, humidity, now):
+        # Runs step() and switches the fan to match, returns the action taken. The new state is only kept once
+        # the fan has switched, if that raises the next step tries again.
+        with self.fan_lock:
+            with self.lock:
+                previous = self.state
+                state, action = step(previous, self.settings, humidity, now)
+            if action is None:
+                return None
+            if self.fan is not None:
+                if action == FAN_START:
+                    self.fan.engage_fan()
+                else:
+                    self.fan.disengage_fan()
+            with self.lock:
+                self.state = state
+                if action == FAN_START:
+                    self.start_count += 1
+                else:
+                    self.stop_count += 1
+                    self.last_run_time = now - previous.changed_at
+        return action
+
+    def fan_on(self):
+        with self.lock:
+            return self.state.fan_on
+
+    def run_time(self):
+        # How long the fan ran the last time it stopped, None until it has
+        with self.lock:
+            return self.last_run_time
+
+    def set_settings(self, settings):
+        # From a config reload. Setpoints that are being edited on the buttons are kept.
+        with self.lock:
+            if self.changed:
+                settings = settings._replace(min_humidity=self.settings.min_humidity,
+                                             max_humidity=self.settings.max_humidity)
+            self.settings = settings
+
+    def button_held(self, button_name, now, both_held=False):
+        # Holding up edits the max setpoint, holding down the min. Returns the setpoint being edited.
+        with self.lock:
+            self.last_press_time[button_name] = now
+            if both_held:
+                return None, None
+            if button_name == 'up':
+                self.mode = 'max'
+                return 'max', self.settings.max_humidity
+            self.mode = 'min'
+            return 'min', self.settings.min_humidity
+
+    def button_pressed(self, button_name, now):
+        # Steps the setpoint being edited, or just shows it when nothing is. Returns the setpoint shown.
+        with self.lock:
+            if self.mode is None:
+                if button_name == 'up':
+                    return 'max', self.settings.max_humidity
+                return 'min', self.settings.min_humidity
+            change = 1 if button_name == 'up' else -1
+            key = self.mode + '_humidity'
+            value = getattr(self.settings, key) + change
+            self.last_press_time[button_name] = now
+            if not self._in_band(key, value):
+                # Stops at the edge of the band rather than crossing the other setpoint
+                return self.mode, getattr(self.settings, key)
+            self.settings = self.settings._replace(**{key: value})
+            self.changed = True
+            return self.mode, value
+
+    def _in_band(self, key, value):
+        # min stays at least hysteresis (or one step) below max, and both stay within 0-100%
+        gap = max(self.settings.hysteresis, 1)
+        if key == 'min_humidity':
+            return 0 <= value <= self.settings.max_humidity - gap
+        return self.settings.min_humidity + gap <= value <= 100
+
+    def take_pending_save(self, now):
+        # Returns (min_humidity, max_humidity) once an edit has been left alone for SAVE_QUIET_TIME,
+        # and leaves edit mode. Returns None otherwise.
+        with self.lock:
+            if not self.changed:
+                return None
+            if now - self.last_press_time['up'] <= SAVE_QUIET_TIME or \
+                    now - self.last_press_time['dn'] <= SAVE_QUIET_TIME:
+                return None
+            self.changed = False
+            self.mode = None
+            return self.settings.min_humidity, self.settings.max_humidity
+
+    def stats(self):
+        with self.lock:
+            return {'fan_on': self.state.fan_on, 'starts': self.start_count, 'stops': self.stop_count}
@@ -0,0 +1,178 @@
+import sys
+import time
+import resource
+import importlib
+import clock
+import i2c_bus
+
+SENSOR = 'sensor'
+DISPLAY = 'display'
+FAN = 'fan'
+
+FAN_SPIN_UP_TIME = 1
+FAN_TEST_SPEED = 25
+
+_import_times = {}
+
+
+def load_driver(module_name):
+    # Imports a driver module the first time a configured device needs it
+    module = sys.modules.get(module_name)
+    if module is None:
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        _import_times[module_name] = time.perf_counter() - started
+    return module
+
+
+def import_times():
+    return dict(_import_times)
+
+
+def memory_usage():
+    # Current and peak resident set size in kB
+    rss = None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1])
+                    break
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss, max(peak, rss or 0)
+
+
+def resource_report():
+    imports = ", ".join(f"{name} {elapsed * 1000:.0f}ms" for name, elapsed in _import_times.items())
+    rss, peak = memory_usage()
+    rss_text = f"{rss / 1024:.1f}MB" if rss is not None else "unknown"
+    return (f"Driver imports: {imports or 'none'} (total {sum(_import_times.values()) * 1000:.0f}ms), "
+            f"RSS {rss_text}, peak {peak / 1024:.1f}MB")
+
+
+class DeviceType:
+    # One kind of device: where it lives, which module drives it and how the self test checks it.
+    # addresses lists the ones it can answer on, the first is the default. role is the reading a sensor gives,
+    # Internal or External.
+    def __init__(self, name, kind, driver, bus_name, addresses, probe, factory=None, role=None):
+        self.name = name
+        self.kind = kind
+        self.driver = driver
+        self.bus_name = bus_name
+        self.addresses = addresses
+        self.probe = probe
+        self.factory = factory
+        self.role = role
+
+    @property
+    def address(self):
+        return self.addresses[0]
+
+    def load(self):
+        return load_driver(self.driver)
+
+    def get_device(self, address=None):
+        # Driver instance shared through i2c_bus, factory(module, i2c, address) builds it the first time
+        if address is None:
+            address = self.address
+        module = self.load()
+        return i2c_bus.get_device(self.bus_name, address, lambda i2c: self.factory(module, i2c, address))
+
+
+DEVICE_TYPES = {}
+
+
+def register(device_type):
+    DEVICE_TYPES[device_type.name] = device_type
+    return device_type
+
+
+def get_device_type(name, kind=None):
+    device_type = DEVICE_TYPES.get(name)
+    if device_type is None or (kind is not None and device_type.kind != kind):
+        supported = [name for name, device_type in DEVICE_TYPES.items() if kind is None or device_type.kind == kind]
+        raise ValueError(f"Invalid device type. Supported types: {', '.join(supported)}")
+    return device_type
+
+
+def installed_types(names, kind):
+    # Device types of one kind among the installed device names, in the order given, unknown names are skipped
+    return [DEVICE_TYPES[name] for name in names if name in DEVICE_TYPES and DEVICE_TYPES[name].kind == kind]
+
+
+def main_bus_addresses(names):
+    # Every address the named devices could answer on, for one probe pass over the main bus
+    addresses = []
+    for name in names:
+        device_type = DEVICE_TYPES.get(name)
+        if device_type is not None and device_type.bus_name == i2c_bus.MAIN_BUS:
+            addresses += [address for address in device_type.addresses if address not in addresses]
+    return addresses
+
+
+# Probe functions for the self test, probe(device_type, present) returns (address, detail, identity).
+# present holds the main bus addresses that answered, detail is None when the device is missing and
+# identity is what the fast boot inventory compares.
+
+def _probe_sht30(device_type, present):
+    sensor = device_type.get_device()
+    with i2c_bus.bus_lock(device_type.bus_name):
+        return device_type.address, "temperature: {:.2f} C, humidity: {:.2f} %".format(
+            sensor.temperature, sensor.relative_humidity), {'serial': sensor.serial_number}
+
+
+def _probe_sht4x(device_type, present):
+    # Only the main bus is an smbus adapter, elsewhere the driver itself is the presence check
+    if device_type.bus_name == i2c_bus.MAIN_BUS and device_type.address not in present:
+        return device_type.address, None, None
+    sht41 = device_type.get_device()
+    with i2c_bus.bus_lock(device_type.bus_name):
+        # serial_number sends SHT4X_READSERIAL (0x89)
+        return device_type.address, "temperature: {:.2f} C, humidity: {:.2f} %".format(
+            *sht41.measurements), {'serial': sht41.serial_number}
+
+
+def _probe_present(device_type, present):
+    address = next((address for address in device_type.addresses if address in present), None)
+    if address is None:
+        return device_type.address, None, None
+    return address, "", {}
+
+
+def _probe_emc2101(device_type, present):
+    if device_type.address not in present:
+        return device_type.address, None, None
+    emc2101 = device_type.load().EMC2101Registers(i2c_bus.get_bus(device_type.bus_name), device_type.address)
+    return (device_type.address, f"Status: {emc2101.read_status()}, Config: {emc2101.read_config()}",
+            {'product_id': emc2101.read_register(emc2101.PRODUCT_ID_REG)})
+
+
+def _probe_fan(device_type, present, spin_up=FAN_SPIN_UP_TIME, speed=FAN_TEST_SPEED):
+    # The bus is free while the fan spins up, the other checks run in the meantime
+    if device_type.address not in present:
+        return device_type.address, None, None
+    fan = device_type.load().EMC2101(device_type.address)
+    fan.set_fan_speed(speed)
+    try:
+        clock.sleep(spin_up)
+        rpm = fan.read_fan_speed()
+        temp = fan.read_internal_temp()
+    finally:
+        fan.set_fan_speed(0)
+    return device_type.address, f"RPM: {rpm}, Internal Temp: {temp}", {}
+
+
+register(DeviceType('SHT30', SENSOR, 'adafruit_sht31d', i2c_bus.BITBANG_BUS, (0x44,), _probe_sht30,
+                    lambda module, i2c, address: module.SHT31D(i2c, address), role='External'))
+register(DeviceType('SHT41_Internal', SENSOR, 'adafruit_sht4x', i2c_bus.MAIN_BUS, (0x44,), _probe_sht4x,
+                    lambda module, i2c, address: module.SHT4x(i2c, address), role='Internal'))
+register(DeviceType('SHT41_External', SENSOR, 'adafruit_sht4x', i2c_bus.EXTERNAL_BUS, (0x44,), _probe_sht4x,
+                    lambda module, i2c, address: module.SHT4x(i2c, address), role='External'))
+# PCF8574 backpacks come as 0x27 or, for the PCF8574A, 0x3F
+register(DeviceType('LCD2004', DISPLAY, 'LCD2004', i2c_bus.MAIN_BUS, (0x27, 0x3F), _probe_present))
+register(DeviceType('LCD1602', DISPLAY, 'LCD1602', i2c_bus.MAIN_BUS, (0x27, 0x3F), _probe_present))
+register(DeviceType('SSD1306', DISPLAY, 'display', i2c_bus.MAIN_BUS, (0x3C,), _probe_present))
+register(DeviceType('EMC2101', FAN, 'fan_controller', i2c_bus.MAIN_BUS, (0x4C,), _probe_emc2101))
+register(DeviceType('FAN', FAN, 'fan_controller', i2c_bus.MAIN_BUS, (0x4C,), _probe_fan))
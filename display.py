@@ -1,17 +1,82 @@
-import board
-import busio
-import time
-import smbus2 as smbus
-import subprocess
+from collections import OrderedDict
 from PIL import Image, ImageDraw, ImageFont
 import adafruit_ssd1306
+import i2c_bus
+from hd44780 import PCF8574Transport, TRANSPORT_BLOCK, initialize
+
+# SSD1306 commands used for partial refresh, see the datasheet section 10.1
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+COMMAND_STREAM = 0x00  # Co = 0, D/C = 0, every following byte is a command
+DATA_STREAM = 0x40  # Co = 0, D/C = 1, every following byte is display data
+
+# Reverses the bits of a byte, PIL packs the first pixel into the MSB but the SSD1306 wants the top pixel in bit 0
+BIT_REVERSE = bytes(int(f'{i:08b}'[::-1], 2) for i in range(256))
+
+
+def pack_image(image, buffer, offset=0):
+    # Packs a mode '1' image into the SSD1306 page layout, one byte per column per 8 pixel page, without
+    # touching individual pixels in Python. Transposed, every image row is a display column which tobytes()
+    # packs 8 pixels to the byte, so byte column * pages + page is that column's byte for the page.
+    if image.mode != '1':
+        raise ValueError("Image must be in mode 1")
+    width, height = image.size
+    if height % 8:
+        raise ValueError("Image height must be a multiple of 8")
+    pages = height // 8
+    columns = image.transpose(Image.TRANSPOSE).tobytes().translate(BIT_REVERSE)
+    for page in range(pages):
+        start = offset + page * width
+        buffer[start:start + width] = columns[page::pages]
+
+
+class TextBitmapCache:
+    # LRU cache of rendered text, each entry is the ink bitmap and its offset from the top left of its line
+    ENTRY_OVERHEAD = 200  # Rough size in bytes of the Image object and the cache bookkeeping
+
+    def __init__(self, max_bytes=16384):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, render):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        value = render()
+        bitmap = value[0]
+        size = ((bitmap.width + 7) // 8) * bitmap.height + self.ENTRY_OVERHEAD
+        if size <= self.max_bytes:
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
 
 
 class DisplayConfig:
-    def __init__(self, font_path=None, font_size=10, border_size=1):
+    def __init__(self, font_path=None, font_size=10, border_size=1, text_cache_bytes=16384):
         self.font_path = font_path
         self.font_size = font_size
         self.border_size = border_size
+        self.text_cache_bytes = text_cache_bytes
 
     def get_font_path(self):
         return self.font_path
@@ -22,6 +87,9 @@ class DisplayConfig:
     def get_border_size(self):
         return self.border_size
 
+    def get_text_cache_bytes(self):
+        return self.text_cache_bytes
+
 
 class SSD1306Display:
     def __init__(self, configuration, width=128, height=64, i2c_address=0x3C):
@@ -30,53 +98,114 @@ class SSD1306Display:
         self.i2c_address = i2c_address
         self.config_manager = configuration
 
-        # Initialize I2C interface.
-        self.i2c = busio.I2C(board.SCL, board.SDA)
+        # Initialize I2C interface, shared with the other devices on the main bus.
+        self.i2c = i2c_bus.get_bus(i2c_bus.MAIN_BUS)
+        self.lock = i2c_bus.bus_lock(i2c_bus.MAIN_BUS)
 
         # Initialize display.
-        self.disp = adafruit_ssd1306.SSD1306_I2C(self.width, self.height, self.i2c, addr=self.i2c_address)
+        self.disp = i2c_bus.get_device(
+            i2c_bus.MAIN_BUS, self.i2c_address,
+            lambda i2c: adafruit_ssd1306.SSD1306_I2C(self.width, self.height, i2c, addr=self.i2c_address))
 
         # Create blank image for drawing.
         self.image = Image.new('1', (self.width, self.height))
         self.draw = ImageDraw.Draw(self.image)
 
+        # Rendered lines, keyed by text, font and layout
+        self.text_cache = TextBitmapCache(self.config_manager.get_text_cache_bytes())
+
         # Set the font using config_manager
         self.set_font(self.config_manager.get_font_path(), self.config_manager.get_font_size())
 
         # Initialize lines
         self.lines = [""] * 4
 
+        # Copy of the frame last sent to the panel, only the pages and columns that differ from it are sent.
+        # None until the first frame, which is always sent in full.
+        self.pages = self.height // 8
+        self.sent_frame = None
+        self.frame_count = 0
+        self.last_frame_bytes = 0
+        self.total_bytes = 0
+        # What the stock show() puts on the wire: 6 commands of 2 bytes, then the framebuffer plus a control
+        # byte, each transaction also carrying the address byte
+        self.full_frame_bytes = 6 * 3 + (self.pages * self.width + 2)
+
     def reset_screen(self):
-        self.disp.fill(0)
-        self.disp.show()
-        self._clear_image()
+        self.clear_screen()
 
     def clear_screen(self):
-        self.disp.fill(0)
-        self.disp.show()
+        with self.lock:
+            self.disp.fill(0)
+            self._send_dirty_pages()
         self._clear_image()
 
+    def _show_image(self):
+        with self.lock:
+            # Straight into the driver's buffer, which starts with the data control byte
+            pack_image(self.image, self.disp.buffer, offset=1)
+            self._send_dirty_pages()
+
+    def _send_dirty_pages(self):
+        # Sends each changed page as a column window in horizontal addressing mode. Like the stock show()
+        # on a 128 column panel, column addresses map straight onto framebuffer columns.
+        frame = self.disp.buffer
+        frame_bytes = 0
+        for page in range(self.pages):
+            start = 1 + page * self.width
+            new = frame[start:start + self.width]
+            if self.sent_frame is None:
+                first, last = 0, self.width - 1
+            else:
+                old = self.sent_frame[start:start + self.width]
+                if new == old:
+                    continue
+                first = 0
+                while new[first] == old[first]:
+                    first += 1
+                last = self.width - 1
+                while new[last] == old[last]:
+                    last -= 1
+
+            window = bytes([COMMAND_STREAM, SET_COL_ADDR, first, last, SET_PAGE_ADDR, page, page])
+            data = bytearray([DATA_STREAM]) + new[first:last + 1]
+            with self.disp.i2c_device as device:
+                device.write(window)
+                device.write(data)
+            # Each transaction also carries the address byte
+            frame_bytes += len(window) + len(data) + 2
+
+        self.sent_frame = bytearray(frame)
+        self.frame_count += 1
+        self.last_frame_bytes = frame_bytes
+        self.total_bytes += frame_bytes
+
+    def refresh_stats(self):
+        frames = max(self.frame_count, 1)
+        return {'frames': self.frame_count, 'last_frame_bytes': self.last_frame_bytes,
+                'total_bytes': self.total_bytes, 'full_frame_bytes': self.full_frame_bytes,
+                'mean_ratio': self.total_bytes / (frames * self.full_frame_bytes)}
+
     def _clear_image(self):
         self.image = Image.new('1', (self.width, self.height))
         self.draw = ImageDraw.Draw(self.image)
 
     def set_font(self, font_path=None, font_size=10):
+        self.font_path = font_path
+        self.font_size = font_size
         if font_path:
             self.font = ImageFont.truetype(font_path, font_size)
         else:
             self.font = ImageFont.load_default()
 
-    def get_max_characters(self):
-        # Get the bounding box of a single character
-        bbox = self.draw.textbbox((0, 0), "W", font=self.font)
-        char_width = bbox[2] - bbox[0]
-        # Calculate the maximum number of characters that can fit in the display width
-        max_chars = self.width // char_width
-        return max_chars
+    def _draw_text(self, text, top, line_height, justification='center'):
+        # Pastes the cached bitmap of text, laid out in the line starting at top, onto the image
+        key = (text, self.font_path, self.font_size, justification, line_height)
+        bitmap, x_offset, y_offset = self.text_cache.get(
+            key, lambda: self._render_text(text, line_height, justification))
+        self.image.paste(255, (x_offset, top + y_offset), bitmap)
 
-    # The justification parameter can be 'left', 'right', or 'center' (default).
-    def display_text_center(self, text, justification='center'):
-        self.clear_screen()
+    def _render_text(self, text, line_height, justification):
         bbox = self.draw.textbbox((0, 0), text, font=self.font)
         text_width = bbox[2] - bbox[0]
         text_height = bbox[3] - bbox[1]
@@ -88,39 +217,39 @@ class SSD1306Display:
             x_position = self.width - text_width
         else:  # default to center
             x_position = (self.width - text_width) // 2
+        y_position = (line_height - text_height) // 2
 
-        position = (x_position, (self.height - text_height) // 2)
-        self.draw.text(position, text, font=self.font, fill=255)
-        self.disp.image(self.image)
-        self.disp.show()
+        # Only the inked box is kept, drawn so it lines up with where draw.text() would have put it
+        bitmap = Image.new('1', (max(text_width, 1), max(text_height, 1)))
+        ImageDraw.Draw(bitmap).text((-bbox[0], -bbox[1]), text, font=self.font, fill=255)
+        return bitmap, x_position + bbox[0], y_position + bbox[1]
+
+    def get_max_characters(self):
+        # Get the bounding box of a single character
+        bbox = self.draw.textbbox((0, 0), "W", font=self.font)
+        char_width = bbox[2] - bbox[0]
+        # Calculate the maximum number of characters that can fit in the display width
+        max_chars = self.width // char_width
+        return max_chars
+
+    # The justification parameter can be 'left', 'right', or 'center' (default).
+    def display_text_center(self, text, justification='center'):
+        self._clear_image()
+        self._draw_text(text, 0, self.height, justification)
+        self._show_image()
 
     def display_default_four_rows(self):
         self.display_four_rows_center(["Internal:", "reading...", "External:", "reading..."], justification='left')
 
     def display_four_rows_center(self, texts, justification='center'):
-        self.clear_screen()
+        self._clear_image()
         num_lines = min(4, len(texts))
         self.lines = [""] * 4  # Reset lines
         line_height = self.height // num_lines
         for i in range(num_lines):
-            text = texts[i]
-            self.lines[i] = text
-            bbox = self.draw.textbbox((0, 0), text, font=self.font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-
-            # Calculate horizontal position based on justification
-            if justification == 'left':
-                x_position = 0
-            elif justification == 'right':
-                x_position = self.width - text_width
-            else:  # default to center
-                x_position = (self.width - text_width) // 2
-
-            position = (x_position, i * line_height + (line_height - text_height) // 2)
-            self.draw.text(position, text, font=self.font, fill=255)
-        self.disp.image(self.image)
-        self.disp.show()
+            self.lines[i] = texts[i]
+            self._draw_text(texts[i], i * line_height, line_height, justification)
+        self._show_image()
 
     def update_line(self, line_number, text, justification='center'):
         if line_number < 0 or line_number >= 4:
@@ -133,42 +262,24 @@ class SSD1306Display:
         y_position = line_number * line_height
         self.draw.rectangle((0, y_position, self.width, y_position + line_height), outline=0, fill=0)
 
-        bbox = self.draw.textbbox((0, 0), text, font=self.font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-
-        # Calculate horizontal position based on justification
-        if justification == 'left':
-            x_position = 0
-        elif justification == 'right':
-            x_position = self.width - text_width
-        else:  # default to center
-            x_position = (self.width - text_width) // 2
-
-        position = (x_position, y_position + (line_height - text_height) // 2)
-        self.draw.text(position, text, font=self.font, fill=255)
-
-        self.disp.image(self.image)
-        self.disp.show()
+        self._draw_text(text, y_position, line_height, justification)
+        self._show_image()
 
     def display_text_center_with_border(self, text):
-        self.clear_screen()
+        self._clear_image()
         border_size = self.config_manager.get_border_size()
         self.draw.rectangle((border_size, border_size, self.width - border_size - 1, self.height - border_size - 1),
                             outline=255, fill=0)
-        bbox = self.draw.textbbox((0, 0), text, font=self.font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        position = ((self.width - text_width) // 2, (self.height - text_height) // 2)
-        self.draw.text(position, text, font=self.font, fill=255)
-        self.disp.image(self.image)
-        self.disp.show()
+        self._draw_text(text, 0, self.height)
+        self._show_image()
 
 
 class LCD2004Display:
-    def __init__(self):
+    def __init__(self, transport=TRANSPORT_BLOCK):
         # Note you need to change the bus number to 0 if running on a revision 1 Raspberry Pi.
-        self.bus = smbus.SMBus(1)
+        self.bus = i2c_bus.get_smbus(1)
+        self.lock = i2c_bus.smbus_lock(1)
+        self.transport = PCF8574Transport(self.bus, transport)
         self.BLEN = 1  # turn on/off background light
         self.PCF8574_address = 0x27  # I2C address of the PCF8574 chip.
         self.PCF8574A_address = 0x3f  # I2C address of the PCF8574A chip.
@@ -186,69 +297,34 @@ class LCD2004Display:
         self.bus.write_byte(addr, temp)
 
     def send_command(self, comm):
-        # Send bit7-4 firstly
-        buf = comm & 0xF0
-        buf |= 0x04  # RS = 0, RW = 0, EN = 1
-        self.write_word(self.LCD_ADDR, buf)
-        time.sleep(0.002)
-        buf &= 0xFB  # Make EN = 0
-        self.write_word(self.LCD_ADDR, buf)
-        # Send bit3-0 secondly
-        buf = (comm & 0x0F) << 4
-        buf |= 0x04  # RS = 0, RW = 0, EN = 1
-        self.write_word(self.LCD_ADDR, buf)
-        time.sleep(0.002)
-        buf &= 0xFB  # Make EN = 0
-        self.write_word(self.LCD_ADDR, buf)
+        with self.lock:
+            self._send_command(comm)
+
+    def _send_command(self, comm):
+        self.transport.command(self.LCD_ADDR, comm, self.BLEN == 1)
 
     def send_data(self, data):
-        # Send bit7-4 firstly
-        buf = data & 0xF0
-        buf |= 0x05  # RS = 1, RW = 0, EN = 1
-        self.write_word(self.LCD_ADDR, buf)
-        time.sleep(0.002)
-        buf &= 0xFB  # Make EN = 0
-        self.write_word(self.LCD_ADDR, buf)
-        # Send bit3-0 secondly
-        buf = (data & 0x0F) << 4
-        buf |= 0x05  # RS = 1, RW = 0, EN = 1
-        self.write_word(self.LCD_ADDR, buf)
-        time.sleep(0.002)
-        buf &= 0xFB  # Make EN = 0
-        self.write_word(self.LCD_ADDR, buf)
-
-    def i2c_scan(self):
-        cmd = "i2cdetect -y 1 |awk \'NR>1 {$1=\"\";print}\'"
-        result = subprocess.check_output(cmd, shell=True).decode()
-        result = result.replace("\n", "").replace(" --", "")
-        i2c_list = result.split(' ')
-        return i2c_list
+        with self.lock:
+            self._send_data(data)
+
+    def _send_data(self, data):
+        self.transport.send(self.LCD_ADDR, [(data, True)], self.BLEN == 1)
 
     def init_lcd(self, addr=None, bl=1):
-        i2c_list = self.i2c_scan()
         if addr is None:
-            if '27' in i2c_list:
-                self.LCD_ADDR = self.PCF8574_address
-            elif '3f' in i2c_list:
-                self.LCD_ADDR = self.PCF8574A_address
-            else:
+            found = i2c_bus.probe_addresses([self.PCF8574_address, self.PCF8574A_address])
+            if not found:
                 raise IOError("I2C address 0x27 or 0x3f not found.")
+            self.LCD_ADDR = found[0]
         else:
             self.LCD_ADDR = addr
-            if str(hex(addr)).strip('0x') not in i2c_list:
+            if not i2c_bus.probe(addr):
                 raise IOError(f"I2C address {str(hex(addr))} not found.")
         self.BLEN = bl
         try:
-            self.send_command(0x33)  # Must initialize to 8-line mode at first
-            time.sleep(0.005)
-            self.send_command(0x32)  # Then initialize to 4-line mode
-            time.sleep(0.005)
-            self.send_command(0x28)  # 2 Lines & 5*7 dots
-            time.sleep(0.005)
-            self.send_command(0x0C)  # Enable display without cursor
-            time.sleep(0.005)
-            self.send_command(0x01)  # Clear Screen
-            self.bus.write_byte(self.LCD_ADDR, 0x08)
+            with self.lock:
+                initialize(self.transport, self.LCD_ADDR, self.BLEN == 1)
+                self.bus.write_byte(self.LCD_ADDR, 0x08)
         except:
             return False
         else:
@@ -258,8 +334,8 @@ class LCD2004Display:
         self.send_command(0x01)  # Clear Screen
 
     def openlight(self):  # Enable the backlight
-        self.bus.write_byte(self.LCD_ADDR, 0x08)
-        self.bus.close()
+        with self.lock:
+            self.bus.write_byte(self.LCD_ADDR, 0x08)
 
     def write(self, x, y, str):
         if x < 0:
@@ -272,9 +348,9 @@ class LCD2004Display:
             y = self.lcd_rows - 1
         # Move cursor
         addr = 0x80 + 0x40 * y + x
-        self.send_command(addr)
-        for chr in str:
-            self.send_data(ord(chr))
+        # Cursor move and text go out as one transfer
+        with self.lock:
+            self.transport.send(self.LCD_ADDR, [(addr, False)] + [(ord(chr), True) for chr in str], self.BLEN == 1)
 
     def display_num(self, x, y, num):
         addr = 0x80 + 0x40 * y + x
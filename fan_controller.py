@@ -1,32 +1,40 @@
-import board
-import adafruit_emc2101
+import i2c_bus
+import devices
 
 
 class EMC2101:
     def __init__(self, i2c_address=0x4C):
-        self.i2c = board.I2C()
-        self.sensor = adafruit_emc2101.EMC2101(self.i2c)
+        self.i2c = i2c_bus.get_bus(i2c_bus.MAIN_BUS)
+        self.lock = i2c_bus.bus_lock(i2c_bus.MAIN_BUS)
+        # The Adafruit driver is only imported once a fan controller is created
+        self.sensor = i2c_bus.get_device(i2c_bus.MAIN_BUS, i2c_address,
+                                         devices.load_driver('adafruit_emc2101').EMC2101)
 
     def read_internal_temp(self):
-        temp = self.sensor.internal_temperature
+        with self.lock:
+            temp = self.sensor.internal_temperature
         return temp
 
     def read_external_temp(self):
-        temp = self.sensor.external_temperature
+        with self.lock:
+            temp = self.sensor.external_temperature
         return temp
 
     def read_fan_speed(self):
-        fan_speed = self.sensor.fan_speed
+        with self.lock:
+            fan_speed = self.sensor.fan_speed
         return fan_speed
 
     def set_fan_speed(self, speed):
         if 0 <= speed <= 100:
-            self.sensor.manual_fan_speed = speed
+            with self.lock:
+                self.sensor.manual_fan_speed = speed
         else:
             raise ValueError("Fan speed must be between 0 and 100")
 
     def read_status(self):
-        status = self.sensor.devstatus
+        with self.lock:
+            status = self.sensor.devstatus
         status_description = []
         if status & 0x01:
             status_description.append("Internal temperature sensor fault")
@@ -42,5 +50,67 @@ class EMC2101:
         return ", ".join(status_description)
 
     def read_config(self):
-        config = self.sensor.devconfig
+        with self.lock:
+            config = self.sensor.devconfig
         return config
+
+
+class EMC2101Registers:
+    # Raw register access, used by the self test
+    I2C_ADDRESS = 0x4C
+    INTERNAL_TEMP_REG = 0x00
+    EXTERNAL_TEMP_REG = 0x01
+    FAN_SPEED_REG = 0x10
+    FAN_SPEED_SET_REG = 0x11
+    STATUS_REG = 0x02
+    CONFIG_REG = 0x03
+    RESET_REG = 0x05
+    PRODUCT_ID_REG = 0xFD
+
+    def __init__(self, i2c, i2c_address=I2C_ADDRESS):
+        self.device = devices.load_driver('adafruit_bus_device.i2c_device').I2CDevice(i2c, i2c_address)
+        self.lock = i2c_bus.bus_lock(i2c_bus.MAIN_BUS)
+
+    def read_register(self, register):
+        with self.lock, self.device:
+            self.device.write(bytes([register]))
+            result = bytearray(1)
+            self.device.readinto(result)
+        return result[0]
+
+    def read_status(self):
+        status = self.read_register(self.STATUS_REG)
+        status_description = []
+
+        if status & 0x01:
+            status_description.append("Internal temperature sensor fault")
+        if status & 0x02:
+            status_description.append("External temperature sensor fault")
+        if status & 0x04:
+            status_description.append("Fan speed fault")
+        if status & 0x08:
+            status_description.append("Device reset")
+
+        if not status_description:
+            status_description.append("No faults")
+
+        return ", ".join(status_description)
+
+    def read_config(self):
+        config = self.read_register(self.CONFIG_REG)
+        config_description = []
+
+        if config & 0x01:
+            config_description.append("Device enabled")
+        else:
+            config_description.append("Device disabled")
+        if config & 0x02:
+            config_description.append("Fan control enabled")
+        else:
+            config_description.append("Fan control disabled")
+        if config & 0x04:
+            config_description.append("Temperature monitoring enabled")
+        else:
+            config_description.append("Temperature monitoring disabled")
+
+        return ", ".join(config_description)
@@ -0,0 +1,100 @@
+import clock
+
+# PCF8574 backpack pins: P0 = RS, P1 = RW, P2 = EN, P3 = backlight, P4-P7 = D4-D7
+RS = 0x01
+EN = 0x04
+BACKLIGHT = 0x08
+
+CLEAR_DISPLAY = 0x01
+RETURN_HOME = 0x02
+# Clear and home take 1.52ms, every other instruction 37us (HD44780U datasheet, table 6)
+LONG_INSTRUCTIONS = (CLEAR_DISPLAY, RETURN_HOME)
+LONG_INSTRUCTION_DELAY = 0.002
+
+FUNCTION_SET_4BIT_2LINE = 0x28
+DISPLAY_ON = 0x0C
+ENTRY_MODE_INCREMENT = 0x06
+
+TRANSPORT_BLOCK = 'block'  # One I2C write per batch of instructions
+TRANSPORT_BYTE = 'byte'  # One I2C write per PCF8574 output byte
+TRANSPORTS = (TRANSPORT_BLOCK, TRANSPORT_BYTE)
+
+
+def strobe_sequence(value, rs=False, backlight=True, out=None):
+    # The four PCF8574 output bytes that clock one 8 bit value into the HD44780 in 4 bit mode: each
+    # nibble is put on D4-D7 with EN high, then EN is dropped to latch it.
+    # Every byte takes 9 SCL cycles on the wire (90us at 100kHz, 22.5us at 400kHz), so EN is always high
+    # far longer than the 450ns minimum and the four bytes of one instruction outlast its 37us execution time.
+    if out is None:
+        out = bytearray()
+    flags = (RS if rs else 0) | (BACKLIGHT if backlight else 0)
+    high = (value & 0xF0) | flags
+    low = ((value << 4) & 0xF0) | flags
+    out += bytes((high | EN, high, low | EN, low))
+    return out
+
+
+class PCF8574Transport:
+    # Sends HD44780 instructions and data through a PCF8574 on an smbus2 SMBus.
+    # items are (value, rs) pairs, rs False for an instruction and True for a character. message builds the
+    # write message for a block transfer, smbus2's i2c_msg.write unless another bus implementation is given.
+    def __init__(self, bus, mode=TRANSPORT_BLOCK, message=None):
+        if mode not in TRANSPORTS:
+            raise ValueError(f"Invalid transport. Supported transports: {', '.join(TRANSPORTS)}")
+        self.bus = bus
+        self.mode = mode
+        self.message = message
+        self.transactions = 0
+        self.bytes_sent = 0
+
+    def nibble(self, address, value, backlight=True):
+        # Only the high nibble of value, for the 8 bit function sets at the start of initialize()
+        flags = (value & 0xF0) | (BACKLIGHT if backlight else 0)
+        self._write(address, bytes((flags | EN, flags)))
+
+    def command(self, address, value, backlight=True):
+        self.send(address, [(value, False)], backlight)
+
+    def text(self, address, text, backlight=True):
+        self.send(address, [(ord(character), True) for character in text], backlight)
+
+    def send(self, address, items, backlight=True):
+        sequence = bytearray()
+        for value, rs in items:
+            strobe_sequence(value, rs, backlight, sequence)
+            if not rs and value in LONG_INSTRUCTIONS:
+                # Nothing else may be sent until a clear or home has finished
+                self._write(address, sequence)
+                sequence = bytearray()
+                clock.sleep(LONG_INSTRUCTION_DELAY)
+        if sequence:
+            self._write(address, sequence)
+
+    def _write(self, address, sequence):
+        if self.mode == TRANSPORT_BLOCK:
+            if self.message is None:
+                # smbus2 is only imported once a block transfer needs it
+                from smbus2 import i2c_msg
+                self.message = i2c_msg.write
+            self.bus.i2c_rdwr(self.message(address, sequence))
+            self.transactions += 1
+        else:
+            for byte in sequence:
+                self.bus.write_byte(address, byte)
+            self.transactions += len(sequence)
+        self.bytes_sent += len(sequence)
+
+    def stats(self):
+        return {'mode': self.mode, 'transactions': self.transactions, 'bytes': self.bytes_sent}
+
+
+def initialize(transport, address, backlight=True):
+    # Initialization by instruction into 4 bit mode, HD44780U datasheet figure 24
+    transport.nibble(address, 0x30, backlight)
+    clock.sleep(0.0045)
+    transport.nibble(address, 0x30, backlight)
+    clock.sleep(0.00015)
+    transport.nibble(address, 0x30, backlight)
+    transport.nibble(address, 0x20, backlight)
+    transport.send(address, [(FUNCTION_SET_4BIT_2LINE, False), (DISPLAY_ON, False), (CLEAR_DISPLAY, False),
+                             (ENTRY_MODE_INCREMENT, False)], backlight)
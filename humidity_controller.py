@@ -1,30 +1,37 @@
-import time
-from fan_controller import EMC2101
+import clock
 
 
 class HumidityController:
-    def __init__(self):
+    # emc2101 is a fan_controller.EMC2101, made here at its default address when not given
+    def __init__(self, emc2101=None):
         self.fan_engaged = False
         self.fan_engaged_time = 0
-        self.start_time = time.time()
+        self.start_time = clock.monotonic()
         self.fan_engage_start_time = None
-        self.emc2101 = EMC2101()
+        if emc2101 is None:
+            from fan_controller import EMC2101
+            emc2101 = EMC2101()
+        self.emc2101 = emc2101
 
     def engage_fan(self):
         if not self.fan_engaged:
             # Put code here to start fan...
             self.emc2101.set_fan_speed(100)
             self.fan_engaged = True
+            self.fan_engage_start_time = clock.monotonic()
             return True
         else:
             return False
 
     def disengage_fan(self):
         if self.fan_engaged:
-            # Put code here to stop the fan.
-            self.fan_engaged = False
+            # Put code here to stop the fan. Still engaged until the write goes through, so a failed stop is retried
             self.emc2101.set_fan_speed(0)
-            last_run_time = time.time() - self.start_time
+            self.fan_engaged = False
+            # Run time of this start, fan_engaged_time adds up every run since the controller was created
+            last_run_time = clock.monotonic() - self.fan_engage_start_time
+            self.fan_engaged_time += last_run_time
+            self.fan_engage_start_time = None
             return True, last_run_time
         else:
             return False, None
@@ -42,5 +49,5 @@ class HumidityController:
         print("Temperature:", temp)
         print("Fan Engaged:", self.fan_engaged)
         # rpm = 1200 if self.fan_engaged else 0  # Example RPM values
-        last_run_time = time.time() - self.start_time
+        last_run_time = clock.monotonic() - self.start_time
         return status, config, rpm, last_run_time
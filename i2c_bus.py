@@ -0,0 +1,171 @@
+import os
+import json
+import threading
+
+MAIN_BUS = 'main'  # Hardware I2C on board.SCL / board.SDA (/dev/i2c-1)
+EXTERNAL_BUS = 'external'  # Hardware I2C on board.D27 / board.D22
+BITBANG_BUS = 'bitbang'  # Bit-banged I2C on board.D27 / board.D22
+
+# Handles that drive the same wires share one lock
+PHYSICAL_BUSES = {
+    MAIN_BUS: 'i2c-1',
+    EXTERNAL_BUS: 'd27-d22',
+    BITBANG_BUS: 'd27-d22',
+}
+SMBUS_PHYSICAL_BUSES = {1: 'i2c-1'}
+
+# Probe results only hold until the next reboot, the boot id tells a stale cache file apart
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+PROBE_CACHE_FILE = '/run/dehydrator/i2c_probe.json'
+# Same ranges where i2cdetect reads instead of sending a quick write, which can corrupt some EEPROMs
+READ_PROBE_RANGES = (range(0x30, 0x38), range(0x50, 0x60))
+
+_registry_lock = threading.Lock()
+_buses = {}
+_smbuses = {}
+_devices = {}
+_locks = {}
+_probe_lock = threading.Lock()
+_probe_cache = None
+
+
+def _open_bus(name):
+    # Blinka and the bus drivers are only imported once a bus is opened
+    if name not in PHYSICAL_BUSES:
+        raise ValueError(f"Invalid bus name. Supported buses: {', '.join(PHYSICAL_BUSES)}")
+    import board
+    if name == MAIN_BUS:
+        import busio
+        return busio.I2C(board.SCL, board.SDA)
+    elif name == EXTERNAL_BUS:
+        import busio
+        return busio.I2C(board.D27, board.D22)
+    else:
+        # Only needed when a device on the bit-banged bus is configured
+        import adafruit_bitbangio
+        return adafruit_bitbangio.I2C(board.D27, board.D22)
+
+
+def _physical_lock(physical_bus):
+    with _registry_lock:
+        if physical_bus not in _locks:
+            _locks[physical_bus] = threading.RLock()
+        return _locks[physical_bus]
+
+
+def bus_lock(name):
+    # Hold this around every transaction, or group of transactions, on the bus
+    if name not in PHYSICAL_BUSES:
+        raise ValueError(f"Invalid bus name. Supported buses: {', '.join(PHYSICAL_BUSES)}")
+    return _physical_lock(PHYSICAL_BUSES[name])
+
+
+def smbus_lock(number=1):
+    return _physical_lock(SMBUS_PHYSICAL_BUSES.get(number, f'i2c-{number}'))
+
+
+def get_bus(name):
+    lock = bus_lock(name)
+    with lock:
+        if name not in _buses:
+            _buses[name] = _open_bus(name)
+        return _buses[name]
+
+
+def get_smbus(number=1):
+    with smbus_lock(number):
+        if number not in _smbuses:
+            import smbus2
+            _smbuses[number] = smbus2.SMBus(number)
+        return _smbuses[number]
+
+
+def get_device(name, address, factory):
+    # One driver instance per bus and address, factory(i2c) builds it the first time
+    key = (name, address)
+    with bus_lock(name):
+        if key not in _devices:
+            _devices[key] = factory(get_bus(name))
+        return _devices[key]
+
+
+def _boot_id():
+    try:
+        with open(BOOT_ID_FILE) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _load_probe_cache():
+    global _probe_cache
+    if _probe_cache is None:
+        _probe_cache = {}
+        boot_id = _boot_id()
+        try:
+            with open(PROBE_CACHE_FILE) as f:
+                saved = json.load(f)
+            if boot_id is not None and saved.get('boot_id') == boot_id:
+                _probe_cache = saved.get('results', {})
+        except (OSError, ValueError):
+            pass
+    return _probe_cache
+
+
+def _save_probe_cache():
+    boot_id = _boot_id()
+    if boot_id is None:
+        return
+    temp_file = PROBE_CACHE_FILE + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(PROBE_CACHE_FILE), exist_ok=True)
+        with open(temp_file, 'w') as f:
+            json.dump({'boot_id': boot_id, 'results': _probe_cache}, f)
+        os.replace(temp_file, PROBE_CACHE_FILE)
+    except OSError as e:
+        print(f"Error saving I2C probe cache: {e}")
+
+
+def _probe_address(bus, address):
+    try:
+        if any(address in addresses for addresses in READ_PROBE_RANGES):
+            bus.read_byte(address)
+        else:
+            bus.write_quick(address)
+    except OSError:
+        return False
+    return True
+
+
+def probe_addresses(addresses, number=1, refresh=False):
+    # Returns the addresses that answered, in the order given. Only addresses that have not been
+    # probed since boot go on the bus unless refresh is set.
+    with smbus_lock(number), _probe_lock:
+        cache = _load_probe_cache()
+        probed = False
+        for address in addresses:
+            key = f"{number}:{address:#04x}"
+            if refresh or key not in cache:
+                cache[key] = _probe_address(get_smbus(number), address)
+                probed = True
+        if probed:
+            _save_probe_cache()
+        return [address for address in addresses if cache[f"{number}:{address:#04x}"]]
+
+
+def probe(address, number=1, refresh=False):
+    return bool(probe_addresses([address], number, refresh))
+
+
+def close_all():
+    with _registry_lock:
+        buses = list(_buses.values())
+        smbuses = list(_smbuses.values())
+        _buses.clear()
+        _smbuses.clear()
+        _devices.clear()
+    for bus in buses:
+        if hasattr(bus, 'deinit'):
+            bus.deinit()
+    for bus in smbuses:
+        bus.close()
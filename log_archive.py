@@ -0,0 +1,64 @@
+import os
+import gzip
+
+# Compression for rotated log archives, by the log_compression setting. A compressed archive keeps the name of
+# the plain one with a suffix added, log.csv.3 becomes log.csv.3.gz.
+GZIP = 'gzip'
+LZMA = 'lzma'
+NONE = 'none'
+COMPRESSIONS = (GZIP, LZMA, NONE)
+SUFFIXES = {GZIP: '.gz', LZMA: '.xz'}
+COPY_SIZE = 65536
+
+
+def _module(suffix):
+    if suffix == SUFFIXES[LZMA]:
+        # Python can be built without lzma, only needed once an archive uses it
+        import lzma
+        return lzma
+    return gzip
+
+
+def _suffix(path):
+    for suffix in SUFFIXES.values():
+        if path.endswith(suffix):
+            return suffix
+    return None
+
+
+def is_compressed(path):
+    return _suffix(path) is not None
+
+
+def find_log(path):
+    # The file holding a log or archive: path itself or its compressed copy, None when there is neither
+    for candidate in [path] + [path + suffix for suffix in SUFFIXES.values()]:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def open_log(path, mode='rb', **kwargs):
+    # Opens a log or archive by its plain name and decompresses it as it is read. Text needs mode 'rt',
+    # seeking a compressed file decompresses up to the offset.
+    found = find_log(path)
+    if found is None:
+        raise FileNotFoundError(f"No log file {path}")
+    suffix = _suffix(found)
+    if suffix is None:
+        return open(found, mode, **kwargs)
+    return _module(suffix).open(found, mode, **kwargs)
+
+
+def compress_file(f_in, target, compression):
+    # Writes a compressed copy of the open binary file f_in to target and syncs it, so it is safe to remove the
+    # source afterwards. Taking the open file rather than a name keeps the bytes tied to one inode.
+    with open(target, 'wb') as raw:
+        with _module(SUFFIXES[compression]).open(raw, 'wb') as f_out:
+            while True:
+                chunk = f_in.read(COPY_SIZE)
+                if not chunk:
+                    break
+                f_out.write(chunk)
+        raw.flush()
+        os.fsync(raw.fileno())
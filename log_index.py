@@ -0,0 +1,203 @@
+import os
+import json
+import threading
+from log_archive import find_log, open_log, is_compressed
+
+BLOCK_SIZE = 4096
+INDEX_VERSION = 1
+TIMESTAMP_LENGTH = 19  # 2024-06-01 12:00:00
+
+
+def line_timestamp(line):
+    # Timestamps are fixed width local time, so they sort in time order and are compared as strings
+    if len(line) > TIMESTAMP_LENGTH and line[TIMESTAMP_LENGTH] == ',' and line[:1].isdigit():
+        return line[:TIMESTAMP_LENGTH]
+    return None
+
+
+class LogIndex:
+    # Sparse index of the CSV log and its archives. Every block_size bytes of a file gets an entry with the byte
+    # offset of its first line and the earliest and latest timestamp in it, so a time range query only reads
+    # the blocks that can hold matching rows. Files are keyed by archive number, 0 is the live file, and each
+    # remembers its inode, which survives the renames of a rollover, and how far it has been indexed.
+    # Offsets are into the uncompressed text, a compressed archive is decompressed up to them when read.
+    def __init__(self, filename, backup_count, block_size=BLOCK_SIZE):
+        self.filename = filename
+        self.index_file = filename + '.index'
+        self.backup_count = backup_count
+        self.block_size = block_size
+        self.lock = threading.RLock()
+        # The log writer and the archive compressor both save, one at a time through the temp file
+        self.save_lock = threading.Lock()
+        self.files = {}
+        self.dirty = False
+        self.load()
+
+    def file_name(self, number):
+        return self.filename if number == 0 else f'{self.filename}.{number}'
+
+    def load(self):
+        try:
+            with open(self.index_file) as f:
+                data = json.load(f)
+            if data['version'] == INDEX_VERSION and data['block_size'] == self.block_size:
+                self.files = {int(number): entry for number, entry in data['files'].items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            self.files = {}
+
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                data = json.dumps({'version': INDEX_VERSION, 'block_size': self.block_size, 'files': self.files})
+                self.dirty = False
+            temp_file = self.index_file + '.tmp'
+            try:
+                with open(temp_file, 'w') as f:
+                    f.write(data)
+                os.replace(temp_file, self.index_file)
+            except OSError as e:
+                print(f"Error saving log index: {e}")
+
+    def sync(self):
+        # Lines the index up with the files on disk. Entries follow their inode when files were rotated after the
+        # index was last saved, a file that shrank or is unknown is scanned again and one that grew has its tail
+        # indexed. Called once at startup, after that record() and rotate() keep it up to date.
+        with self.lock:
+            by_inode = {entry['inode']: entry for entry in self.files.values()}
+            files = {}
+            for number in range(self.backup_count + 1):
+                path = find_log(self.file_name(number))
+                if path is None:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entry = by_inode.get(stat.st_ino)
+                if is_compressed(path):
+                    # Compressed archives never change, and their size on disk is not the size of the text
+                    if entry is None:
+                        entry = self._new_entry(stat.st_ino)
+                        self._scan(number, entry)
+                    files[number] = entry
+                    continue
+                if entry is None or entry['size'] > stat.st_size:
+                    entry = self._new_entry(stat.st_ino)
+                files[number] = entry
+                if entry['size'] < stat.st_size:
+                    self._scan(number, entry)
+            if files != self.files:
+                self.dirty = True
+            self.files = files
+
+    @staticmethod
+    def _new_entry(inode):
+        # first and last span every block, so a file outside the range is passed over without looking at them
+        return {'inode': inode, 'size': 0, 'first': None, 'last': None, 'blocks': []}
+
+    def _scan(self, number, entry):
+        try:
+            with open_log(self.file_name(number), 'rb') as f:
+                f.seek(entry['size'])
+                offset = entry['size']
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Still being written, or cut short by a power cut
+                        break
+                    self._add_line(entry, offset, line)
+                    offset += len(line)
+        except (OSError, EOFError) as e:
+            print(f"Error indexing {self.file_name(number)}: {e}")
+        self.dirty = True
+
+    def _add_line(self, entry, offset, line):
+        blocks = entry['blocks']
+        if not blocks or offset - blocks[-1][0] >= self.block_size:
+            blocks.append([offset, None, None])
+        timestamp = line_timestamp(line[:TIMESTAMP_LENGTH + 1].decode('ascii', 'replace'))
+        if timestamp is not None:
+            block = blocks[-1]
+            if block[1] is None or timestamp < block[1]:
+                block[1] = timestamp
+            if block[2] is None or timestamp > block[2]:
+                block[2] = timestamp
+            if entry['first'] is None or timestamp < entry['first']:
+                entry['first'] = timestamp
+            if entry['last'] is None or timestamp > entry['last']:
+                entry['last'] = timestamp
+        entry['size'] = offset + len(line)
+
+    def record(self, position, text):
+        # The log handler wrote text at byte position of the live file
+        with self.lock:
+            entry = self.files.get(0)
+            if entry is None or entry['size'] != position:
+                # Something else wrote to the file, the header for one, index it from the file itself
+                self.sync()
+                return
+            for line in text.encode('utf-8').splitlines(keepends=True):
+                self._add_line(entry, entry['size'], line)
+            self.dirty = True
+
+    def rotate(self):
+        # The live file has become archive 1 and every archive has moved up one, the last one is gone
+        with self.lock:
+            self.files = {number + 1: entry for number, entry in self.files.items() if number < self.backup_count}
+            try:
+                self.files[0] = self._new_entry(os.stat(self.filename).st_ino)
+            except OSError:
+                pass
+            self.dirty = True
+
+    def compress(self, number, inode):
+        # The archive has been swapped for a compressed copy, same text in a new file
+        with self.lock:
+            entry = self.files.get(number)
+            if entry is not None:
+                entry['inode'] = inode
+                self.dirty = True
+
+    def locate(self, entry):
+        # (plain file name, inode) of the file an entry from blocks() is in now, None once it has been trimmed.
+        # Entries move with rotate() and take the new inode in compress(), inode numbers alone are reused.
+        with self.lock:
+            for number, current in self.files.items():
+                if current is entry:
+                    return self.file_name(number), entry['inode']
+            return None
+
+    def remove(self, number):
+        with self.lock:
+            if self.files.pop(number, None) is not None:
+                self.dirty = True
+
+    def blocks(self, start=None, end=None):
+        # (entry, offset, end offset) for each run of blocks that may hold rows with start <= time < end, oldest
+        # file first. Adjacent matching blocks are merged so they are read in one go. locate(entry) gives the file
+        # holding them, which a rollover or compression may have changed since.
+        runs = []
+        with self.lock:
+            for number in sorted(self.files, reverse=True):
+                entry = self.files[number]
+                if entry['first'] is None or (start is not None and entry['last'] < start) or \
+                        (end is not None and entry['first'] >= end):
+                    continue
+                blocks = entry['blocks']
+                run = None
+                for i, (offset, first, last) in enumerate(blocks):
+                    if first is None or (start is not None and last < start) or (end is not None and first >= end):
+                        continue
+                    block_end = blocks[i + 1][0] if i + 1 < len(blocks) else entry['size']
+                    if run is not None and run[2] == offset:
+                        run[2] = block_end
+                    else:
+                        run = [entry, offset, block_end]
+                        runs.append(run)
+        return [tuple(run) for run in runs]
+
+    def stats(self):
+        with self.lock:
+            return {'files': len(self.files), 'blocks': sum(len(entry['blocks']) for entry in self.files.values()),
+                    'indexed_bytes': sum(entry['size'] for entry in self.files.values())}
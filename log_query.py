@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Time range queries over the CSV log, its archives and the reading store. Run from the repository root:
+#   python3 log_query.py "2024-06-04" "2024-06-05 12:00" --sensor Internal
+import os
+import time
+import heapq
+import argparse
+import clock
+from logger import BACKUP_COUNT
+from log_index import LogIndex, line_timestamp, TIMESTAMP_LENGTH
+from log_archive import open_log
+from reading_store import ReadingStore, SENSOR_IDS, FLAG_SHUTDOWN
+from config_manager import ConfigManager
+
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+
+def parse_time(value):
+    # Seconds since the epoch, or a local time string down to the day, as a log timestamp
+    if value is None or isinstance(value, str) and len(value) == TIMESTAMP_LENGTH:
+        return value
+    if isinstance(value, (int, float)):
+        return clock.timestamp(value)
+    for time_format in TIME_FORMATS:
+        try:
+            return clock.timestamp(time.mktime(time.strptime(value, time_format)))
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid time {value!r}, expected YYYY-MM-DD [HH:MM[:SS]]")
+
+
+def _open_inode(path, inode):
+    # The log or archive at path, if it is still the file with this inode
+    try:
+        f = open_log(path, 'rb')
+    except FileNotFoundError:
+        return None
+    if os.fstat(f.fileno()).st_ino != inode:
+        f.close()
+        return None
+    return f
+
+
+def _epoch(timestamp):
+    return None if timestamp is None else time.mktime(time.strptime(timestamp, TIME_FORMATS[0]))
+
+
+class LogQuery:
+    # Rows come back as (timestamp, name, id, message) tuples. Readings from the store are given the message
+    # the CSV log used to hold for them, so history from before and after the store reads the same.
+    def __init__(self, logfile, store=None, index=None):
+        self.store = store
+        if index is None:
+            # Somebody else's log, index whatever has been written since the logger last saved it
+            index = LogIndex(logfile, BACKUP_COUNT)
+            index.sync()
+        self.index = index
+        self.blocks_read = 0
+        self.bytes_read = 0
+
+    def log_rows(self, start=None, end=None, name=None):
+        # Seeks to each run of blocks the index says may match and reads only those, compressed archives are
+        # decompressed as far as the last of them
+        for entry, offset, end_offset in self.index.blocks(start, end):
+            try:
+                f = self._open(entry)
+                if f is None:
+                    # Trimmed since the index was read
+                    continue
+                with f:
+                    f.seek(offset)
+                    data = f.read(end_offset - offset)
+            except (OSError, EOFError):
+                continue
+            self.blocks_read += 1
+            self.bytes_read += len(data)
+            for line in data.decode('utf-8', 'replace').splitlines():
+                timestamp = line_timestamp(line)
+                if timestamp is None or (start is not None and timestamp < start) or \
+                        (end is not None and timestamp >= end):
+                    continue
+                row = line.split(',', 3)
+                if len(row) == 4 and (name is None or row[1] == name):
+                    yield tuple(row)
+
+    def _open(self, entry):
+        # Opens the file an index entry is for, checked by inode so offsets are never read from another file
+        located = self.index.locate(entry)
+        if located is None:
+            return None
+        path, inode = located
+        f = _open_inode(path, inode)
+        if f is not None:
+            return f
+        # The handler has renamed the files but not told the index yet, look for the inode on disk
+        for number in range(self.index.backup_count + 1):
+            f = _open_inode(self.index.file_name(number), inode)
+            if f is not None:
+                return f
+        return None
+
+    def store_rows(self, start=None, end=None, name=None):
+        if self.store is None or not self.store.segment_sizes or (name is not None and name not in SENSOR_IDS):
+            return
+        names = {sensor_id: sensor_name for sensor_name, sensor_id in SENSOR_IDS.items()}
+        readings = self.store.read_range(_epoch(start), _epoch(end), name)
+        for timestamp, sensor, flags, temperature, humidity in zip(
+                readings['time'].tolist(), readings['sensor'].tolist(), readings['flags'].tolist(),
+                readings['temperature'].tolist(), readings['humidity'].tolist()):
+            if flags & FLAG_SHUTDOWN:
+                # The CSV log has its own shutdown row
+                continue
+            yield (clock.timestamp(timestamp), names[sensor], f'{sensor:02d}',
+                   f"Temperature: {temperature:.1f}C, Humidity: {humidity:.1f}%")
+
+    def query(self, start=None, end=None, sensor=None):
+        # Rows with start <= timestamp < end in time order, sensor picks one Name column value. start and end are
+        # seconds since the epoch or local time strings.
+        start = parse_time(start)
+        end = parse_time(end)
+        return heapq.merge(self.log_rows(start, end, sensor), self.store_rows(start, end, sensor),
+                           key=lambda row: row[0])
+
+
+def query(start=None, end=None, sensor=None, logfile='log.csv', readings_dir='readings'):
+    store = ReadingStore(readings_dir, read_only=True)
+    return LogQuery(logfile, store).query(start, end, sensor)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print log rows between two local times')
+    parser.add_argument('start', nargs='?', help='YYYY-MM-DD [HH:MM[:SS]], default is the start of the log')
+    parser.add_argument('end', nargs='?', help='Exclusive, default is the end of the log')
+    parser.add_argument('--sensor', help='Only rows with this name, Internal, External, Fan or System')
+    parser.add_argument('--config', default='config.ini')
+    args = parser.parse_args()
+
+    config = ConfigManager(args.config).snapshot
+    log_query = LogQuery(config.logfile, ReadingStore(config.readings_dir, read_only=True))
+    started = time.perf_counter()
+    count = 0
+    for row in log_query.query(args.start, args.end, args.sensor):
+        print(','.join(row))
+        count += 1
+    print(f"{count} rows in {time.perf_counter() - started:.3f}s, {log_query.bytes_read} bytes of log read "
+          f"from {log_query.blocks_read} block runs, index {log_query.index.stats()}")
@@ -1,8 +1,315 @@
 import os
 import csv
 import time
+import clock
+import queue
 import logging
+import threading
 from logging.handlers import RotatingFileHandler
+from log_index import LogIndex
+from log_archive import SUFFIXES, find_log, compress_file
+
+# Archives are trimmed to max_archive_size long before there are this many, unless they are compressed and small
+BACKUP_COUNT = 100
+ARCHIVE_NAMES = ('',) + tuple(SUFFIXES.values())
+
+# fsync policies for BatchedLogWriter
+FSYNC_EVERY_BATCH = 'batch'
+FSYNC_INTERVAL = 'interval'
+FSYNC_NEVER = 'never'
+FSYNC_POLICIES = (FSYNC_EVERY_BATCH, FSYNC_INTERVAL, FSYNC_NEVER)
+
+_STOP = object()
+_FLUSH = object()
+
+
+class ArchivingRotatingFileHandler(RotatingFileHandler):
+    # Calls on_rollover after every rollover so archives are only checked when they change, and
+    # on_write(position, text) after every write with the byte offset it went to
+    def __init__(self, filename, on_rollover=None, on_write=None, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.on_rollover = on_rollover
+        self.on_write = on_write
+
+    def doRollover(self):
+        # RotatingFileHandler.doRollover, moving compressed archives up along with the plain ones
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if self.backupCount > 0:
+            for i in range(self.backupCount - 1, 0, -1):
+                for suffix in ARCHIVE_NAMES:
+                    source = f'{self.baseFilename}.{i}{suffix}'
+                    if os.path.exists(source):
+                        self.remove_archive(i + 1)
+                        os.rename(source, f'{self.baseFilename}.{i + 1}{suffix}')
+            self.remove_archive(1)
+            self.rotate(self.baseFilename, f'{self.baseFilename}.1')
+        if not self.delay:
+            self.stream = self._open()
+        if self.on_rollover is not None:
+            self.on_rollover()
+
+    def remove_archive(self, index):
+        for suffix in ARCHIVE_NAMES:
+            if os.path.exists(f'{self.baseFilename}.{index}{suffix}'):
+                os.remove(f'{self.baseFilename}.{index}{suffix}')
+
+    def emit(self, record):
+        # RotatingFileHandler.emit, keeping hold of where the line went
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            text = self.format(record) + self.terminator
+            position = self.stream.tell()
+            self.stream.write(text)
+            self.flush()
+            if self.on_write is not None:
+                self.on_write(position, text)
+        except Exception:
+            self.handleError(record)
+
+    def write_batch(self, lines):
+        # One write and one flush for the whole batch, rolling over first if the batch would overflow the file
+        text = ''.join(line + self.terminator for line in lines)
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            position = self.stream.tell()
+            if self.maxBytes > 0 and position > 0 and \
+                    position + len(text.encode(self.encoding or 'utf-8')) >= self.maxBytes:
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+                # The batch goes at the start of the new file
+                position = self.stream.tell()
+            self.stream.write(text)
+            self.stream.flush()
+            if self.on_write is not None:
+                self.on_write(position, text)
+        finally:
+            self.release()
+
+    def sync(self):
+        self.acquire()
+        try:
+            if self.stream is not None:
+                os.fsync(self.stream.fileno())
+        finally:
+            self.release()
+
+
+class BatchedLogWriter(threading.Thread):
+    # Writes log entries on its own thread in batches, so the control loop never waits on the SD card.
+    # A batch is written once it holds batch_size entries or its first entry is batch_interval seconds old.
+    # When the queue is full entries are dropped, or with block=True the caller waits up to block_timeout.
+    # Batching stays on the real clock even when the application runs on a simulated one, it paces the SD card.
+    # on_flush runs on the writer thread after every flush.
+    def __init__(self, handler, batch_size=50, batch_interval=5, fsync=FSYNC_INTERVAL, fsync_interval=60,
+                 max_queue=1000, block=False, block_timeout=0.1, on_flush=None):
+        super().__init__(name='log-writer', daemon=True)
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy. Supported policies: {', '.join(FSYNC_POLICIES)}")
+        self.handler = handler
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.block = block
+        self.block_timeout = block_timeout
+        self.on_flush = on_flush
+        self.queue = queue.Queue(maxsize=max_queue)
+
+        self.written_count = 0
+        self.batch_count = 0
+        self.fsync_count = 0
+        self.dropped_count = 0
+        self.blocked_count = 0
+        self.error_count = 0
+        self._last_sync = time.monotonic()
+
+    def submit(self, entry):
+        try:
+            self.queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            pass
+        if self.block:
+            self.blocked_count += 1
+            try:
+                self.queue.put(entry, timeout=self.block_timeout)
+                return True
+            except queue.Full:
+                pass
+        self.dropped_count += 1
+        return False
+
+    def flush(self, timeout=5, wait=True):
+        # Waits until everything submitted so far has been written. With wait=False the writer is only woken up
+        # to write it, for callers that must never wait on storage.
+        if not self.is_alive():
+            return False
+        if not wait:
+            return self.call(_FLUSH)
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def call(self, callback):
+        # Runs callback on the writer thread once the entries queued before it are written, without waiting.
+        # When the queue is full the writer is busy anyway and the call is dropped.
+        try:
+            self.queue.put_nowait(callback)
+            return True
+        except queue.Full:
+            return False
+
+    def stop(self, timeout=5):
+        if self.is_alive():
+            self.queue.put(_STOP)
+            self.join(timeout)
+
+    def run(self):
+        batch = []
+        deadline = None
+        running = True
+        while running:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            flushed = None
+            if item is _STOP:
+                running = False
+            elif item is _FLUSH or isinstance(item, threading.Event) or callable(item):
+                flushed = item
+            elif item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.batch_interval
+
+            if batch and (not running or flushed is not None or len(batch) >= self.batch_size
+                          or time.monotonic() >= deadline):
+                self._write(batch, force_sync=not running)
+                batch = []
+                deadline = None
+            if flushed is not None:
+                self._finish(flushed)
+
+    def _finish(self, item):
+        try:
+            if item is _FLUSH or isinstance(item, threading.Event):
+                if self.on_flush is not None:
+                    self.on_flush()
+            else:
+                item()
+        except (IOError, OSError) as e:
+            self.error_count += 1
+            print(f"Error flushing: {e}")
+        if isinstance(item, threading.Event):
+            item.set()
+
+    def _write(self, batch, force_sync=False):
+        try:
+            self.handler.write_batch(batch)
+            self.written_count += len(batch)
+            self.batch_count += 1
+            now = time.monotonic()
+            if (self.fsync == FSYNC_EVERY_BATCH
+                    or (self.fsync == FSYNC_INTERVAL and (force_sync or now - self._last_sync >= self.fsync_interval))):
+                self.handler.sync()
+                self.fsync_count += 1
+                self._last_sync = now
+        except (IOError, OSError) as e:
+            self.error_count += 1
+            print(f"Error writing to log file: {e}")
+
+    def stats(self):
+        return {'written': self.written_count, 'batches': self.batch_count, 'fsyncs': self.fsync_count,
+                'dropped': self.dropped_count, 'blocked': self.blocked_count, 'errors': self.error_count,
+                'queued': self.queue.qsize()}
+
+
+class ArchiveCompressor(threading.Thread):
+    # Compresses archives on its own thread after each rollover, so neither the control loop nor the log writer
+    # waits on it. The compressed copy is written next to the archive and swapped in under the handler lock,
+    # wherever rollovers have moved the archive to in the meantime.
+    def __init__(self, logger, compression):
+        super().__init__(name='log-compressor', daemon=True)
+        if compression not in SUFFIXES:
+            raise ValueError(f"Invalid compression. Supported compressions: {', '.join(SUFFIXES)}")
+        self.logger = logger
+        self.compression = compression
+        self.temp_file = logger.filename + '.compressing'
+        self._wake = threading.Event()
+        self._stopping = False
+
+        self.compressed_count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.error_count = 0
+        self.busy_time = 0.0
+
+    def request(self):
+        self._wake.set()
+
+    def stop(self, timeout=30):
+        # An archive left half compressed is done again after the next start
+        self._stopping = True
+        self._wake.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        # Archives left plain by an earlier run, or by a power cut, go first
+        try:
+            os.remove(self.temp_file)
+        except OSError:
+            pass
+        self.request()
+        while not self._stopping:
+            self._wake.wait()
+            self._wake.clear()
+            self.compress_pending()
+
+    def compress_pending(self):
+        while not self._stopping:
+            pending = self.logger.plain_archives()
+            if not pending:
+                return
+            index, inode, size = pending[0]
+            started = time.monotonic()
+            try:
+                source = self.logger.open_archive(index, inode)
+                if source is None:
+                    # Moved by a rollover since it was listed, list again
+                    continue
+                with source:
+                    compress_file(source, self.temp_file, self.compression)
+                compressed_size = os.path.getsize(self.temp_file)
+                replaced = self.logger.replace_archive(inode, self.temp_file, SUFFIXES[self.compression])
+            except OSError as e:
+                # Tried again after the next rollover
+                self.error_count += 1
+                print(f"Error compressing log archive: {e}")
+                return
+            finally:
+                self.busy_time += time.monotonic() - started
+            if replaced:
+                self.logger.index.save()
+                self.compressed_count += 1
+                self.bytes_in += size
+                self.bytes_out += compressed_size
+
+    def stats(self):
+        return {'compressed': self.compressed_count, 'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+                'ratio': round(self.bytes_in / self.bytes_out, 1) if self.bytes_out else None,
+                'errors': self.error_count, 'busy_time': round(self.busy_time, 2)}
 
 
 class Logger:
@@ -10,15 +317,29 @@ class Logger:
         self.filename = filename
         self.max_log_size = max_log_size
         self.max_archive_size = max_archive_size
-        self.filename = filename
-        self.max_log_size = max_log_size
-        self.max_archive_size = max_archive_size
+        self.index = None
+
+        # Archive sizes by index, filename.1 is the newest. Scanned once here, then kept up to date on rollover
+        self.archive_sizes = {}
+        self.scan_archives()
+        self.trim_archives()
 
         # Initialize the file before setting up logging
         self.initialize_file()
 
+        # Time index for log_query, brought up to date with whatever was written since it was last saved
+        self.index = LogIndex(filename, BACKUP_COUNT)
+        self.index.sync()
+        self.index.save()
+
         # Setup logging after the file has been initialized
         self.logger = self.setup_logging()
+        self.handler = self.logger.handlers[0]
+
+        # Entries are written synchronously until start_writer() is called
+        self.writer = None
+        # Archives stay plain until start_compressor() is called
+        self.compressor = None
 
     def initialize_file(self):
         print('Initializing log file....')
@@ -28,7 +349,7 @@ class Logger:
                 with open(self.filename, mode='w', newline='') as file:
                     writer = csv.writer(file)
                     writer.writerow(['Timestamp', 'Name', 'ID', 'Message'])
-                    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+                    timestamp = clock.timestamp()
                     writer.writerow([timestamp, '', '', 'Initial Log File Creation...'])
         except IOError as e:
             print(f"Error initializing log file: {e}")
@@ -38,29 +359,157 @@ class Logger:
         logger = logging.getLogger('CustomLogger')
         logger.handlers.clear()  # Clear existing handlers
         logger.setLevel(logging.INFO)
-        handler = RotatingFileHandler(self.filename, maxBytes=self.max_log_size, backupCount=10)
+        handler = ArchivingRotatingFileHandler(self.filename, on_rollover=self.manage_archives,
+                                               on_write=self.index.record, maxBytes=self.max_log_size,
+                                               backupCount=BACKUP_COUNT, encoding='utf-8')
         formatter = logging.Formatter('%(message)s')
         handler.setFormatter(formatter)
         logger.addHandler(handler)
         return logger
 
+    def archive_name(self, index):
+        return f'{self.filename}.{index}'
+
+    def scan_archives(self):
+        # Archive files are named filename.1 .. filename.BACKUP_COUNT, compressed or not, anything else is left
+        # alone. Sizes are what the archives take on disk, so compressed ones count at their compressed size.
+        self.archive_sizes = {}
+        for index in range(1, BACKUP_COUNT + 1):
+            path = find_log(self.archive_name(index))
+            if path is not None:
+                self.archive_sizes[index] = os.path.getsize(path)
+
+    def archive_size(self):
+        return sum(self.archive_sizes.values())
+
     def manage_archives(self):
-        # Archive files are named filename.log.1, filename.log.2, etc.
-        archive_files = [
-            f for f in os.listdir('.') if f.startswith(self.filename) and f != self.filename
-        ]
-        total_size = sum(os.path.getsize(f) for f in archive_files)
-
-        while total_size > self.max_archive_size and archive_files:
-            oldest_file = min(archive_files, key=os.path.getctime)
-            total_size -= os.path.getsize(oldest_file)
-            os.remove(oldest_file)
-            archive_files.remove(oldest_file)
+        # The handler has just shifted every archive up one index and written a new filename.1
+        self.index.rotate()
+        self.archive_sizes = {index + 1: size for index, size in self.archive_sizes.items() if index < BACKUP_COUNT}
+        try:
+            self.archive_sizes[1] = os.path.getsize(self.archive_name(1))
+        except OSError:
+            pass
+        # The new archive counts at its plain size until it is compressed, leave room for that rather than
+        # removing the compressed history it is about to fit in with
+        self.trim_archives(self.max_log_size if self.compressor is not None else 0)
+        self.index.save()
+        if self.compressor is not None:
+            self.compressor.request()
+
+    def plain_archives(self):
+        # (index, inode, size) of every archive still to be compressed, newest first
+        self.handler.acquire()
+        try:
+            pending = []
+            for index in sorted(self.archive_sizes):
+                try:
+                    stat = os.stat(self.archive_name(index))
+                except OSError:
+                    continue
+                pending.append((index, stat.st_ino, stat.st_size))
+            return pending
+        finally:
+            self.handler.release()
+
+    def open_archive(self, index, inode):
+        # Opens plain archive index for reading if it is still the file with this inode, None otherwise
+        self.handler.acquire()
+        try:
+            try:
+                f = open(self.archive_name(index), 'rb')
+            except OSError:
+                return None
+            if os.fstat(f.fileno()).st_ino != inode:
+                f.close()
+                return None
+            return f
+        finally:
+            self.handler.release()
+
+    def replace_archive(self, inode, compressed_file, suffix):
+        # Swaps a compressed copy in for the archive with this inode, False when it was trimmed meanwhile
+        self.handler.acquire()
+        try:
+            for index in self.archive_sizes:
+                path = self.archive_name(index)
+                try:
+                    if os.stat(path).st_ino != inode:
+                        continue
+                except OSError:
+                    continue
+                os.replace(compressed_file, path + suffix)
+                os.remove(path)
+                stat = os.stat(path + suffix)
+                self.archive_sizes[index] = stat.st_size
+                self.index.compress(index, stat.st_ino)
+                self.trim_archives(self.max_log_size if self.plain_archives() else 0)
+                return True
+            os.remove(compressed_file)
+            return False
+        finally:
+            self.handler.release()
+
+    def trim_archives(self, allowance=0):
+        # Remove the oldest archives until the rest fit in max_archive_size, plus allowance bytes
+        total_size = self.archive_size()
+        while total_size > self.max_archive_size + allowance and self.archive_sizes:
+            oldest = max(self.archive_sizes)
+            total_size -= self.archive_sizes.pop(oldest)
+            try:
+                for suffix in ARCHIVE_NAMES:
+                    if os.path.exists(self.archive_name(oldest) + suffix):
+                        os.remove(self.archive_name(oldest) + suffix)
+            except OSError as e:
+                print(f"Error removing log archive: {e}")
+            if self.index is not None:
+                self.index.remove(oldest)
+
+    def start_writer(self, **kwargs):
+        # Hand entries to a BatchedLogWriter thread, kwargs are passed on to it
+        self.writer = BatchedLogWriter(self.handler, on_flush=self.index.save, **kwargs)
+        self.writer.start()
+        return self.writer
+
+    def call_in_background(self, callback):
+        # Runs callback on the writer thread, or straight away when there is none
+        if self.writer is None:
+            callback()
+        else:
+            self.writer.call(callback)
+
+    def start_compressor(self, compression):
+        # Compress archives with log_archive compression on an ArchiveCompressor thread
+        self.compressor = ArchiveCompressor(self, compression)
+        self.compressor.start()
+        return self.compressor
 
     def log(self, timestamp, name, id, message):
         log_entry = f'{timestamp},{name},{id},{message}'
+        if self.writer is not None:
+            self.writer.submit(log_entry)
+            return
         try:
             self.logger.info(log_entry)
-            self.manage_archives()
         except IOError as e:
             print(f"Error writing to log file: {e}")
+
+    def flush(self, wait=True):
+        # With wait=False the writer thread does the flush and saves the index, the caller never waits on storage
+        if self.writer is not None:
+            self.writer.flush(wait=wait)
+            if not wait:
+                return
+        for handler in self.logger.handlers:
+            handler.flush()
+        self.index.save()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+        if self.compressor is not None:
+            self.compressor.stop()
+        for handler in self.logger.handlers:
+            handler.flush()
+        self.index.save()
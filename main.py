@@ -1,30 +1,59 @@
 # main.py
 
-import time
+import argparse
+import threading
 from datetime import timedelta
 from gpiozero import Button
-from LCD2004 import LCD2004Display
+import clock
 import system_status as SystemStatus
+import i2c_bus
+import devices
 from humidity_controller import HumidityController
+from dehydrator_controller import DehydratorController, ControlSettings, FAN_START, FAN_STOP, off_threshold
 from logger import Logger as Log
-from display import SSD1306Display, DisplayConfig
-from sensor import Sensor
-from config_manager import ConfigManager
-import sys
+from reading_store import ReadingStore, SENSOR_IDS, FLAG_FAN_ON
+from rollup import Rollups, retention_days
+from sensor import Sensor, HeaterScheduler, ReadingState, SHT4XHeater, heater_cooldown_time
+from sampler import SamplingService, ReadingSnapshot
+from scheduler import Scheduler
+from async_runtime import AsyncRuntime
+from config_manager import ConfigManager, ConfigWriter
 
 
 class MyDehydrator:
     def __init__(self, configuration):
         self.config_manager = configuration
         self.logger = Log
-        self.logfile = self.config_manager.get_config('logfile')
-        self.min_humidity = self.config_manager.get_int_config('min_humidity')
-        self.max_humidity = self.config_manager.get_int_config('max_humidity')
-        self.font = self.config_manager.get_config('font')
-        self.fontsize = self.config_manager.get_int_config('fontsize')
-        self.border = self.config_manager.get_int_config('border')
-        self.max_log_size = self.config_manager.get_int_config('max_log_size')
-        self.max_archive_size = self.config_manager.get_int_config('max_archive_size')
+        config = self.config_manager.snapshot
+        self.logfile = config.logfile
+        self.readings_dir = config.readings_dir
+        self.rollup_dir = config.rollup_dir
+        self.rollup_retention = retention_days(config)
+        self.min_humidity = config.min_humidity
+        self.max_humidity = config.max_humidity
+        self.font = config.font
+        self.fontsize = config.fontsize
+        self.border = config.border
+        self.text_cache_bytes = config.text_cache_bytes
+        self.max_log_size = config.max_log_size
+        self.max_archive_size = config.max_archive_size
+        self.log_compression = config.log_compression
+        self.log_batch_size = config.log_batch_size
+        self.log_batch_interval = config.log_batch_interval
+        self.log_fsync = config.log_fsync
+        self.log_fsync_interval = config.log_fsync_interval
+        self.log_queue_size = config.log_queue_size
+        self.sensor_interval = config.sensor_interval
+        self.sensor_heat_interval = config.sensor_heat_interval
+        self.sensor_heat_startup_time = config.sensor_heat_startup_time
+        self.sensor_heat_running_time = config.sensor_heat_running_time
+        self.display_interval = config.display_interval
+        self.log_flush_interval = config.log_flush_interval
+        self.config_save_interval = config.config_save_interval
+        self.config_reload_interval = config.config_reload_interval
+        self.config_write_debounce = config.config_write_debounce
+        self.fast_boot = config.fast_boot
+        self.inventory_file = config.inventory_file
 
 
 # Display function placeholders
@@ -36,146 +65,391 @@ def display_max_humidity(value):
     print(f"Max Humidity: {value}%")
 
 
+def show_setpoint(setpoint, value):
+    if setpoint == 'max':
+        display_max_humidity(value)
+    elif setpoint == 'min':
+        display_min_humidity(value)
+
+
 # Save configuration
-def save_config():
-    global min_humidity, max_humidity
+def save_config(min_humidity, max_humidity):
     print("Saving config...")
     print("Min Humidity: ", min_humidity)
     print("Max Humidity: ", max_humidity)
-    config_manager.update_config('min_humidity', min_humidity)
-    config_manager.update_config('max_humidity', max_humidity)
+    # Queued for the writer thread, which saves both in one write once the buttons go quiet
+    config_writer.update('min_humidity', min_humidity)
+    config_writer.update('max_humidity', max_humidity)
 
 
 def button_pressed_callback(button):
-    global min_humidity, max_humidity, last_press_time, humidity_changed, mode
-
-    now = time.time()
+    # Runs on a gpiozero thread, all setpoint state lives in the controller behind its lock
     button_name = 'up' if button.pin.number == up_button_pin else 'dn'
-    # last_press_time[button_name] = now
-
-    print(f"Button: {button_name} Mode: {mode}")
-    print(f"Up last pressed: {last_press_time['up']} DN last pressed: {last_press_time['dn']}")
-    print("Humidity Changed: ", humidity_changed)
-
-    if humidity_changed and (now - last_press_time['up'] > 3 and now - last_press_time['dn'] > 3):
-        save_config()
-        humidity_changed = False
-        mode = None
-
-    # Show the current setting when the button is pressed and released
-    if mode is None:
-        if button_name == 'up':
-            print('Up Button Pressed...', mode)
-            display_max_humidity(max_humidity)
-        else:
-            print('DN Button Pressed...')
-            display_min_humidity(min_humidity)
-    else:
-        now = time.time()
-        if mode == 'max':
-            if button_name == 'up':
-                max_humidity += 1
-                display_max_humidity(max_humidity)
-                humidity_changed = True
-                last_press_time['up'] = now
-            elif button_name == 'dn':
-                max_humidity -= 1
-                display_max_humidity(max_humidity)
-                humidity_changed = True
-                last_press_time['dn'] = now
-        elif mode == 'min':
-            if button_name == 'up':
-                min_humidity += 1
-                display_min_humidity(min_humidity)
-                humidity_changed = True
-                last_press_time['up'] = now
-            elif button_name == 'dn':
-                min_humidity -= 1
-                display_min_humidity(min_humidity)
-                humidity_changed = True
-                last_press_time['dn'] = now
+    setpoint, value = dehydrator.button_pressed(button_name, clock.monotonic())
+    print(f"Button: {button_name} Setpoint: {setpoint}")
+    show_setpoint(setpoint, value)
 
 
 def button_hold_callback(button):
-    global min_humidity, max_humidity, last_press_time, humidity_changed, mode
-
     button_name = 'up' if button.pin.number == up_button_pin else 'dn'
-    last_press_time[button_name] = time.time()
-    # print(f"First button: {button_name}")
-    # print("Up button held: ", up_button.is_held)
-    # print("Dn Button Held: ", dn_button.is_held)
-    # print("Up button Is Active: ", up_button.is_active)
-    # print("Dn Button IS Active: ", dn_button.is_active)
-
-    if up_button.is_active and dn_button.is_active:
+    both_held = up_button.is_active and dn_button.is_active
+    setpoint, value = dehydrator.button_held(button_name, clock.monotonic(), both_held)
+    if both_held:
         print("Both buttons are being held...")
         return
+    print('Up Button Held...' if button_name == 'up' else 'DN Button Held...')
+    show_setpoint(setpoint, value)
+
+
+def process_readings():
+    # Stores readings that moved by more than 0.2% and switches the fan on the internal sensor
+    timestamp = clock.timestamp()
+    now = clock.now()
+    flags = FLAG_FAN_ON if dehydrator.fan_on() else 0
+    add_rollups()
+
+    externaloutput = snapshot.get('External')
+    # Readings taken while heating or cooling down are skewed, skip them
+    if (externaloutput is not None and externaloutput['state'] == ReadingState.VALID
+            and abs(externaloutput['humidity'] - externalprevious_output['humidity']) > 0.2):
+        readings.append_reading(now, 'External', externaloutput, flags)
+        # Update previous output values
+        externalprevious_output['temperature'] = externaloutput['temperature']
+        externalprevious_output['humidity'] = externaloutput['humidity']
+        print("External Sensor Reading:", externaloutput)
+
+    internaloutput = snapshot.get('Internal')
+    if (internaloutput is not None and internaloutput['state'] == ReadingState.VALID
+            and abs(internaloutput['humidity'] - internalprevious_output['humidity']) > 0.2):
+        readings.append_reading(now, 'Internal', internaloutput, flags)
+        # Update previous output values
+        internalprevious_output['temperature'] = internaloutput['temperature']
+        internalprevious_output['humidity'] = internaloutput['humidity']
+        print("Internal Sensor Reading:", internaloutput)
+
+    # Every valid reading goes to the controller, a minimum on or off time may just have run out
+    if internaloutput is None or internaloutput['state'] != ReadingState.VALID:
+        return
+    try:
+        action = dehydrator.step(internaloutput['humidity'], clock.monotonic())
+    except OSError as e:
+        # The controller keeps its old state, so the switch is tried again on the next reading
+        print(f"Error switching fan: {e}")
+        return
+    settings = dehydrator.settings
+    if action == FAN_START:
+        logger.log(timestamp, 'Fan', '', f"Fan started, exceeded MAX humidity of: {settings.max_humidity}%")
+        print(f"Fan started, exceeded set humidity of: {settings.max_humidity}%")
+        show_banner('Fan Started...')
+    elif action == FAN_STOP:
+        run_time = dehydrator.run_time()
+        print("Fan stopped...")
+        logger.log(timestamp, 'Fan', '',
+                   f"Fan stopped, passed MIN humidity of: {off_threshold(settings)}%")
+        logger.log(timestamp, 'Fan', '', f"Fan run time: {str(timedelta(seconds=round(run_time)))}")
+        show_banner('Fan Stopped...')
+
+
+def add_rollups():
+    # The rollups take every new valid reading, not just the ones that moved enough to be stored
+    for name, reading in snapshot.latest().items():
+        if reading['state'] == ReadingState.VALID and reading['sequence'] != rollup_sequences.get(name):
+            rollup_sequences[name] = reading['sequence']
+            rollups.add_reading(reading['timestamp'], name, reading)
+
+
+def flush_logs():
+    # Runs on the control thread, so the writes are only queued for the log writer thread. cleanup() waits.
+    logger.flush(wait=False)
+    logger.call_in_background(readings.flush)
+    logger.call_in_background(rollups.flush)
+
+
+def sample_and_process_readings():
+    # Sample job on a simulated clock, there are no sampler threads
+    sampler.sample_once()
+    process_readings()
+
+
+def show_banner(text, duration=1):
+    # Drawn by the display job, which puts the four rows back after duration seconds
+    global banner_text, banner_end_time
+    banner_text = text
+    banner_end_time = clock.monotonic() + duration
+
+
+def mark_phase(name):
+    # Time since the previous mark, for the startup report
+    global phase_started
+    now = clock.monotonic()
+    startup_phases[name] = now - phase_started
+    phase_started = now
+
+
+def report_startup():
+    # Printed once, as soon as the first valid reading is in
+    global startup_phases
+    if startup_phases is None:
+        return
+    readings = [reading for reading in snapshot.latest().values() if reading['state'] == ReadingState.VALID]
+    if not readings:
+        return
+    first_reading = min(reading['timestamp'] for reading in readings) - startup_wall_time
+    phases = ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in startup_phases.items())
+    self_test_phases = ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in self_test['phases'].items())
+    report = f"Startup: {phases} (self test {self_test_phases}), first valid reading after {first_reading:.2f}s"
+    resources = devices.resource_report()
+    timestamp = clock.timestamp()
+    for line in (report, resources):
+        print(line)
+        logger.log(timestamp, 'System', '', line)
+    startup_phases = None
+
+
+def refresh_display():
+    global banner_text, banner_end_time
+    report_startup()
+    if ssd1306_display is None:
+        return
+    if banner_text is not None:
+        ssd1306_display.display_text_center_with_border(banner_text)
+        banner_text = None
+    if banner_end_time is not None:
+        if clock.monotonic() < banner_end_time:
+            return
+        banner_end_time = None
+        ssd1306_display.display_default_four_rows()
+
+    for name, line_number in (('Internal', 1), ('External', 3)):
+        output = snapshot.get(name)
+        if output is None or output['state'] != ReadingState.VALID:
+            continue
+        text = f"{output['humidity']}% - {output['temperature']}°C"
+        if ssd1306_display.lines[line_number] != text:
+            ssd1306_display.update_line(line_number, justification='left', text=text)
+
+
+def heat_sensors():
+    if not self_test_done.is_set():
+        # A pulse would make the sensors NACK the background self test, try again on the next run
+        print("Background self test still running, sensor heating skipped")
+        return
+    timestamp = clock.timestamp()
+    heated = heater_scheduler.heat_all()
+    for name, sensor in sensors.items():
+        if sensor in heated:
+            print(f"Heating {name} sensor...")
+            logger.log(timestamp, name, f'{SENSOR_IDS[name]:02d}', f"Heating {name} sensor...")
+
+
+def save_pending_config():
+    # Saves once both buttons have been left alone for a few seconds
+    limits = dehydrator.take_pending_save(clock.monotonic())
+    if limits is not None:
+        save_config(*limits)
+
+
+def control_settings(config):
+    return ControlSettings(config.min_humidity, config.max_humidity, config.hysteresis,
+                           config.min_fan_on_time, config.min_fan_off_time)
 
-    if button_name == 'up':
-        print('Up Button Held...')
-        display_max_humidity(max_humidity)
-        mode = 'max'
-    else:
-        print('DN Button Held...')
-        display_min_humidity(min_humidity)
-        mode = 'min'
+
+# Jobs whose period follows a config key when the file is reloaded
+JOB_INTERVALS = {
+    'sample': 'sensor_interval',
+    'display': 'display_interval',
+    'heat': 'sensor_heat_interval',
+    'log_flush': 'log_flush_interval',
+    'config_save': 'config_save_interval',
+    'config_reload': 'config_reload_interval',
+}
+
+
+def reload_config():
+    # Picks up edits to config.ini without a restart. Settings that are only used while starting up
+    # (devices, pins, log and display setup) still need one.
+    if not config_manager.reload_if_changed():
+        return
+    config = config_manager.snapshot
+    print("Configuration reloaded")
+    logger.log(clock.timestamp(), 'System', '', "Configuration reloaded")
+    # Button edits that haven't been saved yet win over the file
+    dehydrator.set_settings(control_settings(config))
+    for name, key in JOB_INTERVALS.items():
+        if name in runtime.jobs:
+            runtime.jobs[name].period = getattr(config, key)
+    for sensor in sensors.values():
+        sensor.cooldown_time = heater_cooldown_time(config.sensor_interval)
+    if sampler is not None:
+        sampler.set_interval(config.sensor_interval)
+    elif args.runtime == 'asyncio':
+        runtime.set_sensor_interval(config.sensor_interval)
 
 
 def cleanup():
     # Test
     # Want to add code here to update display, update log with run time etc
     print('Cleaning Up')
-    ssd1306_display.display_text_center_with_border('Shutting down...')
-    lcd2004_display.display_text_with_border('Shutting down...')
-    logger.log(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+    if ssd1306_display is not None:
+        ssd1306_display.display_text_center_with_border('Shutting down...')
+    if lcd2004_display is not None:
+        lcd2004_display.display_text_with_border(['Shutting down...'])
+    logger.log(clock.timestamp(),
                'System', '', "Shutting down...")
-    time.sleep(3)
-    ssd1306_display.clear_screen()
-    lcd2004_display.clear()
+    if sampler is not None:
+        sampler.stop()
+    if runtime is not None:
+        for line in runtime.report():
+            print(line)
+    if ssd1306_display is not None:
+        print(f"SSD1306 refresh: {ssd1306_display.refresh_stats()}")
+        print(f"SSD1306 text cache: {ssd1306_display.text_cache.stats()}")
+    if lcd2004_display is not None:
+        print(f"LCD2004 writes: {lcd2004_display.write_stats()}")
+    if logger.writer is not None:
+        print(f"Log writer: {logger.writer.stats()}")
+    if logger.compressor is not None:
+        print(f"Log compressor: {logger.compressor.stats()}")
+    print(f"Fan control: {dehydrator.stats()}")
+    config_writer.stop()
+    print(f"Config writer: {config_writer.stats()}")
+    logger.close()
+    readings.mark_shutdown(clock.now())
+    readings.close()
+    print(f"Reading store: {readings.stats()}")
+    rollups.close()
+    print(f"Rollups: {rollups.stats()}")
+    clock.sleep(3)
+    if ssd1306_display is not None:
+        ssd1306_display.clear_screen()
+    if lcd2004_display is not None:
+        lcd2004_display.clear()
+    i2c_bus.close_all()
+
+
+def background_self_test():
+    # Full probe after a fast boot. The fan spin test is left out, the controller owns the fan by now.
+    # It measures with the same sensor drivers as the control loop, so no heater pulse starts until it is done.
+    try:
+        report = SystemStatus.self_test([device for device in installed_devices if device != "FAN"], refresh=True)
+    finally:
+        self_test_done.set()
+    timestamp = clock.timestamp()
+    for result in report['devices']:
+        logger.log(timestamp, 'System', '', SystemStatus.format_result(result))
+    if SystemStatus.inventory_matches(inventory, report):
+        return
+    if report['status'] == SystemStatus.OVERALL_GOOD:
+        print("Device inventory changed, saving the new one")
+        inventory['devices'].update(SystemStatus.inventory_from_report(report)['devices'])
+        SystemStatus.save_inventory(module.inventory_file, inventory)
+    else:
+        # Don't trust the inventory again until a full probe passes
+        print(f"Background self test failed, overall status: {report['status']}")
+        logger.log(timestamp, 'System', 'Overall', "Background self test failed")
+        SystemStatus.clear_inventory(module.inventory_file)
 
 
 def read_installed_devices(config):
-    devices = config.get_config('installed_devices').split(',')
-    devices = [device.strip() for device in devices]  # Remove any extra whitespace
-    return devices
+    return list(config.snapshot.installed_devices)
+
+
+def create_sensors(installed_devices):
+    # A Sensor for each installed sensor, keyed by the reading it gives. Other sensor drivers are never loaded.
+    created = {}
+    for device_type in devices.installed_types(installed_devices, devices.SENSOR):
+        created[device_type.role] = Sensor(device_type.name, device_type.address,
+                                           cooldown_time=heater_cooldown_time(module.sensor_interval),
+                                           heater_time=module.sensor_heat_running_time)
+    return created
+
+
+def create_fan_controller(installed_devices):
+    # The EMC2101 driver is only loaded when a fan controller is installed, without one the fan is not driven
+    for device_type in devices.installed_types(installed_devices, devices.FAN):
+        return HumidityController(device_type.load().EMC2101(device_type.address))
+    return None
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Aircraft dehydrator controller')
+    parser.add_argument('--runtime', choices=['scheduler', 'asyncio'], default='scheduler',
+                        help='Run the control loop on the deadline scheduler or on asyncio')
+    parser.add_argument('--clock', choices=list(clock.CLOCKS), default=clock.REAL,
+                        help='Time source, simulated jumps from one scheduled job to the next without waiting')
+    parser.add_argument('--run-for', type=float, default=None,
+                        help='Shut down after this many seconds on the chosen clock')
+    args = parser.parse_args()
+    if args.clock == clock.SIMULATED and args.runtime == 'asyncio':
+        parser.error("the asyncio runtime runs on the event loop's own clock, use --runtime scheduler")
+    if args.run_for is not None and args.runtime == 'asyncio':
+        parser.error("--run-for needs --runtime scheduler")
+    clock.set_clock(clock.create_clock(args.clock))
+    startup_time = clock.monotonic()
+    startup_wall_time = clock.now()
+    startup_phases = {}
+    phase_started = startup_time
+
     config_manager = ConfigManager('config.ini')
     module = MyDehydrator(config_manager)
+    config_writer = ConfigWriter(config_manager, debounce=module.config_write_debounce)
+    config_writer.start()
     logger = module.logger(module.logfile, module.max_log_size, module.max_archive_size)
-    controller = HumidityController()
+    logger.start_writer(batch_size=module.log_batch_size, batch_interval=module.log_batch_interval,
+                        fsync=module.log_fsync, fsync_interval=module.log_fsync_interval,
+                        max_queue=module.log_queue_size)
+    # Rotated archives are compressed in the background and count against max_archive_size compressed
+    if module.log_compression != 'none':
+        logger.start_compressor(module.log_compression)
+    # Sensor readings go to the binary store, the CSV log keeps the events
+    readings = ReadingStore(module.readings_dir, module.max_log_size, module.max_archive_size)
+    # Minute, hour and day summaries of them outlive the store
+    rollups = Rollups(module.rollup_dir, module.rollup_retention)
+    rollup_sequences = {}
+    sampler = None
+    runtime = None
+    ssd1306_display = None
+    lcd2004_display = None
+
+    mark_phase('config')
 
     installed_devices = read_installed_devices(config_manager)
-    overall_status, statuses = SystemStatus.query_i2c_devices(installed_devices)
+    controller = create_fan_controller(installed_devices)
+    dehydrator = DehydratorController(control_settings(config_manager.snapshot), fan=controller)
+    inventory = SystemStatus.load_inventory(module.inventory_file) if module.fast_boot else None
+    self_test = SystemStatus.quick_check(installed_devices, inventory)
+    fast_boot = self_test is not None and self_test['status'] == SystemStatus.OVERALL_GOOD
+    # Set once no self test can be measuring the sensors, heater pulses wait for it
+    self_test_done = threading.Event()
+    if not fast_boot:
+        self_test_done.set()
+    if not fast_boot:
+        # No inventory, a different set of devices or one of them did not answer, probe everything now
+        self_test = SystemStatus.self_test(installed_devices, refresh=True)
+        if self_test['status'] == SystemStatus.OVERALL_GOOD:
+            inventory = SystemStatus.inventory_from_report(self_test)
+            SystemStatus.save_inventory(module.inventory_file, inventory)
+    overall_status = self_test['status']
+    mark_phase('self_test')
     print(f"Overall status: {overall_status}")
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    for status in statuses:
+    timestamp = clock.timestamp()
+    for result in self_test['devices']:
+        status = SystemStatus.format_result(result)
         print(status)
         logger.log(timestamp, 'System', '', status)
-    if overall_status == 'Bad':
+    if overall_status == SystemStatus.OVERALL_BAD:
         logger.log(timestamp, 'System', 'Overall', "Overall Status: Fail")
         cleanup()
         raise ValueError("Overall Status Failed")
-        sys.exit(1)
 
-    # Get initial values
-    min_humidity = config_manager.get_int_config('min_humidity')
-    max_humidity = config_manager.get_int_config('max_humidity')
     # Get button pins
-    up_button_pin = config_manager.get_int_config('up_button_pin')
-    dn_button_pin = config_manager.get_int_config('dn_button_pin')
+    up_button_pin = config_manager.snapshot.up_button_pin
+    dn_button_pin = config_manager.snapshot.dn_button_pin
 
     # GPIO setup using gpiozero
     up_button = Button(up_button_pin, pull_up=True, bounce_time=0.2, hold_time=3)
     dn_button = Button(dn_button_pin, pull_up=True, bounce_time=0.2, hold_time=3)
 
-    # Variables to manage button state and humidity values
-    last_press_time = {'up': 0, 'dn': 0}
-    button_hold_time = 2
-    humidity_changed = False
-    mode = None
-
     # Attach event handlers
     up_button.when_pressed = button_pressed_callback
     up_button.when_held = button_hold_callback
@@ -187,101 +461,83 @@ if __name__ == "__main__":
     lines = [""] * 4  # For four line ssd1306_display...
 
     try:
-        ssd1306_display_config = DisplayConfig(font_path=module.font, font_size=module.fontsize,
-                                               border_size=module.border)
-        ssd1306_display = SSD1306Display(ssd1306_display_config)
-        lcd2004_display = LCD2004Display()
-
-        # Display centered text
-        ssd1306_display.display_text_center("Initializing...")
-        lcd2004_display.display_text_with_border('Initializing...')
-        time.sleep(3)
-
-        internalsensor = Sensor('SHT41_Internal', 0x44)
-        externalsensor = Sensor('SHT30', 0x44)
+        # Display drivers, and PIL for the SSD1306, are only imported when the display is installed
+        if "SSD1306" in installed_devices:
+            display = devices.get_device_type("SSD1306").load()
+            ssd1306_display_config = display.DisplayConfig(font_path=module.font, font_size=module.fontsize,
+                                                           border_size=module.border,
+                                                           text_cache_bytes=module.text_cache_bytes)
+            ssd1306_display = display.SSD1306Display(ssd1306_display_config)
+            # Display centered text
+            ssd1306_display.display_text_center("Initializing...")
+        if "LCD2004" in installed_devices:
+            lcd2004_display = devices.get_device_type("LCD2004").load().LCD2004Display()
+            lcd2004_display.display_text_with_border(['Initializing...'])
+        mark_phase('displays')
+
+        sensors = create_sensors(installed_devices)
+        mark_phase('sensors')
 
         # Initialize previous output values to None
         internalprevious_output = {'temperature': 0, 'humidity': 0}
         externalprevious_output = {'temperature': 0, 'humidity': 0}
 
-        print("External Mode: ", externalsensor.sensor_mode())
-        print("Internal Mode: ", internalsensor.sensor_mode())
+        for name, sensor in sensors.items():
+            print(f"{name} Mode: ", sensor.sensor_mode())
 
-        ssd1306_display.display_four_rows_center(["Internal:", "reading...", "External:", "reading..."],
-                                                 justification='left')
-        ssd1306_display.display_default_four_rows()
-        time.sleep(2)
-        start_time = time.time()
-        controller = HumidityController()
-        fan_status = controller.fan_status()
-        print(fan_status)
-        while True:
-            current_time = time.time()
-            # Read and print sensor data every 2 seconds
-            if int(current_time - start_time) % 1 == 0:
-                timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-
-                externaloutput = externalsensor.read_sensor()
-                if abs(externaloutput['humidity'] - externalprevious_output['humidity']) > 0.2:
-                    logger.log(timestamp, 'External', '01',
-                               f"Temperature: {externaloutput['temperature']}C,"
-                               f" Humidity: {externaloutput['humidity']}%")
-                    # Update previous output values
-                    externalprevious_output['temperature'] = externaloutput['temperature']
-                    externalprevious_output['humidity'] = externaloutput['humidity']
-                    print("External Sensor Reading:", externaloutput)
-                    ssd1306_display.update_line(
-                        3, justification='left',
-                        text=f"{externaloutput['humidity']}% - {externaloutput['temperature']}°C")
-
-                time.sleep(.1)
-                internaloutput = internalsensor.read_sensor()
-                if abs(internaloutput['humidity'] - internalprevious_output['humidity']) > 0.2:
-                    logger.log(timestamp, 'Internal', '02',
-                               f"Temperature: {internaloutput['temperature']}C,"
-                               f" Humidity: {internaloutput['humidity']}%")
-                    # Update previous output values
-                    internalprevious_output['temperature'] = internaloutput['temperature']
-                    internalprevious_output['humidity'] = internaloutput['humidity']
-                    print("Internal Sensor Reading:", internaloutput)
-                    ssd1306_display.update_line(1,
-                                                justification='left', text=f"{internaloutput['humidity']}%"
-                                                                           f" - {internaloutput['temperature']}°C")
-                    if internaloutput['humidity'] > max_humidity:
-                        started = controller.engage_fan()
-                        if started:
-                            logger.log(timestamp, 'Fan', '',
-                                       f"Fan started, exceeded MAX humidity of: {module.max_humidity}%")
-                            print(f"Fan started, exceeded set humidity of: {module.max_humidity}%")
-                            ssd1306_display.display_text_center_with_border('Fan Started...')
-                            time.sleep(1)
-                            ssd1306_display.display_default_four_rows()
-                    elif internaloutput['humidity'] < min_humidity:
-                        stopped, run_time = controller.disengage_fan()
-                        if stopped:
-                            print("Fan stopped...")
-                            logger.log(timestamp, 'Fan', '',
-                                       f"Fan stopped, passed MIN humidity of: {module.min_humidity}%")
-                            logger.log(timestamp, 'Fan', '', f"Fan run time: {str(timedelta(seconds=run_time))}")
-                            ssd1306_display.display_text_center_with_border('Fan Stopped...')
-                            time.sleep(1)
-                            ssd1306_display.display_default_four_rows()
-
-                time.sleep(.1)  # Adjust as needed
-            initial_start = False
-            # Heat the sensors every 90 seconds
-            if int(current_time - start_time) % 90 == 0:
-                timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-                print("Heating External sensor...")
-                externalsensor.heat_sensor()
-                logger.log(timestamp, 'External', '01', "Heating External sensor...")
-
-                print("Heating Internal sensor...")
-                internalsensor.heat_sensor()
-                logger.log(timestamp, 'Internal', '02', "Heating Internal sensor...")
-
-            # Sleep for a short duration to avoid multiple reads/heats within the same second
-            time.sleep(0.5)
+        if ssd1306_display is not None:
+            ssd1306_display.display_default_four_rows()
+        banner_text = None
+        banner_end_time = None
+
+        # The SHT4x only has fixed 1s and 100ms heat pulses, the SHT30 heater stays on for the running time
+        if module.sensor_heat_running_time >= 1:
+            heater = SHT4XHeater.HIGH_HEATER_1S
+        else:
+            heater = SHT4XHeater.HIGH_HEATER_100MS
+        if controller is not None:
+            print(controller.fan_status())
+
+        if args.runtime == 'asyncio':
+            # Sensors are read in coroutines and each reading is acted on as soon as it arrives
+            snapshot = ReadingSnapshot()
+            runtime = AsyncRuntime(snapshot)
+            runtime.add_sensors(sensors, module.sensor_interval, on_reading=process_readings)
+            # Pulses are ended on a timer thread, the heater executor is only used to start them
+            heater_scheduler = HeaterScheduler(list(sensors.values()), heater=heater)
+            runtime.add_job('display', module.display_interval, refresh_display, executor='display')
+            runtime.add_job('heat', module.sensor_heat_interval, heat_sensors,
+                            start_delay=module.sensor_heat_startup_time, executor='heater')
+        else:
+            # Each bus is read on its own thread, the jobs below only look at the latest readings
+            sampler = SamplingService(sensors, interval=module.sensor_interval)
+            snapshot = sampler.snapshot
+            runtime = Scheduler()
+            # Each pulse is ended by a one-shot job when it is done, not by the next sample
+            heater_scheduler = HeaterScheduler(list(sensors.values()), heater=heater, call_later=runtime.call_later)
+            if args.clock == clock.SIMULATED:
+                # One thread drives simulated time, so the sensors are read by the sample job itself
+                runtime.add_job('sample', module.sensor_interval, sample_and_process_readings)
+            else:
+                # The first readings are taken here, so the first fan decision is made as soon as the loop starts
+                sampler.sample_once()
+                sampler.start()
+                runtime.add_job('sample', module.sensor_interval, process_readings)
+            runtime.add_job('display', module.display_interval, refresh_display)
+            runtime.add_job('heat', module.sensor_heat_interval, heat_sensors,
+                            start_delay=module.sensor_heat_startup_time)
+
+        runtime.add_job('log_flush', module.log_flush_interval, flush_logs)
+        runtime.add_job('config_save', module.config_save_interval, save_pending_config)
+        runtime.add_job('config_reload', module.config_reload_interval, reload_config)
+        if args.run_for is not None:
+            runtime.call_later(args.run_for, runtime.stop)
+        if fast_boot:
+            threading.Thread(target=background_self_test, name='self-test', daemon=True).start()
+        if args.runtime == 'asyncio':
+            runtime.run()
+        else:
+            runtime.run_forever()
 
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt detected!")
@@ -0,0 +1,224 @@
+import os
+import mmap
+import struct
+import threading
+
+# Sensor ids, the same numbers as the ID column of the CSV log
+SYSTEM_ID = 0
+SENSOR_IDS = {'External': 1, 'Internal': 2}
+
+# Flags on a record
+FLAG_FAN_ON = 0x01  # The fan was running when the reading was taken
+FLAG_SHUTDOWN = 0x80  # SYSTEM_ID record written on a clean shutdown, carries no reading
+
+MAGIC = b'DHRS'
+VERSION = 1
+# magic, version, record size, base time in seconds since the epoch
+HEADER = struct.Struct('<4sBBxxd')
+# milliseconds since the base time, sensor id, flags, temperature in 0.01C, humidity in 0.01%
+RECORD = struct.Struct('<IBBhH')
+MAX_OFFSET = 0xFFFFFFFF
+SEGMENT_SUFFIX = '.seg'
+
+
+def _record_dtype(np):
+    # Same layout as RECORD, so a segment can be viewed in place
+    return np.dtype([('offset', '<u4'), ('sensor', 'u1'), ('flags', 'u1'), ('temperature', '<i2'),
+                     ('humidity', '<u2')])
+
+
+def _reading_dtype(np):
+    return np.dtype([('time', '<f8'), ('sensor', 'u1'), ('flags', 'u1'), ('temperature', '<f4'),
+                     ('humidity', '<f4')])
+
+
+class ReadingStore:
+    # Append-only store of fixed size binary readings, 10 bytes each against 60-70 for a reading line in the
+    # CSV log. Segments are numbered files in directory, the highest is the one being written. A segment is
+    # sealed once it reaches segment_size, and the oldest sealed ones are removed to keep them within
+    # archive_size. A segment is also sealed when the clock goes backwards, so times only rise inside one.
+    # read_only is for tools looking at the store of a running controller, nothing is written or removed.
+    def __init__(self, directory, segment_size=150000, archive_size=310001, read_only=False):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.archive_size = archive_size
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+
+        self.written_count = 0
+        self.rotation_count = 0
+        self.removed_count = 0
+
+        # A new segment is started by the first append, an earlier run's last segment is left sealed
+        self._file = None
+        self._base_time = None
+        self._last_offset = 0
+        self._size = 0
+
+        # Segment sizes by number, scanned once here and then kept up to date
+        self.segment_sizes = {}
+        self.scan_segments()
+        if not read_only:
+            self.trim_segments()
+        self._number = max(self.segment_sizes, default=0)
+
+    def segment_name(self, number):
+        return os.path.join(self.directory, f'{number:08d}{SEGMENT_SUFFIX}')
+
+    def scan_segments(self):
+        self.segment_sizes = {}
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            stem, suffix = os.path.splitext(name)
+            if suffix != SEGMENT_SUFFIX or not stem.isdigit():
+                continue
+            try:
+                self.segment_sizes[int(stem)] = os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                continue
+
+    def sealed_size(self):
+        return sum(size for number, size in self.segment_sizes.items()
+                   if self._file is None or number != self._number)
+
+    def trim_segments(self):
+        # Remove the oldest sealed segments until the rest fit in archive_size
+        total_size = self.sealed_size()
+        while total_size > self.archive_size:
+            sealed = [number for number in self.segment_sizes if self._file is None or number != self._number]
+            if not sealed:
+                break
+            oldest = min(sealed)
+            total_size -= self.segment_sizes.pop(oldest)
+            self.removed_count += 1
+            try:
+                os.remove(self.segment_name(oldest))
+            except OSError as e:
+                print(f"Error removing reading segment: {e}")
+
+    def _start_segment(self, base_time):
+        if self.read_only:
+            raise ValueError(f"Reading store {self.directory} is open read only")
+        self._close_segment()
+        self._number += 1
+        self._file = open(self.segment_name(self._number), 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, base_time))
+        self._base_time = base_time
+        self._last_offset = 0
+        self._size = HEADER.size
+        self.segment_sizes[self._number] = self._size
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self.rotation_count += 1
+        self.trim_segments()
+
+    def append(self, timestamp, sensor_id, temperature=0.0, humidity=0.0, flags=0):
+        with self.lock:
+            offset = None
+            if self._file is not None:
+                offset = round((timestamp - self._base_time) * 1000)
+                if offset < self._last_offset or offset > MAX_OFFSET or \
+                        self._size + RECORD.size > self.segment_size:
+                    offset = None
+            if offset is None:
+                self._start_segment(timestamp)
+                offset = 0
+            # Clamped to what the fields hold, a sensor can't report anything near the limits
+            record = RECORD.pack(offset, sensor_id, flags, max(-32768, min(32767, round(temperature * 100))),
+                                 max(0, min(65535, round(humidity * 100))))
+            self._file.write(record)
+            self._last_offset = offset
+            self._size += RECORD.size
+            self.segment_sizes[self._number] = self._size
+            self.written_count += 1
+
+    def append_reading(self, timestamp, name, reading, flags=0):
+        self.append(timestamp, SENSOR_IDS[name], reading['temperature'], reading['humidity'], flags)
+
+    def mark_shutdown(self, timestamp):
+        self.append(timestamp, SYSTEM_ID, flags=FLAG_SHUTDOWN)
+
+    def flush(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self.lock:
+            self._close_segment()
+
+    def segments(self):
+        # Readable segments, oldest first, as (number, base_time, records). records is a NumPy view straight
+        # onto the mapped file, nothing is copied. A record cut short by a power cut is left out.
+        import numpy as np
+        self.flush()
+        record_dtype = _record_dtype(np)
+        with self.lock:
+            numbers = sorted(self.segment_sizes)
+        for number in numbers:
+            try:
+                with open(self.segment_name(number), 'rb') as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if size < HEADER.size:
+                        continue
+                    mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # Removed by trim_segments since the list was taken
+                continue
+            magic, version, record_size, base_time = HEADER.unpack_from(mapped)
+            if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                print(f"Skipping reading segment {number}, unknown format")
+                continue
+            count = (size - HEADER.size) // RECORD.size
+            yield number, base_time, np.frombuffer(mapped, record_dtype, count, HEADER.size)
+
+    def segment_range(self, start=None, end=None):
+        # Like segments(), with each view cut down to start <= time < end by binary search
+        for number, base_time, records in self.segments():
+            if not len(records):
+                continue
+            first = 0
+            last = len(records)
+            if start is not None:
+                if base_time + records['offset'][-1] / 1000 < start:
+                    continue
+                first = int(records['offset'].searchsorted(max(0, round((start - base_time) * 1000))))
+            if end is not None:
+                if base_time >= end:
+                    continue
+                last = int(records['offset'].searchsorted(round((end - base_time) * 1000)))
+            if first < last:
+                yield number, base_time, records[first:last]
+
+    def read_range(self, start=None, end=None, sensor=None):
+        # Readings with start <= time < end as one NumPy array in seconds, degrees and percent.
+        # sensor is a name or an id, None for every record.
+        import numpy as np
+        if isinstance(sensor, str):
+            sensor = SENSOR_IDS[sensor]
+        parts = []
+        for number, base_time, records in self.segment_range(start, end):
+            if sensor is not None:
+                records = records[records['sensor'] == sensor]
+            part = np.empty(len(records), _reading_dtype(np))
+            part['time'] = base_time + records['offset'] / 1000
+            part['sensor'] = records['sensor']
+            part['flags'] = records['flags']
+            part['temperature'] = records['temperature'] / 100
+            part['humidity'] = records['humidity'] / 100
+            parts.append(part)
+        if not parts:
+            return np.empty(0, _reading_dtype(np))
+        return np.concatenate(parts)
+
+    def stats(self):
+        return {'written': self.written_count, 'segments': len(self.segment_sizes),
+                'bytes': sum(self.segment_sizes.values()), 'rotations': self.rotation_count,
+                'removed': self.removed_count}
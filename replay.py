@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# Replays the humidity readings in the reading store, and in log.csv and its archives from before there was one,
+# through the fan control logic, to see how a set of setpoints would have behaved. Run from the repository root:
+#   python3 replay.py 50:60:5 48:62:4   (min_humidity:max_humidity:hysteresis, default is config.ini's)
+import time
+import math
+import bisect
+import argparse
+from logger import BACKUP_COUNT
+from log_archive import find_log, open_log
+from reading_store import ReadingStore, SENSOR_IDS, FLAG_SHUTDOWN
+from config_manager import ConfigManager
+from dehydrator_controller import step, off_threshold, FanState, ControlSettings, FAN_START
+
+INTERNAL = 'Internal'
+TIMESTAMP_LENGTH = 19  # 2024-06-01 12:00:00
+HUMIDITY_LABEL = 'Humidity: '
+SHUTDOWN_MESSAGE = 'Shutting down'
+FAN_STARTED_MESSAGE = 'Fan started'
+
+
+def archive_files(filename):
+    # Oldest first: filename.BACKUP_COUNT .. filename.1 then the live file, compressed archives by their own name
+    names = [find_log(f'{filename}.{index}') for index in range(BACKUP_COUNT, 0, -1)] + [find_log(filename)]
+    return [name for name in names if name is not None]
+
+
+class Recording:
+    # Readings of one sensor pulled out of the log. A value of None marks a shutdown, the controller
+    # started again from scratch at the next reading.
+    def __init__(self):
+        self.times = []
+        self.values = []
+        self.rows = 0
+        self.bad_rows = 0
+        self.fan_starts = 0
+        self._hours = {}
+
+    def _parse_time(self, line):
+        # mktime once per hour of the log, minutes and seconds are added on. Keeps DST changes right.
+        hour = line[:13]
+        start = self._hours.get(hour)
+        if start is None:
+            start = time.mktime((int(line[:4]), int(line[5:7]), int(line[8:10]), int(line[11:13]), 0, 0, 0, 0, -1))
+            self._hours[hour] = start
+        return start + int(line[14:16]) * 60 + int(line[17:19])
+
+    def add_line(self, line, name=INTERNAL):
+        # Rows are timestamp,name,id,message with the message unquoted, so it is sliced rather than csv parsed
+        self.rows += 1
+        if line[TIMESTAMP_LENGTH:TIMESTAMP_LENGTH + 1] != ',':
+            # The header, or a row cut short by a power cut
+            self.bad_rows += 1
+            return
+        fields = TIMESTAMP_LENGTH + 1
+        try:
+            if line.startswith(name + ',', fields):
+                start = line.rindex(HUMIDITY_LABEL) + len(HUMIDITY_LABEL)
+                humidity = float(line[start:line.index('%', start)])
+                self._append(self._parse_time(line), humidity)
+            elif line.startswith('System,', fields) and SHUTDOWN_MESSAGE in line:
+                self._append(self._parse_time(line), None)
+            elif line.startswith('Fan,', fields) and FAN_STARTED_MESSAGE in line:
+                self.fan_starts += 1
+        except ValueError:
+            self.bad_rows += 1
+
+    def _append(self, timestamp, value):
+        if value is None and self.values and self.values[-1] is None:
+            return
+        self.times.append(timestamp)
+        self.values.append(value)
+
+    def add_store(self, store, name=INTERNAL):
+        # Readings moved from the CSV log to the store, so the log is only used up to the store's first record
+        if not store.segment_sizes:
+            return
+        readings = store.read_range()
+        if not len(readings):
+            return
+        keep = bisect.bisect_left(self.times, readings['time'][0])
+        del self.times[keep:]
+        del self.values[keep:]
+        shutdown = (readings['flags'] & FLAG_SHUTDOWN) != 0
+        readings = readings[(readings['sensor'] == SENSOR_IDS[name]) | shutdown]
+        for timestamp, humidity, flags in zip(readings['time'].tolist(), readings['humidity'].tolist(),
+                                              readings['flags'].tolist()):
+            self._append(timestamp, None if flags & FLAG_SHUTDOWN else round(humidity, 2))
+
+    def duration(self):
+        return self.times[-1] - self.times[0] if self.times else 0
+
+
+def load_recording(files, name=INTERNAL, store=None):
+    recording = Recording()
+    for filename in files:
+        with open_log(filename, 'rt', newline='') as f:
+            for line in f:
+                recording.add_line(line, name)
+    if store is not None:
+        recording.add_store(store, name)
+    return recording
+
+
+def replay(recording, settings, sample_interval=10):
+    # Runs dehydrator_controller.step over the recording as fast as it will go. A reading is only logged when
+    # it moves, so each one is held until the next. The controller would see it every sample_interval, so a
+    # switch held back by a minimum on or off time happens on the first sample after that time runs out.
+    # The readings are what the enclosure did under the fan as it was run, the replay can't show how a
+    # different fan schedule would have changed them.
+    state = FanState(False, None)
+    threshold = off_threshold(settings)
+    starts = 0
+    covered = fan_on_time = above_max = below_min = 0.0
+    previous_time = None
+    humidity = None
+    for now, value in zip(recording.times, recording.values):
+        if humidity is not None and now > previous_time:
+            held_from = previous_time
+            while state.changed_at is not None:
+                wants_switch = humidity > settings.max_humidity if not state.fan_on else humidity < threshold
+                if not wants_switch:
+                    break
+                hold = settings.min_on_time if state.fan_on else settings.min_off_time
+                samples = max(1, math.ceil((state.changed_at + hold - previous_time) / sample_interval))
+                switch_time = previous_time + samples * sample_interval
+                if switch_time >= now:
+                    break
+                if state.fan_on:
+                    fan_on_time += switch_time - held_from
+                else:
+                    starts += 1
+                covered += switch_time - held_from
+                held_from = switch_time
+                state = FanState(not state.fan_on, switch_time)
+            elapsed = now - held_from
+            covered += elapsed
+            if state.fan_on:
+                fan_on_time += elapsed
+            if humidity > settings.max_humidity:
+                above_max += now - previous_time
+            elif humidity < settings.min_humidity:
+                below_min += now - previous_time
+
+        if value is None:
+            # Shut down, it boots with the fan off and nothing held
+            state = FanState(False, None)
+        elif (previous_time is None or now >= previous_time) and \
+                (value < threshold if state.fan_on else value > settings.max_humidity):
+            # step() would return None for anything in between, skip the call
+            state, action = step(state, settings, value, now)
+            if action == FAN_START:
+                starts += 1
+        previous_time = now
+        humidity = value
+
+    return {'duration': covered, 'fan_on_time': fan_on_time,
+            'duty_cycle': fan_on_time / covered if covered else 0.0, 'starts': starts,
+            'time_above_max': above_max, 'time_below_min': below_min,
+            'out_of_band': (above_max + below_min) / covered if covered else 0.0}
+
+
+def parse_candidate(text, config):
+    # min:max:hysteresis, a missing value comes from the config
+    parts = text.split(':')
+    if len(parts) > 3:
+        raise ValueError(f"Invalid candidate {text!r}, expected min_humidity:max_humidity:hysteresis")
+    values = [float(part) if part else None for part in parts] + [None] * (3 - len(parts))
+    min_humidity, max_humidity, hysteresis = [default if value is None else value for value, default in
+                                              zip(values, (config.min_humidity, config.max_humidity,
+                                                           config.hysteresis))]
+    if min_humidity >= max_humidity:
+        raise ValueError(f"Invalid candidate {text!r}, min_humidity must be below max_humidity")
+    return ControlSettings(min_humidity, max_humidity, hysteresis, config.min_fan_on_time, config.min_fan_off_time)
+
+
+def format_result(settings, result):
+    return (f"min {settings.min_humidity:g}% max {settings.max_humidity:g}% hysteresis {settings.hysteresis:g}%: "
+            f"duty cycle {result['duty_cycle']:.1%}, {result['starts']} starts, "
+            f"out of band {result['out_of_band']:.1%} (above max {result['time_above_max'] / 3600:.1f}h, "
+            f"below min {result['time_below_min'] / 3600:.1f}h)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay logged humidity through candidate fan setpoints')
+    parser.add_argument('candidates', nargs='*', default=[''],
+                        help='min_humidity:max_humidity:hysteresis, missing values come from the config')
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--log', action='append',
+                        help='Log file to replay, repeat oldest first. Default: logfile and its archives')
+    parser.add_argument('--store', help='Reading store directory. Default: readings_dir')
+    args = parser.parse_args()
+
+    config = ConfigManager(args.config).snapshot
+    files = args.log or archive_files(config.logfile)
+    started = time.perf_counter()
+    store = ReadingStore(args.store or config.readings_dir, read_only=True)
+    recording = load_recording(files, store=store)
+    loaded = time.perf_counter()
+    print(f"{len(recording.times)} readings over {recording.duration() / 86400:.1f} days from {len(files)} log files "
+          f"and {len(store.segment_sizes)} store segments ({recording.rows} log rows, {recording.bad_rows} skipped) "
+          f"in {loaded - started:.2f}s, {recording.fan_starts} fan starts logged")
+    for candidate in args.candidates:
+        try:
+            settings = parse_candidate(candidate, config)
+        except ValueError as e:
+            print(e)
+            continue
+        print(format_result(settings, replay(recording, settings, config.sensor_interval)))
+    print(f"Replayed {len(args.candidates)} candidates in {time.perf_counter() - loaded:.2f}s")
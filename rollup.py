@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# Minute, hour and day min/mean/max of every sensor, kept long after the raw readings have rotated away.
+# Run from the repository root to print a trend:
+#   python3 rollup.py 2024-01-01 2024-06-01 --sensor Internal
+import os
+import mmap
+import time
+import struct
+import argparse
+import threading
+import clock
+from reading_store import SENSOR_IDS
+from config_manager import ConfigManager
+
+MINUTE = 'minute'
+HOUR = 'hour'
+DAY = 'day'
+# Tier name and bucket width in seconds, finest first. Buckets are aligned to UTC, so a day runs midnight to
+# midnight UTC whatever the time zone or daylight saving.
+TIERS = ((MINUTE, 60), (HOUR, 3600), (DAY, 86400))
+# Most buckets a trend is given, the finest tier that stays under it is read
+MAX_POINTS = 500
+
+MAGIC = b'DHRU'
+VERSION = 1
+# magic, version, record size, bucket width in seconds, buckets kept
+HEADER = struct.Struct('<4sBBxxII')
+# bucket start in seconds since the epoch, sensor id, reading count, humidity min/mean/max in 0.01%,
+# temperature min/mean/max in 0.01C
+RECORD = struct.Struct('<IBxIHHHhhh')
+SENSOR_SLOTS = sorted(SENSOR_IDS.values())
+
+
+def _record_dtype(np):
+    # Same layout as RECORD, so a tier file can be viewed in place
+    return np.dtype([('start', '<u4'), ('sensor', 'u1'), ('pad', 'u1'), ('count', '<u4'),
+                     ('humidity_min', '<u2'), ('humidity_mean', '<u2'), ('humidity_max', '<u2'),
+                     ('temperature_min', '<i2'), ('temperature_mean', '<i2'), ('temperature_max', '<i2')])
+
+
+TREND_FIELDS = ('humidity_min', 'humidity_mean', 'humidity_max', 'temperature_min', 'temperature_mean',
+                'temperature_max')
+
+
+def _trend_dtype(np):
+    return np.dtype([('time', '<f8'), ('count', '<u4')] + [(field, '<f4') for field in TREND_FIELDS])
+
+
+def _centi(value, low, high):
+    return max(low, min(high, round(value * 100)))
+
+
+class Bucket:
+    # Running aggregate of one sensor over one bucket of one tier
+    def __init__(self, start, sensor_id):
+        self.start = start
+        self.sensor_id = sensor_id
+        self.count = 0
+        self.humidity_min = self.humidity_max = None
+        self.temperature_min = self.temperature_max = None
+        self.humidity_sum = 0.0
+        self.temperature_sum = 0.0
+        self.dirty = False
+
+    def add(self, temperature, humidity):
+        self.merge(1, humidity, humidity, humidity, temperature, temperature, temperature)
+
+    def merge(self, count, humidity_min, humidity_mean, humidity_max, temperature_min, temperature_mean,
+              temperature_max):
+        # count readings already aggregated, from the tier file after a restart
+        if self.count == 0:
+            self.humidity_min, self.humidity_max = humidity_min, humidity_max
+            self.temperature_min, self.temperature_max = temperature_min, temperature_max
+        else:
+            self.humidity_min = min(self.humidity_min, humidity_min)
+            self.humidity_max = max(self.humidity_max, humidity_max)
+            self.temperature_min = min(self.temperature_min, temperature_min)
+            self.temperature_max = max(self.temperature_max, temperature_max)
+        self.humidity_sum += humidity_mean * count
+        self.temperature_sum += temperature_mean * count
+        self.count += count
+        self.dirty = True
+
+    def pack(self):
+        return RECORD.pack(self.start, self.sensor_id, self.count,
+                           _centi(self.humidity_min, 0, 65535), _centi(self.humidity_sum / self.count, 0, 65535),
+                           _centi(self.humidity_max, 0, 65535), _centi(self.temperature_min, -32768, 32767),
+                           _centi(self.temperature_sum / self.count, -32768, 32767),
+                           _centi(self.temperature_max, -32768, 32767))
+
+
+class Tier:
+    # One fixed size ring file: a slot per sensor per bucket, for the last capacity buckets. A bucket goes in
+    # slot (start // width) % capacity and overwrites whatever was there, which is how old buckets expire.
+    # Every slot holds its own start, so a stale or empty one is told apart from the bucket asked for.
+    def __init__(self, path, name, width, capacity, read_only=False):
+        self.path = path
+        self.name = name
+        self.width = width
+        self.capacity = capacity
+        self.read_only = read_only
+        self._file = None
+        self.current = {}
+        self.write_count = 0
+        if not read_only:
+            self._open()
+
+    def _open(self):
+        size = HEADER.size + self.capacity * len(SENSOR_SLOTS) * RECORD.size
+        kept = []
+        if os.path.exists(self.path):
+            header = self._read_header()
+            if header == (MAGIC, VERSION, RECORD.size, self.width, self.capacity):
+                self._file = open(self.path, 'r+b')
+                return
+            # Retention changed, keep the buckets that still fit
+            print(f"Resizing {self.name} rollup tier to {self.capacity} buckets")
+            kept = [record for record in self._records() if record[2]]
+        with open(self.path + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, self.width, self.capacity))
+            f.truncate(size)
+        os.replace(self.path + '.tmp', self.path)
+        self._file = open(self.path, 'r+b')
+        newest = sorted(kept, key=lambda record: record[0])[-self.capacity * len(SENSOR_SLOTS):]
+        for record in newest:
+            self._write_slot(record[0], record[1], RECORD.pack(*record))
+
+    def _read_header(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return HEADER.unpack(f.read(HEADER.size))
+        except (OSError, struct.error):
+            return None
+
+    def _records(self):
+        # Every record in the file as it is on disk, whatever its header says
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return []
+        return [RECORD.unpack_from(data, offset)
+                for offset in range(HEADER.size, len(data) - RECORD.size + 1, RECORD.size)]
+
+    def _slot_offset(self, start, sensor_id):
+        bucket = (start // self.width) % self.capacity
+        return HEADER.size + (bucket * len(SENSOR_SLOTS) + SENSOR_SLOTS.index(sensor_id)) * RECORD.size
+
+    def _write_slot(self, start, sensor_id, record):
+        self._file.seek(self._slot_offset(start, sensor_id))
+        self._file.write(record)
+        self.write_count += 1
+
+    def _load(self, start, sensor_id):
+        # The bucket as far as it got before a restart, or a new one
+        bucket = Bucket(start, sensor_id)
+        self._file.seek(self._slot_offset(start, sensor_id))
+        data = self._file.read(RECORD.size)
+        if len(data) == RECORD.size:
+            record = RECORD.unpack(data)
+            if record[0] == start and record[1] == sensor_id and record[2]:
+                bucket.merge(record[2], *[value / 100 for value in record[3:]])
+                bucket.dirty = False
+        return bucket
+
+    def add(self, timestamp, sensor_id, temperature, humidity):
+        start = int(timestamp // self.width * self.width)
+        bucket = self.current.get(sensor_id)
+        if bucket is None or bucket.start != start:
+            # Into the next bucket, or a different one when the clock was set
+            if bucket is not None:
+                self._store(bucket)
+            bucket = self._load(start, sensor_id)
+            self.current[sensor_id] = bucket
+        bucket.add(temperature, humidity)
+
+    def _store(self, bucket):
+        if bucket.dirty and bucket.count:
+            self._write_slot(bucket.start, bucket.sensor_id, bucket.pack())
+            bucket.dirty = False
+
+    def flush(self):
+        # Writes the buckets still being filled, so a restart or a reader sees them
+        for bucket in self.current.values():
+            self._store(bucket)
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def read(self, start=None, end=None, sensor_id=None):
+        # Buckets of one sensor with start <= bucket start < end, oldest first, from a view of the mapped file
+        import numpy as np
+        if self._file is not None:
+            self._file.flush()
+        try:
+            with open(self.path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return np.empty(0, _record_dtype(np))
+        if HEADER.unpack_from(mapped) != (MAGIC, VERSION, RECORD.size, self.width, self.capacity):
+            return np.empty(0, _record_dtype(np))
+        records = np.frombuffer(mapped, _record_dtype(np), self.capacity * len(SENSOR_SLOTS), HEADER.size)
+        selected = records['count'] > 0
+        if selected.any():
+            # After a gap, slots that were not written since hold buckets from one or more laps ago
+            selected &= records['start'] > int(records['start'][selected].max()) - self.retention()
+        if sensor_id is not None:
+            selected &= records['sensor'] == sensor_id
+        if start is not None:
+            selected &= records['start'] >= start
+        if end is not None:
+            selected &= records['start'] < end
+        selected = records[selected]
+        return selected[np.argsort(selected['start'], kind='stable')]
+
+    def retention(self):
+        return self.width * self.capacity
+
+
+class Rollups:
+    # The minute, hour and day tiers, fed with every new reading. retention maps a tier name to how many days
+    # of it to keep.
+    def __init__(self, directory, retention, read_only=False):
+        self.directory = directory
+        self.lock = threading.Lock()
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+        self.tiers = [Tier(os.path.join(directory, f'{name}.rollup'), name, width,
+                           max(1, round(retention[name] * 86400 / width)), read_only)
+                      for name, width in TIERS]
+        self.reading_count = 0
+
+    def add(self, timestamp, name, temperature, humidity):
+        sensor_id = SENSOR_IDS[name]
+        with self.lock:
+            for tier in self.tiers:
+                tier.add(timestamp, sensor_id, temperature, humidity)
+            self.reading_count += 1
+
+    def add_reading(self, timestamp, name, reading):
+        self.add(timestamp, name, reading['temperature'], reading['humidity'])
+
+    def flush(self):
+        with self.lock:
+            for tier in self.tiers:
+                tier.flush()
+
+    def close(self):
+        with self.lock:
+            for tier in self.tiers:
+                tier.close()
+
+    def choose_tier(self, start, end, max_points=MAX_POINTS, now=None):
+        # The finest tier that still holds start and gives no more than max_points buckets, or the coarsest
+        now = clock.now() if now is None else now
+        for tier in self.tiers:
+            if (end - start) / tier.width <= max_points and start >= now - tier.retention():
+                return tier
+        return self.tiers[-1]
+
+    def trend(self, start, end, sensor, max_points=MAX_POINTS):
+        # (tier name, NumPy array of buckets) for start <= time < end, in seconds, percent and degrees
+        import numpy as np
+        tier = self.choose_tier(start, end, max_points)
+        with self.lock:
+            records = tier.read(int(start // tier.width * tier.width), end, SENSOR_IDS[sensor])
+        trend = np.empty(len(records), _trend_dtype(np))
+        trend['time'] = records['start']
+        trend['count'] = records['count']
+        for field in TREND_FIELDS:
+            trend[field] = records[field] / 100
+        return tier.name, trend
+
+    def stats(self):
+        return {'readings': self.reading_count,
+                'writes': {tier.name: tier.write_count for tier in self.tiers},
+                'bytes': sum(os.path.getsize(tier.path) for tier in self.tiers if os.path.exists(tier.path))}
+
+
+def retention_days(config):
+    return {MINUTE: config.rollup_minute_days, HOUR: config.rollup_hour_days, DAY: config.rollup_day_days}
+
+
+def _parse_day(text):
+    return time.mktime(time.strptime(text, '%Y-%m-%d'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the humidity trend of one sensor from the rollup tiers')
+    parser.add_argument('start', help='YYYY-MM-DD')
+    parser.add_argument('end', nargs='?', help='YYYY-MM-DD, exclusive, default is now')
+    parser.add_argument('--sensor', default='Internal', choices=list(SENSOR_IDS))
+    parser.add_argument('--points', type=int, default=MAX_POINTS, help='Most buckets to print')
+    parser.add_argument('--config', default='config.ini')
+    args = parser.parse_args()
+
+    config = ConfigManager(args.config).snapshot
+    rollups = Rollups(config.rollup_dir, retention_days(config), read_only=True)
+    tier_name, trend = rollups.trend(_parse_day(args.start), _parse_day(args.end) if args.end else time.time(),
+                                     args.sensor, args.points)
+    print(f"{len(trend)} {tier_name} buckets of {args.sensor}")
+    for bucket in trend:
+        print(f"{clock.timestamp(bucket['time'])} humidity {bucket['humidity_min']:5.1f} "
+              f"{bucket['humidity_mean']:5.1f} {bucket['humidity_max']:5.1f}%  temperature "
+              f"{bucket['temperature_min']:5.1f} {bucket['temperature_mean']:5.1f} {bucket['temperature_max']:5.1f}C  "
+              f"({bucket['count']} readings)")
@@ -0,0 +1,98 @@
+import threading
+import clock
+
+
+class ReadingSnapshot:
+    # Latest reading for each sensor, written by the sampler threads and read by everyone else
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._readings = {}
+        self._sequence = 0
+
+    def publish(self, name, reading):
+        with self._lock:
+            self._sequence += 1
+            entry = dict(reading)
+            entry['timestamp'] = clock.now()
+            entry['sequence'] = self._sequence
+            self._readings[name] = entry
+
+    def get(self, name):
+        # Returns None until the first reading for the sensor arrives
+        with self._lock:
+            return self._readings.get(name)
+
+    def latest(self):
+        with self._lock:
+            return dict(self._readings)
+
+
+class BusSampler(threading.Thread):
+    # Reads every sensor on one bus in turn, a slow bus only ever delays its own sensors
+    def __init__(self, bus_name, sensors, snapshot, interval=1):
+        super().__init__(name=f"sampler-{bus_name}", daemon=True)
+        self.bus_name = bus_name
+        self.sensors = sensors
+        self.snapshot = snapshot
+        self.interval = interval
+        self.read_count = 0
+        self.error_count = 0
+        self._stop_event = threading.Event()
+
+    def sample_once(self):
+        for name, sensor in self.sensors.items():
+            try:
+                reading = sensor.read_sensor()
+            except (OSError, RuntimeError) as e:
+                self.error_count += 1
+                print(f"Error reading {name} sensor on {self.bus_name} bus: {e}")
+                continue
+            self.read_count += 1
+            self.snapshot.publish(name, reading)
+
+    def run(self):
+        next_time = clock.monotonic()
+        while not self._stop_event.is_set():
+            self.sample_once()
+            next_time += self.interval
+            delay = next_time - clock.monotonic()
+            if delay < 0:
+                # Fell behind, start counting from now instead of bursting to catch up
+                next_time = clock.monotonic()
+                delay = 0
+            clock.wait(self._stop_event, delay)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class SamplingService:
+    # One BusSampler thread per bus, sensors is a dict of name -> Sensor
+    def __init__(self, sensors, interval=1):
+        self.snapshot = ReadingSnapshot()
+        buses = {}
+        for name, sensor in sensors.items():
+            buses.setdefault(sensor.bus_name, {})[name] = sensor
+        self.samplers = [BusSampler(bus_name, bus_sensors, self.snapshot, interval)
+                         for bus_name, bus_sensors in buses.items()]
+
+    def set_interval(self, interval):
+        # Takes effect after each sampler's current wait
+        for sampler in self.samplers:
+            sampler.interval = interval
+
+    def sample_once(self):
+        # Reads every sensor on the calling thread, for runs on a simulated clock where no sampler thread is started
+        for sampler in self.samplers:
+            sampler.sample_once()
+
+    def start(self):
+        for sampler in self.samplers:
+            sampler.start()
+
+    def stop(self, timeout=2):
+        for sampler in self.samplers:
+            sampler.stop()
+        for sampler in self.samplers:
+            if sampler.is_alive():
+                sampler.join(timeout)
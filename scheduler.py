@@ -0,0 +1,138 @@
+import heapq
+import itertools
+import clock
+
+
+class PeriodicJob:
+    def __init__(self, name, period, callback):
+        self.name = name
+        self.period = period
+        self.callback = callback
+        self.deadline = None
+
+        # Statistics, jitter is how late a run started compared to its deadline
+        self.run_count = 0
+        self.missed_count = 0
+        self.total_jitter = 0.0
+        self.max_jitter = 0.0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+
+    def record_run(self, started, finished):
+        jitter = started - self.deadline
+        self.run_count += 1
+        self.total_jitter += jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.last_duration = finished - started
+        self.max_duration = max(self.max_duration, self.last_duration)
+
+    def advance(self, now):
+        # Keeps the original phase, deadlines that have already passed are counted as missed
+        next_deadline = self.deadline + self.period
+        if next_deadline <= now:
+            missed = int((now - next_deadline) // self.period) + 1
+            self.missed_count += missed
+            next_deadline += missed * self.period
+        self.deadline = next_deadline
+        return next_deadline
+
+    def mean_jitter(self):
+        return self.total_jitter / self.run_count if self.run_count else 0.0
+
+    def stats(self):
+        return {'name': self.name, 'period': self.period, 'runs': self.run_count, 'missed': self.missed_count,
+                'mean_jitter': self.mean_jitter(), 'max_jitter': self.max_jitter,
+                'max_duration': self.max_duration}
+
+
+class Scheduler:
+    # Runs jobs at fixed deadlines on the monotonic clock and sleeps until the next one is due.
+    # The defaults follow the installed clock, on a SimulatedClock each sleep jumps to the next deadline.
+    def __init__(self, clock=clock.monotonic, sleep=clock.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.jobs = {}
+        self._queue = []
+        self._counter = itertools.count()
+        self._running = False
+
+    def add_job(self, name, period, callback, start_delay=0):
+        if period is not None and period <= 0:
+            raise ValueError(f"Period for job {name} must be greater than 0")
+        if name in self.jobs:
+            raise ValueError(f"Job {name} already scheduled")
+        job = PeriodicJob(name, period, callback)
+        job.deadline = self.clock() + start_delay
+        self.jobs[name] = job
+        self._push(job)
+        return job
+
+    def call_later(self, delay, callback):
+        # One-shot job, it is not kept in self.jobs once it has run
+        job = PeriodicJob(getattr(callback, '__name__', 'call_later'), None, callback)
+        job.deadline = self.clock() + delay
+        self._push(job)
+        return job
+
+    def remove_job(self, name):
+        job = self.jobs.pop(name)
+        job.deadline = None
+
+    def _push(self, job):
+        heapq.heappush(self._queue, (job.deadline, next(self._counter), job))
+
+    def run_pending(self):
+        # Runs every job that is due and returns the seconds until the next deadline, or None if idle
+        while self._queue:
+            deadline, _, job = self._queue[0]
+            if job.deadline != deadline:
+                # Removed or rescheduled, drop the stale entry
+                heapq.heappop(self._queue)
+                continue
+
+            now = self.clock()
+            if deadline > now:
+                return deadline - now
+            heapq.heappop(self._queue)
+
+            try:
+                job.callback()
+            finally:
+                finished = self.clock()
+                job.record_run(now, finished)
+                self._reschedule(job, finished)
+        return None
+
+    def _reschedule(self, job, now):
+        if job.period is None or job.deadline is None or self.jobs.get(job.name) is not job:
+            job.deadline = None
+            return
+        job.advance(now)
+        self._push(job)
+
+    def run_forever(self):
+        self._running = True
+        while self._running:
+            delay = self.run_pending()
+            if delay is None:
+                break
+            self.sleep(delay)
+
+    def stop(self):
+        self._running = False
+
+    def stats(self):
+        return [job.stats() for job in self.jobs.values()]
+
+    def report(self):
+        return job_report(self.jobs.values())
+
+
+def job_report(jobs):
+    lines = []
+    for job in jobs:
+        stats = job.stats()
+        lines.append(f"{stats['name']}: period {stats['period']}s, runs {stats['runs']}, "
+                     f"missed {stats['missed']}, jitter mean {stats['mean_jitter'] * 1000:.1f}ms "
+                     f"max {stats['max_jitter'] * 1000:.1f}ms, max duration {stats['max_duration'] * 1000:.1f}ms")
+    return lines
@@ -1,9 +1,8 @@
-import time
-import board
-import busio
-import adafruit_sht4x
-import adafruit_sht31d
-import adafruit_bitbangio
+import struct
+import threading
+import clock
+import i2c_bus
+import devices
 from enum import Enum
 
 # Define constants
@@ -21,6 +20,14 @@ SHT4X_LOWHEAT_100MS = 0x15  # High precision measurement, low heat for 0.1 sec
 SHT4X_READSERIAL = 0x89  # Read Out of Serial Register
 SHT4X_SOFTRESET = 0x94  # Soft Reset
 
+SHT30_HEATER_TIME = 1  # Default seconds the SHT30 heater is left on, it has no combined heat + measure command
+HEATER_COOLDOWN_TIME = 5  # Seconds after a heater pulse during which readings are still skewed
+
+
+def heater_cooldown_time(sample_interval):
+    # At least the first reading taken after a pulse is tagged Cooling, however far apart readings are
+    return max(HEATER_COOLDOWN_TIME, sample_interval)
+
 
 # Define enums
 class SHT4XPrecision(Enum):
@@ -38,6 +45,23 @@ class SHT4XHeater(Enum):
     LOW_HEATER_1S = "Low Heater 1s"
     LOW_HEATER_100MS = "Low Heater 100ms"
 
+
+class ReadingState(Enum):
+    VALID = "Valid"
+    HEATING = "Heating"
+    COOLING = "Cooling"
+
+
+# Heat + measure command and the time until its result can be read back (heater time + measurement)
+SHT4X_HEATER_COMMANDS = {
+    SHT4XHeater.HIGH_HEATER_1S: (SHT4X_HIGHHEAT_1S, 1.1),
+    SHT4XHeater.HIGH_HEATER_100MS: (SHT4X_HIGHHEAT_100MS, 0.11),
+    SHT4XHeater.MED_HEATER_1S: (SHT4X_MEDHEAT_1S, 1.1),
+    SHT4XHeater.MED_HEATER_100MS: (SHT4X_MEDHEAT_100MS, 0.11),
+    SHT4XHeater.LOW_HEATER_1S: (SHT4X_LOWHEAT_1S, 1.1),
+    SHT4XHeater.LOW_HEATER_100MS: (SHT4X_LOWHEAT_100MS, 0.11),
+}
+
 # # Example usage
 # print(f"High precision no heater code: {SHT4X_NOHEAT_HIGHPRECISION}")
 # print(f"Soft reset code: {SHT4X_SOFTRESET}")
@@ -51,55 +75,161 @@ class SHT4XHeater(Enum):
 
 
 class Sensor:
-    def __init__(self, sensor_type, address):
+    def __init__(self, sensor_type, address, cooldown_time=HEATER_COOLDOWN_TIME, heater_time=SHT30_HEATER_TIME):
         self.sensor_type = sensor_type
         self.address = address
+        self.cooldown_time = cooldown_time
+        self.heater_time = heater_time
 
-        print(sensor_type)
+        # Heater state, see heat_sensor()
+        self.heater_ready_time = None
+        self.cooldown_end_time = 0
+        self.last_reading = {'temperature': 0, 'humidity': 0}
+        self._buffer = bytearray(6)
 
-        if sensor_type == 'SHT41_Internal':
-            self.i2c = busio.I2C(board.SCL, board.SDA)
-            self.sensor = adafruit_sht4x.SHT4x(self.i2c, address)
+        print(sensor_type)
 
-        elif sensor_type == 'SHT41_External':
-            self.i2c = busio.I2C(board.D27, board.D22)
-            self.sensor = adafruit_sht4x.SHT4x(self.i2c, address)
+        # The driver module is only imported once a sensor of its type is created
+        device_type = devices.get_device_type(sensor_type, devices.SENSOR)
+        self.bus_name = device_type.bus_name
+        self.sensor = device_type.get_device(address)
 
-        elif sensor_type == 'SHT30':
-            self.i2c = adafruit_bitbangio.I2C(board.D27, board.D22)
-            self.sensor = adafruit_sht31d.SHT31D(self.i2c, address)
-        else:
-            raise ValueError("Invalid sensor type. Supported types: 'SHT41_Internal', 'SHT41_External', 'SHT30'")
+        self.i2c = i2c_bus.get_bus(self.bus_name)
+        self.lock = i2c_bus.bus_lock(self.bus_name)
+        if sensor_type[:5] == 'SHT41':
+            i2c_device = devices.load_driver('adafruit_bus_device.i2c_device')
+            self.device = i2c_device.I2CDevice(self.i2c, address, probe=False)
 
     def sensor_status(self):
         if self.sensor_type == 'SHT30':
-            status = self.sensor.status
+            with self.lock:
+                status = self.sensor.status
         else:
             raise ValueError("Invalid sensor type. Supported types: 'SHT30'")
         return status
 
     def sensor_mode(self):
-        mode = self.sensor.mode
+        with self.lock:
+            mode = self.sensor.mode
         # return hex(mode).upper()
         return mode
 
     def read_sensor(self):
-
+        # Holds the bus lock throughout so a heater pulse can't be started half way through a read
+        with self.lock:
+            now = clock.monotonic()
+            if self.heater_ready_time is not None:
+                if now < self.heater_ready_time:
+                    # Still heating, the sensor will not answer until the pulse is done
+                    return self._tag_reading(self.last_reading, ReadingState.HEATING)
+                return self._tag_reading(self._finish_heater(), ReadingState.HEATING)
+
+            if self.sensor_type[:5] == 'SHT41':
+                temperature, humidity = self.sensor.measurements
+            elif self.sensor_type == 'SHT30':
+                temperature = self.sensor.temperature
+                humidity = self.sensor.relative_humidity
+            else:
+                raise ValueError("Invalid sensor type. Supported types: 'SHT41', 'SHT30'")
+
+            # Format the sensor output to one decimal place
+            self.last_reading = {'temperature': round(temperature, 1), 'humidity': round(humidity, 1)}
+
+            state = ReadingState.COOLING if now < self.cooldown_end_time else ReadingState.VALID
+            return self._tag_reading(self.last_reading, state)
+
+    def heater_busy(self):
+        return self.heater_ready_time is not None
+
+    def heat_sensor(self, heater=SHT4XHeater.HIGH_HEATER_1S):
+        # Starts a heater pulse and returns straight away. finish_heater() ends it once heater_ready_time
+        # has passed, a read_sensor() after that time ends it too if nothing else has.
+        with self.lock:
+            if self.heater_busy():
+                return False
+
+            if self.sensor_type[:5] == 'SHT41':
+                command, duration = SHT4X_HEATER_COMMANDS[heater]
+                self._buffer[0] = command
+                with self.device as i2c:
+                    i2c.write(self._buffer, end=1)
+            else:
+                self.sensor.heater = True
+                duration = self.heater_time
+
+            self.heater_ready_time = clock.monotonic() + duration
+            return True
+
+    def finish_heater(self):
+        # Ends the pulse at heater_ready_time rather than on the next reading. Returns False if there was no
+        # pulse to end, or it is not done yet.
+        with self.lock:
+            if not self.heater_busy() or clock.monotonic() < self.heater_ready_time:
+                return False
+            self._finish_heater()
+            return True
+
+    def _finish_heater(self):
+        reading = self.last_reading
         if self.sensor_type[:5] == 'SHT41':
-            temperature, humidity = self.sensor.measurements
-        elif self.sensor_type == 'SHT30':
-            temperature = self.sensor.temperature
-            humidity = self.sensor.relative_humidity
+            # Collect the measurement taken at the end of the heat pulse
+            with self.device as i2c:
+                i2c.readinto(self._buffer)
+            reading = self._decode_measurement(self._buffer)
         else:
-            raise ValueError("Invalid sensor type. Supported types: 'SHT41', 'SHT30'")
-
-        # Format the sensor output to one decimal place
-        temperature = round(temperature, 1)
-        humidity = round(humidity, 1)
-
-        return {'temperature': temperature, 'humidity': humidity}
-
-    def heat_sensor(self):
-        self.sensor.heater = True
-        time.sleep(1)
-        self.sensor.heater = False
+            self.sensor.heater = False
+
+        self.heater_ready_time = None
+        self.cooldown_end_time = clock.monotonic() + self.cooldown_time
+        return reading
+
+    @staticmethod
+    def _tag_reading(reading, state):
+        return {'temperature': reading['temperature'], 'humidity': reading['humidity'], 'state': state}
+
+    @staticmethod
+    def _decode_measurement(buffer):
+        if buffer[2] != _crc8(buffer[0:2]) or buffer[5] != _crc8(buffer[3:5]):
+            raise RuntimeError("Invalid CRC calculated")
+        temperature = struct.unpack_from(">H", buffer, 0)[0]
+        humidity = struct.unpack_from(">H", buffer, 3)[0]
+        temperature = -45.0 + 175.0 * temperature / 65535.0
+        humidity = max(min(-6.0 + 125.0 * humidity / 65535.0, 100), 0)
+        return {'temperature': round(temperature, 1), 'humidity': round(humidity, 1)}
+
+
+def _crc8(buffer):
+    # CRC-8, polynomial 0x31, init 0xFF as used by the SHT4x
+    crc = 0xFF
+    for byte in buffer:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x31) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+    return crc
+
+
+class HeaterScheduler:
+    # Starts a non-blocking heater pulse on every sensor and ends each one when it is done. call_later(delay,
+    # callback) schedules the end, a Scheduler's call_later or by default a timer thread.
+    def __init__(self, sensors, heater=SHT4XHeater.HIGH_HEATER_1S, call_later=None):
+        self.sensors = sensors
+        self.heater = heater
+        self.call_later = call_later if call_later is not None else _timer_call_later
+
+    def heat_all(self):
+        # Returns the sensors whose heater was started, a sensor that is still heating is skipped
+        heated = [sensor for sensor in self.sensors if sensor.heat_sensor(self.heater)]
+        now = clock.monotonic()
+        for sensor in heated:
+            self.call_later(max(0.0, sensor.heater_ready_time - now), sensor.finish_heater)
+        return heated
+
+
+def _timer_call_later(delay, callback):
+    timer = threading.Timer(delay, callback)
+    timer.daemon = True
+    timer.start()
+    return timer
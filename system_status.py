@@ -1,169 +1,190 @@
+import os
+import json
 import time
-
-import board
-import busio
-import adafruit_sht31d
-import adafruit_sht4x
-import adafruit_character_lcd.character_lcd_i2c as character_lcd
-import adafruit_ssd1306
-from adafruit_bus_device.i2c_device import I2CDevice
-import adafruit_bitbangio
-from fan_controller import EMC2101
-
-
-class SystemStatus:
-    I2C_ADDRESS = 0x4C
-    INTERNAL_TEMP_REG = 0x00
-    EXTERNAL_TEMP_REG = 0x01
-    FAN_SPEED_REG = 0x10
-    FAN_SPEED_SET_REG = 0x11
-    STATUS_REG = 0x02
-    CONFIG_REG = 0x03
-    RESET_REG = 0x05
-
-    def __init__(self, i2c):
-        self.device = I2CDevice(i2c, self.I2C_ADDRESS)
-
-    def read_register(self, register):
-        with self.device:
-            self.device.write(bytes([register]))
-            result = bytearray(1)
-            self.device.readinto(result)
-        return result[0]
-
-    def read_status(self):
-        status = self.read_register(self.STATUS_REG)
-        status_description = []
-
-        if status & 0x01:
-            status_description.append("Internal temperature sensor fault")
-        if status & 0x02:
-            status_description.append("External temperature sensor fault")
-        if status & 0x04:
-            status_description.append("Fan speed fault")
-        if status & 0x08:
-            status_description.append("Device reset")
-
-        if not status_description:
-            status_description.append("No faults")
-
-        return ", ".join(status_description)
-
-    def read_config(self):
-        config = self.read_register(self.CONFIG_REG)
-        config_description = []
-
-        if config & 0x01:
-            config_description.append("Device enabled")
-        else:
-            config_description.append("Device disabled")
-        if config & 0x02:
-            config_description.append("Fan control enabled")
-        else:
-            config_description.append("Fan control disabled")
-        if config & 0x04:
-            config_description.append("Temperature monitoring enabled")
-        else:
-            config_description.append("Temperature monitoring disabled")
-
-        return ", ".join(config_description)
-
-
-def query_i2c_devices(installed_devices):
-    i2c = busio.I2C(board.SCL, board.SDA)
-
-    devices = {
-        "SHT30": {"address": 0x44, "status": "Not detected"},
-        "SHT41_Internal": {"address": 0x44, "status": "Not detected"},
-        "SHT41_External": {"address": 0x44, "status": "Not detected"},
-        "LCD2004": {"address": 0x27, "status": "Not detected"},
-        "LCD1602": {"address": 0x27, "status": "Not detected"},
-        "EMC2101": {"address": 0x4C, "status": "Not detected"},
-        "FAN": {"address": 0x3C, "status": "Not detected"},
-        "SSD1306": {"address": 0x3C, "status": "Not detected"}
-    }
-    overall_status = "good"
-    statuses = []
-
-    if "SHT30" in installed_devices:
-        try:
-            # The SHT30 uses a non-standard I2C interface
-            i2c = adafruit_bitbangio.I2C(board.D27, board.D22)
-            sensor = adafruit_sht31d.SHT31D(i2c, 0x44)
-            devices["SHT30"]["status"] = ("Detected, temperature: {:.2f} C,"
-                                          " humidity: {:.2f} %").format(sensor.temperature, sensor.relative_humidity)
-        except Exception as e:
-            devices["SHT30"]["status"] = f"Error: {str(e)}"
-            overall_status = "bad"
-
-    if "SHT41_Internal" in installed_devices:
-        try:
-            i2c = busio.I2C(board.SCL, board.SDA)
-            sht41 = adafruit_sht4x.SHT4x(i2c)
-            devices["SHT41_Internal"]["status"] = ("Detected, temperature: {:.2f} C,"
-                                          " humidity: {:.2f} %").format(sht41.temperature, sht41.relative_humidity)
-        except Exception as e:
-            devices["SHT41_Internal"]["status"] = f"Error: {str(e)}"
-            overall_status = "bad"
-
-    if "SHT41_External" in installed_devices:
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import partial
+
+import i2c_bus
+import devices
+
+STATUS_OK = 'ok'
+STATUS_MISSING = 'missing'
+STATUS_ERROR = 'error'
+STATUS_TIMEOUT = 'timeout'
+
+# Overall status of a self test or quick check
+OVERALL_GOOD = 'good'
+OVERALL_BAD = 'bad'
+
+DEVICE_TIMEOUT = 1.0
+
+
+def _run_check(check, device_type, present):
+    # Errors are returned rather than raised so their latency is measured here too
+    started = time.monotonic()
+    try:
+        address, detail, identity = check(device_type, present)
+    except Exception as e:
+        return None, e, None, time.monotonic() - started
+    return address, detail, identity, time.monotonic() - started
+
+
+def self_test(installed_devices, timeout=DEVICE_TIMEOUT, fan_spin_up=devices.FAN_SPIN_UP_TIME, refresh=False):
+    # Checks every installed device at once, each on its own thread, and gives each one timeout seconds
+    # (plus the spin-up time for the fan). Returns a dict with the overall status, one result dict per
+    # device and the elapsed time of each phase. refresh probes the main bus again rather than trusting
+    # the probe results cached since boot.
+    phases = {}
+    started = time.monotonic()
+    try:
+        present = i2c_bus.probe_addresses(devices.main_bus_addresses(installed_devices), refresh=refresh)
+    except OSError as e:
+        print(f"Error probing main I2C bus: {e}")
+        present = []
+    phases['probe'] = time.monotonic() - started
+
+    checks_started = time.monotonic()
+    results = []
+    futures = []
+    executor = ThreadPoolExecutor(max_workers=max(1, len(installed_devices)), thread_name_prefix='self-test')
+    # The fan is started first so its spin-up overlaps everything else
+    for device in sorted(installed_devices, key=lambda name: name != "FAN"):
+        device_type = devices.DEVICE_TYPES.get(device)
+        if device_type is None:
+            results.append({'device': device, 'address': None, 'status': STATUS_ERROR, 'latency': 0.0,
+                            'detail': "Unknown device", 'identity': None})
+            continue
+        check = device_type.probe
+        allowed = timeout
+        if device == "FAN":
+            check = partial(check, spin_up=fan_spin_up)
+            allowed += fan_spin_up
+        futures.append((device, time.monotonic(), allowed, executor.submit(_run_check, check, device_type, present)))
+
+    for device, submitted, allowed, future in futures:
+        result = {'device': device, 'address': None, 'status': STATUS_OK, 'latency': 0.0, 'detail': "",
+                  'identity': None}
         try:
-            i2c = busio.I2C(board.D27, board.D22)
-            sht41 = adafruit_sht4x.SHT4x(i2c)
-            devices["SHT41_External"]["status"] = ("Detected, temperature: {:.2f} C,"
-                                          " humidity: {:.2f} %").format(sht41.temperature, sht41.relative_humidity)
-        except Exception as e:
-            devices["SHT41_External"]["status"] = f"Error: {str(e)}"
-            overall_status = "bad"
-
-    if "LCD2004" in installed_devices:
-        try:
-            lcd2004 = character_lcd.Character_LCD_I2C(i2c, 20, 4, devices["LCD2004"]["address"])
-            devices["LCD2004"]["status"] = "Detected"
-        except Exception as e:
-            devices["LCD2004"]["status"] = f"Error: {str(e)}"
-            overall_status = "bad"
-
-    if "LCD1602" in installed_devices:
-        try:
-            lcd1602 = character_lcd.Character_LCD_I2C(i2c, 16, 2, devices["LCD1602"]["address"])
-            devices["LCD1602"]["status"] = "Detected"
-        except Exception as e:
-            devices["LCD1602"]["status"] = f"Error: {str(e)}"
-            overall_status = "bad"
-
-    if "EMC2101" in installed_devices:
-        try:
-            emc2101 = SystemStatus(i2c)
-            status = emc2101.read_status()
-            config = emc2101.read_config()
-            devices["EMC2101"]["status"] = f"Detected, Status: {status}, Config: {config}"
-        except Exception as e:
-            devices["EMC2101"]["status"] = f"Error: {str(e)}"
-            overall_status = "bad"
-
-    if "FAN" in installed_devices:
-        try:
-            fan = EMC2101()
-            fan.set_fan_speed(25)
-            time.sleep(1)
-            rpm = fan.read_fan_speed()
-            temp = fan.read_internal_temp()
-            fan.set_fan_speed(0)
-            devices["FAN"]["status"] = f"Detected, RPM: {rpm}, Internal Temp: {temp}"
-        except Exception as e:
-            devices["EMC2101"]["status"] = f"Error: {str(e)}"
-            overall_status = "bad"
-
-    if "SSD1306" in installed_devices:
+            result['address'], detail, result['identity'], result['latency'] = future.result(
+                max(0.0, submitted + allowed - time.monotonic()))
+        except FutureTimeoutError:
+            result['status'] = STATUS_TIMEOUT
+            result['latency'] = allowed
+            result['detail'] = f"no answer after {allowed:.2f}s"
+        else:
+            if isinstance(detail, Exception):
+                result['status'] = STATUS_ERROR
+                result['detail'] = str(detail)
+            elif detail is None:
+                result['status'] = STATUS_MISSING
+            else:
+                result['detail'] = detail
+        results.append(result)
+    # A check stuck in a driver call cannot be interrupted, leave its thread behind rather than wait for it
+    executor.shutdown(wait=False)
+    results.sort(key=lambda result: installed_devices.index(result['device']))
+    phases['checks'] = time.monotonic() - checks_started
+    phases['total'] = time.monotonic() - started
+
+    overall_status = OVERALL_GOOD if all(result['status'] == STATUS_OK for result in results) else OVERALL_BAD
+    return {'status': overall_status, 'devices': results, 'phases': phases}
+
+
+def inventory_from_report(report):
+    # Fingerprint of a passing self test, the address and serial number or product id of every device
+    return {'devices': {result['device']: dict(result['identity'], address=result['address'])
+                        for result in report['devices']}}
+
+
+def inventory_matches(inventory, report):
+    # Only the devices in the report are compared, so a self test of a subset can still match
+    if inventory is None or report['status'] != OVERALL_GOOD:
+        return False
+    fingerprint = inventory_from_report(report)['devices']
+    return all(inventory['devices'].get(device) == identity for device, identity in fingerprint.items())
+
+
+def load_inventory(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_inventory(path, inventory):
+    temp_file = path + '.tmp'
+    try:
+        with open(temp_file, 'w') as f:
+            json.dump(inventory, f, indent=2)
+        os.replace(temp_file, path)
+    except OSError as e:
+        print(f"Error saving device inventory: {e}")
+
+
+def clear_inventory(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _ack(device, address):
+    bus_name = devices.get_device_type(device).bus_name
+    if bus_name == i2c_bus.MAIN_BUS:
+        # Always on the bus, the cache may be from before a restart and the device gone since
+        return i2c_bus.probe(address, refresh=True)
+    try:
+        with i2c_bus.bus_lock(bus_name):
+            # I2CDevice checks for an ACK when it is constructed
+            devices.load_driver('adafruit_bus_device.i2c_device').I2CDevice(i2c_bus.get_bus(bus_name), address)
+    except ValueError:
+        return False
+    return True
+
+
+def quick_check(installed_devices, inventory):
+    # ACK check of the addresses in the last good inventory. Returns a report shaped like self_test(),
+    # or None when the installed devices are not the ones the inventory was taken from.
+    if inventory is None or sorted(inventory.get('devices', {})) != sorted(installed_devices):
+        return None
+    started = time.monotonic()
+    results = []
+    for device in installed_devices:
+        address = inventory['devices'][device]['address']
+        check_started = time.monotonic()
+        result = {'device': device, 'address': address, 'status': STATUS_OK, 'latency': 0.0,
+                  'detail': "ACK, full check pending", 'identity': None}
         try:
-            oled = adafruit_ssd1306.SSD1306_I2C(128, 64, i2c)
-            devices["SSD1306"]["status"] = "Detected"
-        except Exception as e:
-            devices["SSD1306"]["status"] = f"Error: {str(e)}"
-            overall_status = "bad"
+            if not _ack(device, address):
+                result['status'] = STATUS_MISSING
+        except OSError as e:
+            result['status'] = STATUS_ERROR
+            result['detail'] = str(e)
+        result['latency'] = time.monotonic() - check_started
+        results.append(result)
+    elapsed = time.monotonic() - started
+
+    overall_status = OVERALL_GOOD if all(result['status'] == STATUS_OK for result in results) else OVERALL_BAD
+    return {'status': overall_status, 'devices': results, 'phases': {'ack': elapsed, 'total': elapsed}}
+
+
+def format_result(result):
+    if result['status'] == STATUS_OK:
+        text = "Detected"
+        if result['address'] is not None:
+            text += f" at {hex(result['address'])}"
+        if result['detail']:
+            text += f", {result['detail']}"
+    elif result['status'] == STATUS_MISSING:
+        text = "Not detected"
+    elif result['status'] == STATUS_TIMEOUT:
+        text = f"Timed out, {result['detail']}"
+    else:
+        text = f"Error: {result['detail']}"
+    return f"{result['device']}: {text} ({result['latency'] * 1000:.0f} ms)"
 
-    for device in installed_devices:
-        statuses.append(f"{device}: {devices[device]['status']}")
 
-    return overall_status, statuses
+def query_i2c_devices(installed_devices):
+    report = self_test(installed_devices)
+    return report['status'], [format_result(result) for result in report['devices']]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# Runs dehydrator_controller.step() over random humidity walks, checks that no decision breaks the
+# hysteresis band or the minimum on/off times, and reports steps per second.
+# Run from the repository root: python3 tests/controller_bench.py [steps]
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dehydrator_controller import (step, off_threshold, FanState, ControlSettings,  # noqa: E402
+                                   FAN_START, FAN_STOP)
+
+STEPS = 1000000
+SAMPLE_INTERVAL = 10
+
+
+def random_settings(rng):
+    min_humidity = rng.uniform(30, 70)
+    return ControlSettings(min_humidity, min_humidity + rng.uniform(0.5, 20), rng.uniform(0, 10),
+                           rng.choice([0, 30, 60, 300]), rng.choice([0, 30, 60, 300]))
+
+
+def fuzz(steps, seed=1):
+    rng = random.Random(seed)
+    settings = random_settings(rng)
+    state = FanState(False, None)
+    humidity = 55.0
+    now = 0.0
+    switches = 0
+    for i in range(steps):
+        if i % 10000 == 0:
+            settings = random_settings(rng)
+        now += SAMPLE_INTERVAL
+        humidity = min(100.0, max(0.0, humidity + rng.gauss(0, 1.5)))
+        reading = None if rng.random() < 0.01 else humidity
+        previous = state
+        state, action = step(state, settings, reading, now)
+        if action is None:
+            assert state == previous
+            continue
+        switches += 1
+        assert reading is not None
+        if previous.changed_at is not None:
+            hold = settings.min_on_time if previous.fan_on else settings.min_off_time
+            assert now - previous.changed_at >= hold, "switched inside the minimum time"
+        if action == FAN_START:
+            assert reading > settings.max_humidity and not previous.fan_on
+        elif action == FAN_STOP:
+            assert reading < off_threshold(settings) and previous.fan_on
+            assert reading < settings.min_humidity and reading < settings.max_humidity - settings.hysteresis
+    return switches
+
+
+def bench(steps):
+    settings = ControlSettings(62.0, 74.0, 5.0, 60, 60)
+    state = FanState(False, None)
+    readings = [60 + 20 * ((i * 7919) % 1000) / 1000 for i in range(1000)]
+    started = time.perf_counter()
+    now = 0.0
+    for i in range(steps):
+        now += SAMPLE_INTERVAL
+        state, action = step(state, settings, readings[i % 1000], now)
+    return steps / (time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else STEPS
+    switches = fuzz(steps)
+    print(f"Fuzzed {steps} steps, {switches} fan switches, no violations")
+    print(f"step(): {bench(steps):,.0f} steps/s")
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Compares the old per-byte writes with 2ms sleeps against hd44780.PCF8574Transport in byte and block mode
+# for one full 20x4 screen. The bus is simulated: every transaction costs a fixed driver overhead plus
+# 9 SCL cycles per byte on the wire, and time.sleep only advances the simulated clock.
+# Run from the repository root: python3 tests/lcd_transport_bench.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import hd44780  # noqa: E402
+
+ADDRESS = 0x27
+BUS_SPEED = 100000
+TRANSACTION_OVERHEAD = 0.00015  # ioctl round trip, start and stop conditions
+ROW_OFFSETS = [0x00, 0x40, 0x14, 0x54]
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class SimulatedSMBus:
+    def __init__(self, clock):
+        self.clock = clock
+        self.transactions = 0
+
+    def _transfer(self, length):
+        # Address byte plus payload, 9 clocks each
+        self.transactions += 1
+        self.clock.now += TRANSACTION_OVERHEAD + (length + 1) * 9 / BUS_SPEED
+
+    def write_byte(self, address, value):
+        self._transfer(1)
+
+    def i2c_rdwr(self, *messages):
+        for message in messages:
+            self._transfer(len(message))
+
+
+class FakeMessage:
+    def __init__(self, address, data):
+        self.address = address
+        self.data = bytes(data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+def legacy_send(bus, clock, value, mode):
+    # The original send_command / send_data: four write_byte calls with a 2ms sleep while EN is high
+    for nibble in (value & 0xF0, (value << 4) & 0xF0):
+        buf = nibble | mode | 0x08
+        bus.write_byte(ADDRESS, buf)
+        clock.sleep(0.002)
+        bus.write_byte(ADDRESS, buf & 0xFB)
+
+
+def screen_items(frame):
+    items = []
+    for y, text in enumerate(frame):
+        items.append((0x80 + ROW_OFFSETS[y], False))
+        items += [(ord(character), True) for character in text]
+    return items
+
+
+def run(name, frame):
+    clock = SimulatedClock()
+    bus = SimulatedSMBus(clock)
+    if name == 'legacy':
+        for value, rs in screen_items(frame):
+            legacy_send(bus, clock, value, 0x05 if rs else 0x04)
+    else:
+        transport = hd44780.PCF8574Transport(bus, name, message=FakeMessage)
+        transport.send(ADDRESS, screen_items(frame))
+    return bus.transactions, clock.now
+
+
+if __name__ == '__main__':
+    frame = ["Internal:".center(20), "55.2% - 21.3C".center(20), "External:".center(20), "61.8% - 19.7C".center(20)]
+    legacy_transactions, legacy_time = run('legacy', frame)
+    print(f"Full screen at {BUS_SPEED // 1000}kHz, {TRANSACTION_OVERHEAD * 1e6:.0f}us per transaction")
+    for name in ('legacy', hd44780.TRANSPORT_BYTE, hd44780.TRANSPORT_BLOCK):
+        transactions, elapsed = run(name, frame)
+        print(f"{name:7s} {transactions:5d} transactions {elapsed * 1e3:8.2f} ms "
+              f"({legacy_time / elapsed:.0f}x faster than legacy)")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# Logs the same run of fan and system events through logger.Logger under the default disk budget with each
+# log_compression setting, and compares how much history fits, how long log() calls took while archives were
+# being compressed, and how long log_query takes over the oldest hour kept.
+# Run from the repository root: python3 tests/log_compression_bench.py
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import clock  # noqa: E402
+import logger  # noqa: E402
+import log_query  # noqa: E402
+from log_archive import COMPRESSIONS, NONE, open_log  # noqa: E402
+
+MAX_LOG_SIZE = 150000
+MAX_ARCHIVE_SIZE = 310001
+EVENT_INTERVAL = 300
+ROWS = 80000
+START = time.mktime((2024, 5, 1, 0, 0, 0, 0, 0, -1))
+
+
+def event(row):
+    # Roughly what a fan cycle logs, with the odd restart
+    if row % 400 == 399:
+        return 'System', '', "Shutting down..."
+    if row % 3 == 0:
+        return 'Fan', '', f"Fan started, exceeded MAX humidity of: {60 + row % 7 / 10:.1f}%"
+    if row % 3 == 1:
+        return 'Fan', '', f"Fan stopped, passed MIN humidity of: {50 + row % 5 / 10:.1f}%"
+    return 'Fan', '', f"Fan run time: 0:{row % 50 + 5:02d}:{row * 7 % 60:02d}"
+
+
+def fill(directory, compression):
+    simulated = clock.set_clock(clock.SimulatedClock(start=START))
+    log = logger.Logger(os.path.join(directory, 'log.csv'), MAX_LOG_SIZE, MAX_ARCHIVE_SIZE)
+    if compression != NONE:
+        log.start_compressor(compression)
+    latencies = []
+    for row in range(ROWS):
+        started = time.perf_counter()
+        log.log(clock.timestamp(), *event(row))
+        latencies.append(time.perf_counter() - started)
+        simulated.advance(EVENT_INTERVAL)
+    while log.compressor is not None and log.plain_archives():
+        time.sleep(0.01)
+    log.flush()
+    return log, sorted(latencies)
+
+
+def history(log):
+    oldest = max(log.archive_sizes)
+    with open_log(log.archive_name(oldest), 'rt') as f:
+        first = next(line for line in f if line[:1].isdigit())[:19]
+    return first, (START + ROWS * EVENT_INTERVAL - time.mktime(time.strptime(first, '%Y-%m-%d %H:%M:%S'))) / 86400
+
+
+def scan(log, start, end):
+    rows = 0
+    for index in [0] + sorted(log.archive_sizes):
+        with open_log(log.archive_name(index) if index else log.filename, 'rt') as f:
+            rows += sum(1 for line in f if start <= line[:19] < end)
+    return rows
+
+
+if __name__ == '__main__':
+    print(f"Budget {MAX_LOG_SIZE + MAX_ARCHIVE_SIZE} bytes, {ROWS} events {EVENT_INTERVAL}s apart")
+    for compression in COMPRESSIONS:
+        with tempfile.TemporaryDirectory() as directory:
+            started = time.perf_counter()
+            log, latencies = fill(directory, compression)
+            fill_time = time.perf_counter() - started
+            first, days = history(log)
+            disk = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+                       if not name.endswith('.index'))
+            start = log_query.parse_time(time.mktime(time.strptime(first, '%Y-%m-%d %H:%M:%S')) + 3600)
+            end = log_query.parse_time(time.mktime(time.strptime(first, '%Y-%m-%d %H:%M:%S')) + 7200)
+            query = log_query.LogQuery(log.filename, index=log.index)
+            started = time.perf_counter()
+            found = list(query.query(start, end))
+            query_time = time.perf_counter() - started
+            assert len(found) == scan(log, start, end) > 0
+            # A fresh index built from the files on disk finds the same rows
+            os.remove(log.index.index_file)
+            assert len(list(log_query.LogQuery(log.filename).query(start, end))) == len(found)
+            compressor = log.compressor.stats() if log.compressor is not None else {}
+            log.close()
+            print(f"{compression:5}: {days:6.1f} days in {len(log.archive_sizes):3} archives, {disk} bytes on disk, "
+                  f"filled in {fill_time:.1f}s, log() 99.9% {latencies[int(len(latencies) * 0.999)] * 1000:.1f}ms "
+                  f"max {latencies[-1] * 1000:.1f}ms, "
+                  f"oldest hour query {query_time * 1000:.2f}ms {compressor}")
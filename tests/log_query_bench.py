@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# Fills logs of growing size through logger.Logger on a simulated clock, then looks up one hour with log_query
+# and with a scan of every file. The indexed lookup reads the same few blocks whatever the size of the log.
+# Run from the repository root: python3 tests/log_query_bench.py
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import clock  # noqa: E402
+import logger  # noqa: E402
+import log_query  # noqa: E402
+
+START = time.mktime((2024, 5, 1, 0, 0, 0, 0, 0, -1))
+EVENT_INTERVAL = 20
+ARCHIVES = 10  # Archive budget in log files
+
+
+def fill(directory, max_log_size, rows):
+    simulated = clock.set_clock(clock.SimulatedClock(start=START))
+    log = logger.Logger(os.path.join(directory, 'log.csv'), max_log_size, max_log_size * ARCHIVES)
+    for row in range(rows):
+        log.log(clock.timestamp(), ('Fan', 'System', 'External')[row % 3], '', f"Event number {row} of the bench")
+        simulated.advance(EVENT_INTERVAL)
+    log.close()
+    return log
+
+
+def scan(filename, start, end):
+    names = [filename] + [f'{filename}.{number}' for number in range(1, logger.BACKUP_COUNT + 1)]
+    rows = []
+    for name in names:
+        if os.path.exists(name):
+            with open(name) as f:
+                rows += [line for line in f if start <= line[:19] < end]
+    return rows
+
+
+if __name__ == '__main__':
+    for max_log_size in (15000, 150000, 1500000):
+        with tempfile.TemporaryDirectory() as directory:
+            rows = max_log_size * (ARCHIVES + 1) // 50
+            log = fill(directory, max_log_size, rows)
+            end_time = START + rows * EVENT_INTERVAL
+            start, end = clock.timestamp(end_time - 7200), clock.timestamp(end_time - 3600)
+
+            query = log_query.LogQuery(log.filename, index=log.index)
+            started = time.perf_counter()
+            found = list(query.query(start, end))
+            query_time = time.perf_counter() - started
+            started = time.perf_counter()
+            scanned = scan(log.filename, start, end)
+            scan_time = time.perf_counter() - started
+            assert len(found) == len(scanned)
+            total = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+            print(f"Log {total / 1024:7.0f} KB: {len(found)} rows, query {query_time * 1000:6.2f}ms reading "
+                  f"{query.bytes_read} bytes, full scan {scan_time * 1000:7.2f}ms, index {log.index.stats()}")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Compares the per-entry cost of Logger.log with the old directory scan on every write
+# as the number of archives grows. Run from the repository root: python3 tests/logger_bench.py
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logger import Logger  # noqa: E402
+
+ENTRIES = 2000
+
+
+def old_manage_archives(filename, max_archive_size):
+    # The previous implementation, run after every entry
+    archive_files = [
+        f for f in os.listdir('.') if f.startswith(filename) and f != filename
+    ]
+    total_size = sum(os.path.getsize(f) for f in archive_files)
+
+    while total_size > max_archive_size and archive_files:
+        oldest_file = min(archive_files, key=os.path.getctime)
+        total_size -= os.path.getsize(oldest_file)
+        os.remove(oldest_file)
+        archive_files.remove(oldest_file)
+
+
+def make_archives(filename, count, size=1000):
+    for index in range(1, count + 1):
+        with open(f'{filename}.{index}', 'w') as file:
+            file.write('x' * size)
+
+
+def bench(archive_count):
+    filename = 'log.csv'
+    make_archives(filename, archive_count)
+    logger = Logger(filename, max_log_size=10 ** 9, max_archive_size=10 ** 9)
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+    start = time.perf_counter()
+    for i in range(ENTRIES):
+        logger.log(timestamp, 'Internal', '02', f"Temperature: 21.{i % 10}C, Humidity: 55.{i % 10}%")
+    new_cost = (time.perf_counter() - start) / ENTRIES
+
+    start = time.perf_counter()
+    for i in range(ENTRIES):
+        logger.log(timestamp, 'Internal', '02', f"Temperature: 21.{i % 10}C, Humidity: 55.{i % 10}%")
+        old_manage_archives(filename, 10 ** 9)
+    old_cost = (time.perf_counter() - start) / ENTRIES
+    logger.flush()
+    return new_cost, old_cost
+
+
+if __name__ == '__main__':
+    print(f"{'archives':>8} {'new us/entry':>14} {'old us/entry':>14}")
+    for archive_count in (0, 2, 5, 10):
+        with tempfile.TemporaryDirectory() as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                new_cost, old_cost = bench(archive_count)
+            finally:
+                os.chdir(cwd)
+        print(f"{archive_count:>8} {new_cost * 1e6:>14.1f} {old_cost * 1e6:>14.1f}")
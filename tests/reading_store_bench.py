@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Fills the default disk budget (max_log_size + max_archive_size) with readings, once as the CSV reading lines
+# main.py used to log and once in reading_store.ReadingStore, and compares how much history each keeps.
+# Then times appends and range reads on the store.
+# Run from the repository root: python3 tests/reading_store_bench.py
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import reading_store  # noqa: E402
+
+MAX_LOG_SIZE = 150000
+MAX_ARCHIVE_SIZE = 310001
+READING_INTERVAL = 27  # Seconds between stored readings of one sensor once the 0.2% deadband is applied
+START = time.mktime((2024, 5, 1, 0, 0, 0, 0, 0, -1))
+
+
+def reading(index):
+    return {'temperature': round(20 + (index % 50) / 10, 1), 'humidity': round(55 + (index % 97) / 10, 1)}
+
+
+def csv_line(timestamp, name, value):
+    # The row main.py logged for a reading before the store
+    sensor_id = '02' if name == 'Internal' else '01'
+    return (f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))},{name},{sensor_id},"
+            f"Temperature: {value['temperature']}C, Humidity: {value['humidity']}%\n")
+
+
+def csv_history_days():
+    # Lines are all about the same length, so the budget divided by the average is close enough
+    lines = [csv_line(START + index * READING_INTERVAL / 2, ('External', 'Internal')[index % 2], reading(index))
+             for index in range(10000)]
+    line_size = sum(len(line) for line in lines) / len(lines)
+    readings = (MAX_LOG_SIZE + MAX_ARCHIVE_SIZE) / line_size
+    return line_size, readings * READING_INTERVAL / 2 / 86400
+
+
+if __name__ == '__main__':
+    line_size, csv_days = csv_history_days()
+    with tempfile.TemporaryDirectory() as directory:
+        store = reading_store.ReadingStore(directory, MAX_LOG_SIZE, MAX_ARCHIVE_SIZE)
+        count = 200000
+        started = time.perf_counter()
+        for index in range(count):
+            store.append_reading(START + index * READING_INTERVAL / 2, ('External', 'Internal')[index % 2],
+                                 reading(index))
+        store.flush()
+        append_time = time.perf_counter() - started
+
+        store.read_range(0, 0)  # Imports NumPy
+        started = time.perf_counter()
+        everything = store.read_range()
+        read_time = time.perf_counter() - started
+        store_days = (everything['time'][-1] - everything['time'][0]) / 86400
+        last_day = everything['time'][-1] - 86400
+        started = time.perf_counter()
+        for _ in range(100):
+            day = store.read_range(last_day, sensor='Internal')
+        day_time = (time.perf_counter() - started) / 100
+        started = time.perf_counter()
+        for _ in range(100):
+            views = list(store.segment_range(last_day))
+        view_time = (time.perf_counter() - started) / 100
+
+        print(f"Budget {MAX_LOG_SIZE + MAX_ARCHIVE_SIZE} bytes, a reading every {READING_INTERVAL}s per sensor")
+        print(f"CSV lines:     {line_size:.1f} bytes per reading, {csv_days:.1f} days of history")
+        print(f"Reading store: {reading_store.RECORD.size} bytes per reading, {store_days:.1f} days of history "
+              f"({store_days / csv_days:.1f}x), {store.stats()}")
+        print(f"Append {count / append_time:,.0f} readings/s, read all {len(everything)} in {read_time * 1000:.1f}ms, "
+              f"last day of Internal ({len(day)}) in {day_time * 1000:.2f}ms, "
+              f"zero copy views of it in {view_time * 1000:.2f}ms")
+        store.close()
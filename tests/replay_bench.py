@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Writes a synthetic season of log.csv archives in the Logger's format, then times replay.py loading them
+# and sweeping a grid of setpoints. The enclosure model is the one in simulated_day_bench.py, run under the
+# config.ini setpoints, and readings are only logged when they move by more than 0.2% like main.py does.
+# Run from the repository root: python3 tests/replay_bench.py [days]
+import os
+import sys
+import math
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import replay  # noqa: E402
+from dehydrator_controller import ControlSettings  # noqa: E402
+
+DAYS = 120
+SAMPLE_INTERVAL = 10
+ROWS_PER_FILE = 50000
+START = time.mktime((2024, 5, 1, 0, 0, 0, 0, 0, -1))
+
+
+def write_season(directory, days):
+    # Fan on above 60%, off below 50%, with the humidity drifting towards 80% off and 35% on
+    lines = []
+    humidity = 60.0
+    fan_on = False
+    logged = 0.0
+    for sample in range(int(days * 86400 / SAMPLE_INTERVAL)):
+        now = START + sample * SAMPLE_INTERVAL
+        target, time_constant = (35.0, 900.0) if fan_on else (80.0 + 5 * math.sin(sample / 8640), 3600.0)
+        humidity = target + (humidity - target) * math.exp(-SAMPLE_INTERVAL / time_constant)
+        reading = round(humidity, 1)
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+        if abs(reading - logged) > 0.2:
+            lines.append(f"{timestamp},Internal,02,Temperature: 21.0C, Humidity: {reading}%")
+            logged = reading
+        if not fan_on and reading > 60:
+            fan_on = True
+            lines.append(f"{timestamp},Fan,,Fan started, exceeded MAX humidity of: 60.0%")
+        elif fan_on and reading < 50:
+            fan_on = False
+            lines.append(f"{timestamp},Fan,,Fan stopped, passed MIN humidity of: 50.0%")
+    filename = os.path.join(directory, 'log.csv')
+    chunks = [lines[i:i + ROWS_PER_FILE] for i in range(0, len(lines), ROWS_PER_FILE)]
+    for index, chunk in enumerate(chunks):
+        # Newest chunk is the live file, archives count up from there
+        name = filename if index == len(chunks) - 1 else f"{filename}.{len(chunks) - 1 - index}"
+        with open(name, 'w') as f:
+            f.write('Timestamp,Name,ID,Message\n' + '\n'.join(chunk) + '\n')
+    return filename
+
+
+if __name__ == '__main__':
+    days = float(sys.argv[1]) if len(sys.argv) > 1 else DAYS
+    with tempfile.TemporaryDirectory() as directory:
+        filename = write_season(directory, days)
+        files = replay.archive_files(filename)
+        started = time.perf_counter()
+        recording = replay.load_recording(files)
+        loaded = time.perf_counter()
+        print(f"Loaded {len(recording.times)} readings over {recording.duration() / 86400:.0f} days from "
+              f"{len(files)} files in {loaded - started:.2f}s, {recording.fan_starts} fan starts logged")
+
+        candidates = [ControlSettings(low, high, hysteresis, 60, 60)
+                      for low in (45, 50, 55) for high in (60, 65, 70) for hysteresis in (2, 5)]
+        results = [(settings, replay.replay(recording, settings, SAMPLE_INTERVAL)) for settings in candidates]
+        elapsed = time.perf_counter() - loaded
+        for settings, result in results[:3]:
+            print(replay.format_result(settings, result))
+        # Fewer than logged: a crossing that turns back inside main.py's 0.2% logging deadband never reaches the log
+        recorded = replay.replay(recording, ControlSettings(50, 60, 0, 0, 0), SAMPLE_INTERVAL)
+        print(f"Recorded setpoints replay to {recorded['starts']} starts, {recording.fan_starts} were logged")
+        print(f"Replayed {len(candidates)} candidates in {elapsed:.2f}s "
+              f"({elapsed / len(candidates) * 1000:.0f}ms each)")
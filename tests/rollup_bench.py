@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# Feeds a year of readings from both sensors, one every 30 seconds, into rollup.Rollups with the default
+# retention, then asks for trends over spans from an hour to a year and checks them against the raw readings.
+# Run from the repository root: python3 tests/rollup_bench.py
+import os
+import sys
+import math
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import clock  # noqa: E402
+import rollup  # noqa: E402
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC
+DAYS = 365
+INTERVAL = 30
+RETENTION = {rollup.MINUTE: 2, rollup.HOUR: 90, rollup.DAY: 3650}
+SPANS = (('hour', 3600), ('day', 86400), ('week', 7 * 86400), ('month', 30 * 86400), ('year', 365 * 86400))
+
+
+def humidity(timestamp):
+    # A daily swing on top of a yearly one
+    day = math.sin(timestamp / 86400 * 2 * math.pi)
+    year = math.sin(timestamp / 31536000 * 2 * math.pi)
+    return round(55 + 8 * day + 5 * year, 1)
+
+
+def temperature(timestamp):
+    return round(15 + 6 * math.sin(timestamp / 86400 * 2 * math.pi + 1), 1)
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        rollups = rollup.Rollups(directory, RETENTION)
+        end = START + DAYS * 86400
+        count = 0
+        started = time.perf_counter()
+        for timestamp in range(START, end, INTERVAL):
+            rollups.add(timestamp, 'Internal', temperature(timestamp), humidity(timestamp))
+            rollups.add(timestamp, 'External', temperature(timestamp) - 2, humidity(timestamp) + 10)
+            count += 2
+        rollups.flush()
+        feed_time = time.perf_counter() - started
+        print(f"{count:,} readings in {feed_time:.1f}s, {count / feed_time:,.0f} readings/s, {rollups.stats()}")
+        for tier in rollups.tiers:
+            print(f"  {tier.name:6} tier: {os.path.getsize(tier.path):7} bytes, {tier.capacity} buckets, "
+                  f"{tier.retention() / 86400:.0f} days")
+
+        clock.set_clock(clock.SimulatedClock(start=end))
+        # The last day, checked bucket by bucket against the raw readings
+        name, trend = rollups.trend(end - 86400, end, 'Internal', max_points=2000)
+        assert name == rollup.MINUTE and len(trend) == 1440, (name, len(trend))
+        for bucket in trend[::97]:
+            start = int(bucket['time'])
+            values = [humidity(timestamp) for timestamp in range(start, start + 60, INTERVAL)]
+            assert bucket['count'] == len(values)
+            assert abs(bucket['humidity_min'] - min(values)) < 0.006
+            assert abs(bucket['humidity_max'] - max(values)) < 0.006
+            assert abs(bucket['humidity_mean'] - sum(values) / len(values)) < 0.006
+
+        # A restart in the middle of a bucket picks up where it left off
+        rollups.close()
+        rollups = rollup.Rollups(directory, RETENTION)
+        for timestamp in range(end, end + 30, INTERVAL // 3):
+            rollups.add(timestamp, 'Internal', temperature(timestamp), humidity(timestamp))
+        rollups.close()
+        rollups = rollup.Rollups(directory, RETENTION)
+        for timestamp in range(end + 30, end + 60, INTERVAL // 3):
+            rollups.add(timestamp, 'Internal', temperature(timestamp), humidity(timestamp))
+        rollups.flush()
+        minute = rollups.tiers[0].read(end, end + 60, rollup.SENSOR_IDS['Internal'])
+        assert len(minute) == 1 and minute['count'][0] == 6, minute
+
+        for span_name, span in SPANS:
+            rollups.trend(end - span, end, 'Internal')
+            started = time.perf_counter()
+            for _ in range(20):
+                name, trend = rollups.trend(end - span, end, 'Internal')
+            query_time = (time.perf_counter() - started) / 20
+            print(f"Last {span_name:5}: {name:6} tier, {len(trend):4} buckets, {query_time * 1000:.2f}ms, "
+                  f"humidity {trend['humidity_min'].min():.1f} to {trend['humidity_max'].max():.1f}%")
+        rollups.close()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Runs a day of the control loop on clock.SimulatedClock: the Scheduler, a Sensor with heater cycles,
+# HeaterScheduler, DehydratorController and HumidityController's run time accounting. Only the drivers are
+# fake: an SHT30 reading a simple enclosure model and an EMC2101 that just remembers its speed.
+# Run from the repository root: python3 tests/simulated_day_bench.py [hours]
+import os
+import sys
+import math
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import clock  # noqa: E402
+import devices  # noqa: E402
+import i2c_bus  # noqa: E402
+import humidity_controller  # noqa: E402
+from scheduler import Scheduler  # noqa: E402
+from sensor import Sensor, HeaterScheduler, ReadingState, heater_cooldown_time  # noqa: E402
+from dehydrator_controller import DehydratorController, ControlSettings  # noqa: E402
+
+HOURS = 24
+SENSOR_INTERVAL = 10
+HEAT_INTERVAL = 90
+HEATER_TIME = 2
+AMBIENT_HUMIDITY = 80.0  # The enclosure creeps towards this with the fan off
+DRY_HUMIDITY = 35.0  # and towards this with it on
+LEAK_TIME_CONSTANT = 3600.0
+DRY_TIME_CONSTANT = 900.0
+
+
+class FakeEMC2101:
+    def __init__(self, *args):
+        self.speed = 0
+
+    def set_fan_speed(self, speed):
+        self.speed = speed
+
+
+class Enclosure:
+    def __init__(self, humidity=60.0):
+        self.humidity = humidity
+        self.fan = None
+        self.updated = clock.monotonic()
+
+    def update(self):
+        now = clock.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        if self.fan is not None and self.fan.emc2101.speed > 0:
+            target, time_constant = DRY_HUMIDITY, DRY_TIME_CONSTANT
+        else:
+            target, time_constant = AMBIENT_HUMIDITY, LEAK_TIME_CONSTANT
+        self.humidity = target + (self.humidity - target) * math.exp(-elapsed / time_constant)
+
+
+class FakeSHT31D:
+    # Swings 5C over the day so the readings are not constant
+    def __init__(self, enclosure):
+        self.enclosure = enclosure
+        self.heater_on_since = None
+        self.heater_pulses = []
+
+    @property
+    def heater(self):
+        return self.heater_on_since is not None
+
+    @heater.setter
+    def heater(self, on):
+        # Keeps how long each pulse left the heater on
+        if on:
+            self.heater_on_since = clock.monotonic()
+        elif self.heater_on_since is not None:
+            self.heater_pulses.append(clock.monotonic() - self.heater_on_since)
+            self.heater_on_since = None
+
+    @property
+    def temperature(self):
+        return 20 + 5 * math.sin(clock.monotonic() / 86400 * 2 * math.pi)
+
+    @property
+    def relative_humidity(self):
+        self.enclosure.update()
+        return self.enclosure.humidity
+
+    @property
+    def mode(self):
+        return 'Single'
+
+
+def run(hours):
+    simulated = clock.set_clock(clock.SimulatedClock())
+    enclosure = Enclosure()
+    i2c_bus._open_bus = lambda name: None
+    sht31d = FakeSHT31D(enclosure)
+    devices.register(devices.DeviceType('SHT30', devices.SENSOR, '__main__', i2c_bus.BITBANG_BUS, (0x44,), None,
+                                        lambda module, i2c, address: sht31d))
+
+    fan = humidity_controller.HumidityController(FakeEMC2101())
+    enclosure.fan = fan
+    dehydrator = DehydratorController(ControlSettings(50.0, 60.0, 5.0, 60, 60), fan=fan)
+    sensor = Sensor('SHT30', 0x44, cooldown_time=heater_cooldown_time(SENSOR_INTERVAL), heater_time=HEATER_TIME)
+    states = {state: 0 for state in ReadingState}
+    run_times = []
+
+    def sample():
+        reading = sensor.read_sensor()
+        states[reading['state']] += 1
+        if reading['state'] == ReadingState.VALID and dehydrator.step(reading['humidity'], clock.monotonic()):
+            if not dehydrator.fan_on():
+                run_times.append(dehydrator.run_time())
+
+    # The same jobs as main.py, heater pulses are ended by one-shot jobs
+    scheduler = Scheduler()
+    heaters = HeaterScheduler([sensor], call_later=scheduler.call_later)
+    scheduler.add_job('sample', SENSOR_INTERVAL, sample)
+    scheduler.add_job('heat', HEAT_INTERVAL, heaters.heat_all, start_delay=SENSOR_INTERVAL)
+    scheduler.call_later(hours * 3600, scheduler.stop)
+
+    started = time.perf_counter()
+    scheduler.run_forever()
+    elapsed = time.perf_counter() - started
+
+    stats = dehydrator.stats()
+    duty_cycle = fan.fan_engaged_time / simulated.monotonic()
+    assert abs(sum(run_times) - fan.fan_engaged_time) < 1e-6, "fan run time accounting disagrees"
+    assert all(abs(pulse - HEATER_TIME) < 1e-6 for pulse in sht31d.heater_pulses), "heater left on too long"
+    print(f"Simulated {simulated.monotonic() / 3600:.1f}h in {elapsed:.2f}s "
+          f"({simulated.monotonic() / elapsed:,.0f}x real time, {simulated.sleep_count} scheduler sleeps)")
+    print(f"Readings: {', '.join(f'{state.value} {count}' for state, count in states.items())}")
+    print(f"Fan: {stats['starts']} starts, {stats['stops']} stops, duty cycle {duty_cycle:.1%}, "
+          f"longest run {max(run_times, default=0) / 60:.1f} min")
+    print(f"Heater: {len(sht31d.heater_pulses)} pulses, longest {max(sht31d.heater_pulses, default=0):.1f}s")
+    for line in scheduler.report():
+        print(line)
+
+
+if __name__ == '__main__':
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else HOURS)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# Compares display.pack_image with the per-pixel packing done by adafruit_ssd1306 SSD1306.image()
+# on a typical four line frame. Run from the repository root: python3 tests/ssd1306_pack_bench.py
+import os
+import sys
+import time
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from display import pack_image  # noqa: E402
+
+WIDTH = 128
+HEIGHT = 64
+RUNS = 200
+
+
+def stock_pack(image, buffer):
+    # Same steps as SSD1306.image(): clear the buffer, then set one bit per lit pixel through pixel()
+    pixels = image.load()
+    for i in range(len(buffer)):
+        buffer[i] = 0
+    for y in range(HEIGHT):
+        for x in range(WIDTH):
+            if pixels[(x, y)]:
+                index = (y >> 3) * WIDTH + x
+                buffer[index] |= 1 << (y & 7)
+
+
+def make_frame():
+    image = Image.new('1', (WIDTH, HEIGHT))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    for i, text in enumerate(["Internal:", "55.2% - 21.3°C", "External:", "61.8% - 19.7°C"]):
+        draw.text((0, i * 16 + 2), text, font=font, fill=255)
+    return image
+
+
+def bench(pack, image, buffer):
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        pack(image, buffer)
+    return (time.perf_counter() - start) / RUNS
+
+
+if __name__ == '__main__':
+    image = make_frame()
+    stock_buffer = bytearray(WIDTH * HEIGHT // 8)
+    fast_buffer = bytearray(WIDTH * HEIGHT // 8)
+    stock = bench(stock_pack, image, stock_buffer)
+    fast = bench(pack_image, image, fast_buffer)
+    print(f"Buffers match: {stock_buffer == fast_buffer}")
+    print(f"stock image(): {stock * 1e3:8.3f} ms/frame")
+    print(f"pack_image():  {fast * 1e3:8.3f} ms/frame ({stock / fast:.0f}x faster)")
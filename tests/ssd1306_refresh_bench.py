@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Counts the bytes display.SSD1306Display puts on the I2C bus for each frame while main.py's refresh_display
+# changes one reading line at a time, against what the stock full-frame show() sends. The panel is a fake
+# driver that only counts the bytes written to it, the address byte of each transaction included.
+# Run from the repository root: python3 tests/ssd1306_refresh_bench.py
+import os
+import sys
+import math
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import i2c_bus  # noqa: E402
+
+FRAMES = 200
+
+
+class FakeI2CDevice:
+    def __init__(self):
+        self.bytes_written = 0
+        self.transactions = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def write(self, buffer):
+        self.transactions += 1
+        self.bytes_written += len(buffer) + 1
+
+
+class FakeSSD1306:
+    # Just the parts of adafruit_ssd1306.SSD1306_I2C that SSD1306Display uses
+    def __init__(self, width, height, i2c, addr=0x3C):
+        self.i2c_device = FakeI2CDevice()
+        self.buffer = bytearray(width * height // 8 + 1)
+        self.buffer[0] = 0x40
+
+    def fill(self, value):
+        for i in range(1, len(self.buffer)):
+            self.buffer[i] = 0xFF if value else 0
+
+
+sys.modules['adafruit_ssd1306'] = types.SimpleNamespace(SSD1306_I2C=FakeSSD1306)
+import display  # noqa: E402
+
+
+def reading(frame, phase):
+    # Readings that drift by a tenth or so between frames, like the sensors between refreshes
+    humidity = 55 + 5 * math.sin(frame / 40 + phase)
+    temperature = 20 + 2 * math.sin(frame / 90 + phase)
+    return f"{humidity:.1f}% - {temperature:.1f}°C"
+
+
+if __name__ == '__main__':
+    i2c_bus._open_bus = lambda name: None
+    ssd1306 = display.SSD1306Display(display.DisplayConfig())
+    device = ssd1306.disp.i2c_device
+    ssd1306.display_default_four_rows()
+    first = device.bytes_written
+    sent = []
+    for frame in range(FRAMES):
+        # What refresh_display does: only a line whose text changed is redrawn, each redraw is one frame
+        for line_number, phase in ((1, 0), (3, 1)):
+            text = reading(frame, phase)
+            if ssd1306.lines[line_number] == text:
+                continue
+            before = device.bytes_written
+            ssd1306.update_line(line_number, justification='left', text=text)
+            assert device.bytes_written - before == ssd1306.last_frame_bytes, "byte counter disagrees with the bus"
+            sent.append(device.bytes_written - before)
+    full = ssd1306.full_frame_bytes
+    sent.sort()
+    print(f"First frame {first} bytes, stock show() {full} bytes every frame")
+    print(f"{len(sent)} line updates: mean {sum(sent) / len(sent):.0f} bytes, median {sent[len(sent) // 2]}, "
+          f"max {sent[-1]} ({sum(sent) / len(sent) / full:.1%} of a full frame)")
+    print(f"refresh_stats(): {ssd1306.refresh_stats()}")